@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A stress test of concurrent writers to :class:`.ContainedStorage`
+objects, measuring how often they conflict.
+
+Several workers add, get and delete contained objects in a shared
+database for a fixed time, retrying transactions that raise
+``ConflictError`` (with randomized exponential backoff). By default the
+workers are threads sharing one ``FileStorage``; with ``--processes``
+they are processes connected to a ZEO server started locally; ZEO is
+not a dependency of this package, so install the ``benchmarks`` extra
+(or ZEO itself) to use it.
+
+The report gives the throughput, the conflict rate (the fraction of
+commit attempts that conflicted), the number of operations that failed
+after exhausting their retries, and the latency of all operations and
+of those that had to be retried.
+
+Few storages and containers (``--storages 1 --containers 1``) make
+every worker write the same records; many spread them out. Comparing
+runs with different ``--container-type`` values, or before and after
+changing how the storage records modification times, shows their
+effect on conflicts::
+
+    python benchmarks/bm_conflicts.py --workers 8 --duration 10
+    python benchmarks/bm_conflicts.py --container-type btree
+    python benchmarks/bm_conflicts.py --processes --workers 4 --json
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+import importlib
+import multiprocessing
+
+import transaction
+
+from BTrees.OOBTree import OOBTree
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.POSException import ConflictError
+
+from nti.containers.containers import CheckingLastModifiedBTreeContainer
+
+from nti.coremetadata.mixins import ZContainedMixin
+
+from nti.datastructures.containers import SmallLastModifiedBTreeContainer
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.dublincore.datastructures import PersistentCreatedModDateTrackingObject
+
+CONTAINER_TYPES = {
+    'small': SmallLastModifiedBTreeContainer,
+    'btree': CheckingLastModifiedBTreeContainer,
+}
+
+OPERATIONS = ('add', 'get', 'delete')
+
+
+def _container_type(name):
+    if name in CONTAINER_TYPES:
+        return CONTAINER_TYPES[name]
+    module, _, attr = name.rpartition('.')
+    return getattr(importlib.import_module(module), attr)
+
+
+class Contained(ZContainedMixin, PersistentCreatedModDateTrackingObject):
+    """
+    A small persistent object, like the ones storages usually hold.
+    """
+
+
+def _container_id(i):
+    return u'container-%d' % i
+
+
+def _new_object(containerId, name):
+    obj = Contained()
+    obj.containerId = containerId
+    obj.id = name
+    return obj
+
+
+def populate(db, config):
+    """
+    Create the storages and their initial objects.
+    """
+    conn = db.open()
+    try:
+        root = conn.root()
+        storages = root['storages'] = OOBTree()
+        container_type = _container_type(config['container_type'])
+        for i in range(config['storages']):
+            storage = storages[i] = ContainedStorage(containerType=container_type)
+            for c in range(config['containers']):
+                for n in range(config['initial']):
+                    storage.addContainedObject(_new_object(_container_id(c),
+                                                           u'initial-%d' % n))
+        transaction.commit()
+    finally:
+        conn.close()
+
+
+def _random_key(container, rng):
+    if not container:
+        return None
+    keys = container.keys()
+    return keys[rng.randrange(len(keys))]
+
+
+def _operate(storage, op, containerId, rng, name):
+    if op == 'add':
+        storage.addContainedObject(_new_object(containerId, name))
+        return
+    container = storage.getContainer(containerId)
+    key = _random_key(container, rng) if container is not None else None
+    if key is None:
+        return
+    if op == 'get':
+        storage.getContainedObject(containerId, key)
+    else:
+        storage.deleteContainedObject(containerId, key)
+
+
+def run_worker(db, config, seed):
+    """
+    Perform operations until the deadline, returning the statistics.
+    """
+    rng = random.Random(seed)
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    weights = [config['mix'][op] for op in OPERATIONS]
+    stats = {'ops': dict((op, 0) for op in OPERATIONS),
+             'commits': 0, 'conflicts': 0, 'failures': 0,
+             'latencies': [], 'retry_latencies': []}
+    names = itertools.count()
+    deadline = time.time() + config['duration']
+    try:
+        while time.time() < deadline:
+            op = _choose(rng, weights)
+            storage_id = rng.randrange(config['storages'])
+            containerId = _container_id(rng.randrange(config['containers']))
+            start = time.time()
+            first_conflict = None
+            for attempt in range(config['retries'] + 1):
+                try:
+                    tm.begin()
+                    storage = conn.root()['storages'][storage_id]
+                    # Unique across workers and attempts
+                    name = u'%s-%s' % (seed, next(names))
+                    _operate(storage, op, containerId, rng, name)
+                    tm.commit()
+                except ConflictError:
+                    tm.abort()
+                    stats['conflicts'] += 1
+                    if first_conflict is None:
+                        first_conflict = time.time()
+                    time.sleep(rng.uniform(0, config['backoff'] * 2 ** attempt))
+                else:
+                    end = time.time()
+                    stats['commits'] += 1
+                    stats['ops'][op] += 1
+                    stats['latencies'].append(end - start)
+                    if first_conflict is not None:
+                        stats['retry_latencies'].append(end - first_conflict)
+                    break
+            else:
+                stats['failures'] += 1
+            conn.cacheGC()
+    finally:
+        tm.abort()
+        conn.close()
+    return stats
+
+
+def _choose(rng, weights):
+    point = rng.uniform(0, sum(weights))
+    for op, weight in zip(OPERATIONS, weights):
+        point -= weight
+        if point <= 0:
+            return op
+    return OPERATIONS[-1]
+
+
+def _run_process(args):
+    import ZEO
+    addr, config, seed = args
+    db = ZEO.DB(addr)
+    try:
+        return run_worker(db, config, seed)
+    finally:
+        db.close()
+
+
+def run_threads(path, config):
+    db = DB(FileStorage(path))
+    try:
+        populate(db, config)
+        results = [None] * config['workers']
+
+        def target(i):
+            results[i] = run_worker(db, config, config['seed'] + i)
+        threads = [threading.Thread(target=target, args=(i,))
+                   for i in range(config['workers'])]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if None in results:
+            raise RuntimeError("A worker failed")
+        return results, time.time() - start
+    finally:
+        db.close()
+
+
+def run_processes(path, config):
+    import ZEO
+    addr, stop = ZEO.server(path)
+    try:
+        db = ZEO.DB(addr)
+        try:
+            populate(db, config)
+        finally:
+            db.close()
+        context = getattr(multiprocessing, 'get_context', None)
+        pool = context('spawn').Pool(config['workers']) if context \
+            else multiprocessing.Pool(config['workers'])
+        try:
+            tasks = [(addr, config, config['seed'] + i)
+                     for i in range(config['workers'])]
+            start = time.time()
+            results = pool.map(_run_process, tasks)
+            return results, time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        stop()
+
+
+def _percentiles(values):
+    values = sorted(values)
+    result = {}
+    for p in (50, 90, 99):
+        value = values[max(0, -(-len(values) * p // 100) - 1)] if values else 0
+        result['p%d_ms' % p] = round(value * 1000, 3)
+    return result
+
+
+def summarize(results, config, elapsed):
+    ops = dict((op, sum(r['ops'][op] for r in results)) for op in OPERATIONS)
+    commits = sum(r['commits'] for r in results)
+    conflicts = sum(r['conflicts'] for r in results)
+    attempts = commits + conflicts
+    return {
+        'config': config,
+        'elapsed': round(elapsed, 3),
+        'ops': ops,
+        'throughput': round(commits / elapsed, 2),
+        'commits': commits,
+        'conflicts': conflicts,
+        'conflict_rate': round(conflicts / attempts, 4) if attempts else 0,
+        'failures': sum(r['failures'] for r in results),
+        'retried': sum(len(r['retry_latencies']) for r in results),
+        'latency': _percentiles([l for r in results for l in r['latencies']]),
+        'retry_latency': _percentiles([l for r in results
+                                       for l in r['retry_latencies']]),
+    }
+
+
+def _mix(value):
+    weights = [float(w) for w in value.split(',')]
+    if len(weights) != len(OPERATIONS) or sum(weights) <= 0:
+        raise argparse.ArgumentTypeError('expected three weights: add,get,delete')
+    return dict(zip(OPERATIONS, weights))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure conflicts between concurrent writers.")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--processes', action='store_true',
+                        help="Use processes and a local ZEO server instead of threads")
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help="Seconds to run for (default: %(default)s)")
+    parser.add_argument('--storages', type=int, default=1)
+    parser.add_argument('--containers', type=int, default=4,
+                        help="Containers per storage (default: %(default)s)")
+    parser.add_argument('--initial', type=int, default=10,
+                        help="Objects per container to start with (default: %(default)s)")
+    parser.add_argument('--mix', type=_mix, default='4,4,2',
+                        help="Relative weights of add,get,delete (default: 4,4,2)")
+    parser.add_argument('--container-type', default='small',
+                        help="small, btree, or a dotted name (default: %(default)s)")
+    parser.add_argument('--retries', type=int, default=10)
+    parser.add_argument('--backoff', type=float, default=0.001,
+                        help="Base retry delay in seconds (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    config = dict((name, getattr(args, name))
+                  for name in ('workers', 'duration', 'storages', 'containers',
+                               'initial', 'mix', 'container_type', 'retries',
+                               'backoff', 'seed'))
+    config['mode'] = 'processes' if args.processes else 'threads'
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'Data.fs')
+        run = run_processes if args.processes else run_threads
+        results, elapsed = run(path, config)
+        summary = summarize(results, config, elapsed)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print('%(mode)s: %(workers)d workers, %(storages)d storages, '
+              '%(containers)d containers each, %(container_type)s' % config)
+        print('throughput:     %.1f commits/s' % summary['throughput'])
+        print('operations:     %s' % ', '.join('%s %d' % (op, summary['ops'][op])
+                                                for op in OPERATIONS))
+        print('conflict rate:  %.2f%% (%d conflicts, %d operations retried, '
+              '%d failed)' % (summary['conflict_rate'] * 100, summary['conflicts'],
+                              summary['retried'], summary['failures']))
+        print('latency:        %s' % summary['latency'])
+        print('retry latency:  %s' % summary['retry_latency'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the externalization components that
+``nti.datastructures`` registers globally: the
+:class:`~nti.datastructures.decorators.LinkDecorator`, which runs for
+every externalized mapping, and the
+:class:`~nti.datastructures.adapters.LinkNonExternalizableReplacer`.
+
+Lists of 1 to 10,000 objects, plain, with ``links`` and with
+enclosures, are externalized with the components registered and
+again without them; the difference is what the components cost. For
+each case we report, per object, the time and (on Python 3) the
+memory blocks retained by the result and the peak memory used.
+Because absolute times depend on the machine, regressions are judged
+by the time overhead *relative* to externalizing without the
+components, and by the memory use, which don't.
+
+Run from a checkout with the package installed::
+
+    python benchmarks/bm_decorators.py                  # report
+    python benchmarks/bm_decorators.py --save-baseline  # record
+    python benchmarks/bm_decorators.py --check          # compare
+
+``--check`` exits with a non-zero status if any case is more than
+``--tolerance`` worse than the baseline in
+``benchmarks/decorators_baseline.json``. Record the baseline (and
+commit it) on the machine that will run the checks. The baseline
+records how many times each case was run (``--repeat``); checks run
+them the same number of times unless told otherwise. Fewer runs are
+faster but noisier, and may need a larger tolerance.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import gc
+import json
+import timeit
+import argparse
+import contextlib
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from zope import component
+from zope import interface
+
+from zope.configuration import xmlconfig
+
+from zope.location.interfaces import IRoot
+
+import nti.datastructures
+
+from nti.datastructures.adapters import LinkNonExternalizableReplacer
+
+from nti.datastructures.decorators import LinkDecorator
+
+from nti.externalization.datastructures import ExternalizableInstanceDict
+
+from nti.externalization.externalization import toExternalObject
+
+from nti.externalization.interfaces import IExternalMappingDecorator
+from nti.externalization.interfaces import INonExternalizableReplacer
+
+from nti.links.interfaces import ILink
+
+from nti.links.links import Link
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'decorators_baseline.json')
+
+SIZES = (1, 10, 100, 1000, 10000)
+
+KINDS = ('plain', 'links', 'enclosures')
+
+#: The default number of interleaved runs of each case.
+REPEAT = 11
+
+#: Absolute slack for the memory checks, per object, so that small
+#: cases don't fail on noise.
+BLOCK_SLACK = 1
+PEAK_SLACK = 256
+
+
+@interface.implementer(IRoot)
+class Root(object):
+    __name__ = ''
+    __parent__ = None
+
+
+class Enclosure(object):
+
+    def __init__(self, parent, name):
+        self.__parent__ = parent
+        self.__name__ = name
+
+
+class Item(ExternalizableInstanceDict):
+    """
+    A typical small object, externalized from its attributes.
+    """
+
+    __external_class_name__ = 'Item'
+
+    def __init__(self, root, name, kind):
+        super(Item, self).__init__()
+        self.__name__ = name
+        self.__parent__ = root
+        self.title = u'Title of %s' % name
+        self.tags = [u'a', u'b', u'c']
+        if kind == 'links':
+            self.links = [Link(u'/dataserver2/Objects/%s' % name, rel='edit'),
+                          Link(u'/dataserver2/Objects/%s/likes' % name, rel='like')]
+        self._enclosures = ()
+        if kind == 'enclosures':
+            self._enclosures = tuple(Enclosure(self, u'%s-%s' % (name, i))
+                                     for i in range(2))
+
+    def iterenclosures(self):
+        return iter(self._enclosures)
+
+
+def make_items(kind, size):
+    root = Root()
+    return [Item(root, u'item-%d' % i, kind) for i in range(size)]
+
+
+_REGISTRATIONS = (
+    ('SubscriptionAdapter', LinkDecorator, (object,), IExternalMappingDecorator),
+    ('Adapter', LinkNonExternalizableReplacer, (ILink,), INonExternalizableReplacer),
+)
+
+
+@contextlib.contextmanager
+def components_removed():
+    """
+    Remove the global registrations of the components for the
+    duration of the block.
+    """
+    gsm = component.getGlobalSiteManager()
+    for kind, factory, required, provided in _REGISTRATIONS:
+        getattr(gsm, 'unregister' + kind)(factory, required, provided)
+    try:
+        yield
+    finally:
+        for kind, factory, required, provided in _REGISTRATIONS:
+            getattr(gsm, 'register' + kind)(factory, required, provided)
+
+
+def _time(items, number):
+    timer = timeit.Timer(lambda: toExternalObject(items))
+    return timer.timeit(number) / number
+
+
+def _memory(items):
+    """
+    Return the number of memory blocks retained by the externalized
+    form of *items*, and the peak memory used to produce it, in bytes.
+    """
+    if tracemalloc is None:
+        return None, None
+    toExternalObject(items)  # warm up caches
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = toExternalObject(items)
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    stats = after.compare_to(before, 'filename')
+    return sum(max(0, s.count_diff) for s in stats), peak
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def measure(kind, size, repeat=REPEAT):
+    """
+    Return the measurements for externalizing *size* objects of *kind*.
+
+    The runs with and without the components are interleaved *repeat*
+    times. The times are the best of each, and the overhead ratio is
+    the median of the ratios of each pair of runs, to reduce the
+    effect of noise.
+    """
+    items = make_items(kind, size)
+    number = max(1, 2000 // size)
+    time_without = time_with = float('inf')
+    ratios = []
+    for _ in range(repeat):
+        with components_removed():
+            without = _time(items, number)
+        with_ = _time(items, number)
+        ratios.append((with_ - without) / without)
+        time_without = min(time_without, without)
+        time_with = min(time_with, with_)
+    with components_removed():
+        blocks_without, peak_without = _memory(items)
+    blocks_with, peak_with = _memory(items)
+    result = {
+        'kind': kind,
+        'size': size,
+        'seconds_per_object': time_with / size,
+        'overhead_seconds_per_object': (time_with - time_without) / size,
+        'overhead_ratio': _median(ratios),
+        'repeat': repeat,
+        'overhead_blocks_per_object': None,
+        'overhead_peak_bytes_per_object': None,
+    }
+    if blocks_with is not None:
+        result['overhead_blocks_per_object'] = (blocks_with - blocks_without) / size
+        result['overhead_peak_bytes_per_object'] = (peak_with - peak_without) / size
+    return result
+
+
+def run(kinds=KINDS, sizes=SIZES, repeat=REPEAT):
+    return [measure(kind, size, repeat) for kind in kinds for size in sizes]
+
+
+def _key(result):
+    return '%s-%s' % (result['kind'], result['size'])
+
+
+def check(results, baseline, tolerance):
+    """
+    Compare *results* to *baseline*, returning a list of descriptions
+    of the regressions.
+    """
+    failures = []
+    for result in results:
+        base = baseline.get(_key(result))
+        if base is None:
+            continue
+        ratio = result['overhead_ratio']
+        allowed = base['overhead_ratio'] * (1 + tolerance) + tolerance
+        if ratio > allowed:
+            failures.append('%s: time overhead %.1f%% > %.1f%% allowed'
+                            % (_key(result), ratio * 100, allowed * 100))
+        for name, slack in (('overhead_blocks_per_object', BLOCK_SLACK),
+                            ('overhead_peak_bytes_per_object', PEAK_SLACK)):
+            value = result[name]
+            base_value = base.get(name)
+            if value is None or base_value is None:
+                continue
+            allowed = max(base_value, 0) * (1 + tolerance) + slack
+            if value > allowed:
+                failures.append('%s: %s %.2f > %.2f allowed'
+                                % (_key(result), name, value, allowed))
+    return failures
+
+
+def _report(results):
+    print('%-18s %12s %12s %10s %10s %12s' % ('case', 'us/object', 'overhead us',
+                                              'overhead', 'blocks/obj',
+                                              'peak B/obj'))
+    for r in results:
+        blocks = r['overhead_blocks_per_object']
+        peak = r['overhead_peak_bytes_per_object']
+        print('%-18s %12.2f %12.2f %9.1f%% %10s %12s'
+              % (_key(r),
+                 r['seconds_per_object'] * 1e6,
+                 r['overhead_seconds_per_object'] * 1e6,
+                 r['overhead_ratio'] * 100,
+                 '-' if blocks is None else '%.2f' % blocks,
+                 '-' if peak is None else '%.0f' % peak))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the link decorator and replacer.")
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="The baseline file (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Save the results as the new baseline")
+    parser.add_argument('--check', action='store_true',
+                        help="Fail if the results are worse than the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="The allowed relative regression (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=None,
+                        help="The number of runs of each case (default: as many "
+                        "as the baseline used when checking, otherwise %d)" % REPEAT)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=KINDS)
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print('No baseline at %s; record one with --save-baseline'
+                  % args.baseline, file=sys.stderr)
+            return 2
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    repeat = args.repeat
+    if repeat is None:
+        repeat = REPEAT
+        if baseline:
+            repeat = max(r.get('repeat', REPEAT) for r in baseline.values())
+
+    xmlconfig.file('configure.zcml', package=nti.datastructures)
+    results = run(args.kinds, args.sizes, repeat)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        _report(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(dict((_key(r), r) for r in results), f,
+                      indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved baseline to', args.baseline)
+
+    if baseline is not None:
+        failures = check(results, baseline, args.tolerance)
+        for failure in failures:
+            print('REGRESSION', failure, file=sys.stderr)
+        if failures:
+            return 1
+        print('No regressions against', args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
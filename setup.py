@@ -4,6 +4,8 @@ from setuptools import find_packages
 
 entry_points = {
     'console_scripts': [
+        'nti_datastructures_footprint = nti.datastructures.footprint:main',
+        'nti_datastructures_keyindex = nti.datastructures.keyindex:main',
     ],
 }
 
@@ -68,17 +70,22 @@ setup(
         'nti.ntiids',
         'nti.zodb',
         'persistent',
+        'transaction',
         'ZODB',
         'zope.component',
         'zope.container',
         'zope.deferredimport',
         'zope.interface',
         'zope.keyreference',
+        'zope.lifecycleevent',
         'zope.location',
         'zope.security',
     ],
     extras_require={
         'test': TESTS_REQUIRE,
+        'benchmarks': [
+            'ZEO',
+        ],
         'docs': [
             'Sphinx',
             'repoze.sphinx.autointerface',
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the tools that walk the objects of a
+:class:`.ContainedStorage` (exporting, scanning, indexing and so on).
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import six
+
+from ZODB.utils import p64
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def deactivate(obj):
+    """
+    Turn *obj* into a ghost to free its memory, if it is saved and
+    unchanged; anything else would lose data or do nothing.
+    """
+    if getattr(obj, '_p_changed', None) is False:
+        obj._p_deactivate()
+
+
+def as_oid(oid):
+    """
+    Return *oid*, given as bytes or as an integer, as bytes.
+    """
+    return p64(oid) if isinstance(oid, six.integer_types) else oid
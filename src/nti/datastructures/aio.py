@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reading from a :class:`.ContainedStorage` in :mod:`asyncio` code.
+
+ZODB is not asynchronous, so every read blocks. The
+:class:`AsyncContainedStorageReader` performs reads on a bounded pool of
+threads, each with its own connection from a shared :class:`~ZODB.DB`,
+and hands back awaitable results. Because persistent objects belong to
+the connection (and thread) that loaded them, the results are plain
+snapshots of the objects (by default, their external form), never the
+persistent objects themselves.
+
+This module requires Python 3.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import asyncio
+import threading
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+import transaction
+
+from nti.datastructures._util import as_oid
+
+from nti.datastructures.datastructures import keys_from
+
+from nti.externalization.externalization import toExternalObject
+
+logger = __import__('logging').getLogger(__name__)
+
+_marker = object()
+
+
+def _get_loop():
+    # The loop running the coroutine that called us. Python 3.6 has
+    # no get_running_loop, and callers outside of a coroutine
+    # get futures for the current loop, to await later.
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        return asyncio.get_event_loop()
+
+
+class AsyncContainedStorageReader(object):
+    """
+    An asyncio facade for the read methods of one
+    :class:`.ContainedStorage`.
+
+    Each method call is performed in its own (read-only) transaction,
+    so it sees the most recently committed data.
+    """
+
+    def __init__(self, db, oid, max_workers=4, snapshot=toExternalObject):
+        """
+        :param db: The :class:`ZODB.DB` holding the storage.
+        :param oid: The OID of the storage, as bytes or an int.
+        :keyword int max_workers: The maximum number of threads (and
+            hence connections) to use.
+        :keyword snapshot: Called (in a worker thread) to turn each
+            object into the value returned. It must not return persistent
+            objects. The default externalizes the object.
+        """
+        self.db = db
+        self.oid = as_oid(oid)
+        self.snapshot = snapshot
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = self.db.open(transaction.TransactionManager())
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, func, *args):
+        # In a worker thread.
+        conn = self._connection()
+        manager = conn.transaction_manager
+        manager.begin()
+        try:
+            return func(conn.get(self.oid), *args)
+        finally:
+            manager.abort()
+
+    def _submit(self, func, *args):
+        loop = _get_loop()
+        return loop.run_in_executor(self._executor, self._call, func, *args)
+
+    def _get_contained(self, storage, containerId, containedId, defaultValue):
+        result = storage.getContainedObject(containerId, containedId, _marker)
+        return defaultValue if result is _marker else self.snapshot(result)
+
+    def _get_many(self, storage, pairs, defaultValue):
+        return [self._get_contained(storage, containerId, containedId, defaultValue)
+                for containerId, containedId in pairs]
+
+    def _get_container(self, storage, containerId, defaultValue):
+        result = storage.getContainer(containerId, _marker)
+        return defaultValue if result is _marker else self.snapshot(result)
+
+    def _get_batch(self, storage, containerId, after, size):
+        container = storage.getContainer(containerId)
+        if container is None:
+            return []
+        if isinstance(container, collections.Mapping):
+            keys = keys_from(container, after)
+            entries = ((k, container[k]) for k in keys if k != after or after is None)
+        else:
+            start = 0 if after is None else after + 1
+            entries = ((i, container[i]) for i in range(start, len(container)))
+        batch = []
+        for key, value in entries:
+            value = storage._v_unwrap(value)
+            if value is not None:
+                batch.append((key, self.snapshot(value)))
+            if len(batch) >= size:
+                break
+        return batch
+
+    def getContainedObject(self, containerId, containedId, defaultValue=None):
+        """
+        Return an awaitable for the snapshot of the object, or *defaultValue*.
+        """
+        return self._submit(self._get_contained,
+                            containerId, containedId, defaultValue)
+
+    def getContainedObjects(self, pairs, defaultValue=None):
+        """
+        Return an awaitable for a list of snapshots (or *defaultValue*), one
+        for each ``(containerId, containedId)`` in *pairs*. All the objects
+        are read in the same transaction.
+        """
+        return self._submit(self._get_many, list(pairs), defaultValue)
+
+    def getContainer(self, containerId, defaultValue=None):
+        """
+        Return an awaitable for the snapshot of the container, or *defaultValue*.
+        """
+        return self._submit(self._get_container, containerId, defaultValue)
+
+    def iterContainer(self, containerId, batch_size=100):
+        """
+        Return an asynchronous iterator over ``(key, snapshot)`` pairs for
+        the contents of the container, in key order.
+
+        The container is read a batch at a time (each batch in its own
+        transaction), and the next batch is only read once the consumer
+        has taken everything in the previous one.
+        """
+        return _AsyncContainerIterator(self, containerId, batch_size)
+
+    def close(self):
+        """
+        Wait for outstanding reads to finish and close all connections.
+        """
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+class _AsyncContainerIterator(object):
+
+    def __init__(self, reader, containerId, batch_size):
+        self._reader = reader
+        self._containerId = containerId
+        self._batch_size = batch_size
+        self._buffer = collections.deque()
+        self._after = None
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    def _batch_done(self, result, fetch):
+        if result.cancelled():  # pragma: no cover
+            return
+        if fetch.exception() is not None:
+            result.set_exception(fetch.exception())
+            return
+        batch = fetch.result()
+        if len(batch) < self._batch_size:
+            self._exhausted = True
+        if batch:
+            self._after = batch[-1][0]
+            self._buffer.extend(batch)
+        self._next(result)
+
+    def _next(self, result):
+        if self._buffer:
+            result.set_result(self._buffer.popleft())
+        else:
+            result.set_exception(StopAsyncIteration())
+
+    def __anext__(self):
+        result = _get_loop().create_future()
+        if self._buffer or self._exhausted:
+            self._next(result)
+        else:
+            fetch = self._reader._submit(self._reader._get_batch,
+                                         self._containerId,
+                                         self._after,
+                                         self._batch_size)
+            fetch.add_done_callback(lambda f: self._batch_done(result, f))
+        return result
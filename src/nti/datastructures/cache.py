@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A cache of read-only snapshots of persistent objects that can be
+shared between ZODB connections.
+
+Each connection has its own pickle cache, so in a pool of threads the
+same popular object is externalized (or otherwise summarized) again by
+every connection that reads it. A :class:`SharedSnapshotCache` instead
+keeps one (detached, read-only) snapshot of each revision of an object,
+keyed by ``(oid, serial)``. Because a revision of an object never
+changes, a snapshot can be shared by every connection whose MVCC view
+includes that revision.
+
+The serial of a ghost is read from the record its connection would
+load (through the connection's MVCC view), without unpickling it, so
+a hit leaves the object a ghost. Objects modified in the current
+transaction, including those saved in a savepoint, bypass the cache.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import threading
+import collections
+
+from ZODB.utils import z64
+
+from nti.externalization.externalization import toExternalObject
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def _current_serial(obj):
+    """
+    Return the serial of *obj* as seen by its connection, or None if
+    the object is not saved or has been modified in the current transaction.
+    """
+    jar = getattr(obj, '_p_jar', None)
+    oid = getattr(obj, '_p_oid', None)
+    if jar is None or oid is None or obj._p_changed:
+        return None
+    # ZODB has no public API for the connection's view of the
+    # database; this is the storage its objects are loaded from.
+    storage = jar._storage
+    if oid in getattr(storage, 'index', ()):
+        # Saved in a savepoint of the current transaction
+        return None
+    if obj._p_changed is None:
+        # A ghost's serial isn't known until it is loaded, but the
+        # record tells us without unpickling it.
+        serial = storage.load(oid)[1]
+    else:
+        serial = obj._p_serial
+    return serial if serial != z64 else None
+
+
+class SharedSnapshotCache(object):
+    """
+    A thread-safe, size-bounded, least-recently-used cache of snapshots of
+    persistent objects, keyed by ``(oid, serial)``.
+
+    Snapshots are created by calling the *snapshot* function with the
+    object, the first time a given revision is requested. They are shared
+    between threads and so MUST NOT be modified. Objects that haven't been
+    saved yet, or that have been modified in the current transaction,
+    bypass the cache: they get a new snapshot every time.
+    """
+
+    def __init__(self, maxsize=10000, snapshot=toExternalObject):
+        """
+        :keyword int maxsize: The maximum number of snapshots to keep.
+        :keyword snapshot: A callable that creates the snapshot of an
+            object. The default externalizes the object.
+        """
+        self.maxsize = maxsize
+        self.snapshot = snapshot
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, obj):
+        """
+        Return a snapshot of *obj*, creating it if needed.
+        """
+        serial = _current_serial(obj)
+        if serial is None:
+            with self._lock:
+                self.bypasses += 1
+            return self.snapshot(obj)
+
+        key = (obj._p_oid, serial)
+        with self._lock:
+            try:
+                # Move to the most-recently-used end
+                result = self._data[key] = self._data.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.hits += 1
+                return result
+
+        # Don't hold the lock while making the snapshot; at worst
+        # two threads make the same snapshot.
+        result = self.snapshot(obj)
+        with self._lock:
+            self.misses += 1
+            self._data[key] = result
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
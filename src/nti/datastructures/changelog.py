@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A persistent, bounded log of the changes made to a
+:class:`.ContainedStorage`, so that clients can synchronize
+incrementally instead of listing every container.
+
+Enable it with :meth:`.ContainedStorage.enableChangeLog`. Each add,
+modification and delete is recorded as ``(sequence, op, containerId,
+id)``; deletes are kept as tombstones, and deleting a whole container
+is recorded with an id of None. Clients remember the token returned by
+:meth:`ChangeLog.changesSince` and pass it back next time, getting only
+what changed since. Once the log grows past its bound, the oldest
+entries are discarded, and tokens older than those raise
+:class:`ChangeTokenExpired`; the client must then resynchronize fully.
+
+Sequence numbers are not taken from a shared counter, so concurrent
+transactions recording changes in the same log don't conflict over it:
+when a transaction commits, its changes are numbered from the current
+time in microseconds, with a random suffix telling apart transactions
+that commit in the same microsecond. (Until then they are kept under
+negative keys no token reaches.) A transaction that took its numbers
+can still commit after one that took later numbers, so tokens lag
+:attr:`ChangeLog.window` seconds behind the present, and a transaction
+that takes more than half that between numbering its changes and
+voting is refused with a :class:`~ZODB.POSException.ConflictError`, to
+be retried. Clients therefore may see a change again, which is
+harmless, but never miss one, provided the clocks of the machines
+committing and reading agree to within the window.
+
+Changes are recorded in the transaction of the log's connection, or
+that of its storage (``__parent__``); until either is added to a
+connection, the default transaction manager is used.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import random
+
+import transaction
+
+from BTrees.Length import Length
+
+from BTrees.LOBTree import LOBTree
+
+from persistent import Persistent
+
+from ZODB.POSException import ConflictError
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The operations recorded in a :class:`ChangeLog`.
+ADD = 'add'
+MODIFY = 'modify'
+DELETE = 'delete'
+
+
+class ChangeTokenExpired(ValueError):
+    """
+    Raised when the changes since a token have been discarded.
+    """
+
+
+class _Floor(Persistent):
+    """
+    The sequence number of the newest discarded entry. Concurrent
+    updates are resolved by keeping the largest.
+    """
+
+    value = 0
+
+    def _p_resolveConflict(self, oldState, savedState, newState):  # pylint: disable=unused-argument
+        result = dict(newState)
+        result['value'] = max(savedState.get('value', 0), newState.get('value', 0))
+        return result
+
+
+#: The bits of a sequence number telling apart transactions that
+#: commit in the same microsecond.
+_SUFFIX_BITS = 12
+
+
+def _sequence(when):
+    return int(when * 1000000) << _SUFFIX_BITS
+
+
+class _Deadline(object):
+    """
+    A data manager that refuses to commit, when voting, after
+    *deadline*.
+    """
+
+    def __init__(self, manager, deadline):
+        self.transaction_manager = manager
+        self.deadline = deadline
+
+    def sortKey(self):
+        # Vote after the databases
+        return '~' + __name__
+
+    def tpc_vote(self, unused_txn):
+        if time.time() > self.deadline:
+            raise ConflictError("Changes were numbered too long before commit")
+
+    def abort(self, txn):
+        pass
+
+    tpc_begin = commit = tpc_finish = tpc_abort = abort
+
+
+class ChangeLog(Persistent):
+    """
+    The change log of one storage.
+    """
+
+    # The operations, for callers that don't import this module.
+    ADD = ADD
+    MODIFY = MODIFY
+    DELETE = DELETE
+
+    def __init__(self, max_entries=10000):
+        """
+        :keyword int max_entries: About how many entries to keep. The log
+            is trimmed back to this size when it grows a tenth larger.
+        """
+        self.max_entries = max_entries
+        self._entries = LOBTree()
+        self._size = Length()
+        self._floor = _Floor()
+
+    __parent__ = None
+
+    #: How many seconds tokens lag behind the present.
+    window = 60
+
+    def __len__(self):
+        return self._size()
+
+    def _horizon(self):
+        """
+        The sequence number below which all changes have been
+        committed.
+        """
+        return _sequence(time.time() - self.window)
+
+    def _transaction_manager(self):
+        for obj in (self, self.__parent__):
+            manager = getattr(getattr(obj, '_p_jar', None),
+                              'transaction_manager', None)
+            if manager is not None:
+                return manager
+        return transaction.manager
+
+    def _transaction(self):
+        return self._transaction_manager().get()
+
+    def _pending(self):
+        """
+        The negative keys of the changes recorded in the current
+        transaction, in order.
+        """
+        txn = self._transaction()
+        try:
+            pending = txn.data(self)
+        except KeyError:
+            pending = None
+        if not isinstance(pending, list):
+            # Also after our hook has run, if a later one records
+            # changes; they are numbered after the ones it numbered.
+            start = pending
+            pending = []
+            txn.set_data(self, pending)
+            txn.addBeforeCommitHook(self._before_commit, (txn, pending, start))
+        return pending
+
+    def record(self, op, containerId, containedId):
+        """
+        Record a change. It is given its sequence number when the
+        transaction commits.
+        """
+        pending = self._pending()
+        key = -(len(pending) + 1)
+        pending.append(key)
+        self._entries[key] = (op, containerId, containedId)
+        self._size.change(1)
+
+    def _before_commit(self, txn, pending, start):
+        now = time.time()
+        base = _sequence(now) | random.getrandbits(_SUFFIX_BITS)
+        if start is not None:
+            base = max(base, start)
+        step = 1 << _SUFFIX_BITS
+        for key in pending:
+            # Changes rolled back to a savepoint are gone from the tree.
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[base] = entry
+                base += step
+        txn.set_data(self, base)
+        txn.join(_Deadline(self._transaction_manager(), now + self.window / 2))
+        if self._size() > self.max_entries * 1.1:
+            self._trim()
+
+    def _trim(self):
+        # Only changes every client can have seen are discarded.
+        excess = self._size() - self.max_entries
+        keys = list(self._entries.keys(0, self._horizon())[:excess])
+        for key in keys:
+            del self._entries[key]
+        self._size.change(-len(keys))
+        if keys:
+            self._floor.value = max(self._floor.value, keys[-1])
+
+    @property
+    def token(self):
+        """
+        The token for "now", for clients that have just synchronized
+        fully.
+        """
+        last = self._entries.maxKey() if self._entries else 0
+        return max(min(last, self._horizon()), self._floor.value)
+
+    def changesSince(self, token):
+        """
+        Return the changes made after *token*, compacted so that only
+        the most recent change to each object is included, in
+        sequence order.
+
+        :param int token: A token from :attr:`token` or a previous call.
+        :return: A tuple ``(changes, token)``, where *changes* is a list of
+            ``(sequence, op, containerId, id)`` and *token* is to be passed
+            to the next call.
+        :raises ChangeTokenExpired: If changes after *token* have been
+            discarded.
+        """
+        if token < self._floor.value:
+            raise ChangeTokenExpired(token)
+        latest = {}
+        for seq, (op, containerId, containedId) in self._entries.items(token + 1):
+            latest[(containerId, containedId)] = (seq, op, containerId, containedId)
+        changes = sorted(latest.values())
+        if changes:
+            token = max(token, min(changes[-1][0], self._horizon()))
+        return changes, token
@@ -0,0 +1,594 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact containers for :class:`.ContainedStorage`.
+
+A :class:`~nti.containers.containers.CheckingLastModifiedBTreeContainer`
+is stored as three persistent objects: the container, its BTree and
+the BTree's :class:`~BTrees.Length.Length`. Most containers only ever
+hold a few objects, so :class:`SmallLastModifiedBTreeContainer` keeps
+its items in its own record until it holds more than
+:attr:`~SmallLastModifiedBTreeContainer.max_small_size` of them, and
+then moves them to a BTree and Length, behaving exactly like its base
+class from then on. It is the default container type of
+:class:`.ContainedStorage`.
+
+Storages that keep their objects in lists (a deprecated
+``containerType``, but still needed for objects that are shared and so
+can't be given ids) can use :class:`UniqueContainedList`. Like a list,
+it keeps the order in which objects were added, but it holds each
+object only once, and finds objects without scanning.
+
+Code that may or may not write to a container can ask for a
+:class:`LazyContainer` instead (``getOrCreateContainer(containerId,
+lazy=True)``). Until something is written to it, it behaves as an
+empty container and nothing is added to the database.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import bisect
+import weakref
+import threading
+import collections
+
+import six
+
+from zope import interface
+
+from zope.container.interfaces import IContainer
+
+from zope.location.interfaces import ILocation
+
+from BTrees.Length import Length
+
+from BTrees.OOBTree import OOBTree
+
+from ZODB.ConflictResolution import PersistentReference
+
+from ZODB.POSException import ConflictError
+
+from persistent.wref import WeakRef
+
+from nti.base.interfaces import ILastModified
+
+from nti.containers.containers import CheckingLastModifiedBTreeContainer
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+logger = __import__('logging').getLogger(__name__)
+
+_marker = object()
+
+
+class _SmallItems(dict):
+    """
+    The items of a small container, with the (sorted) API of a BTree
+    that the container uses. This is pickled in the container's record.
+    """
+
+    def keys(self, min=None, max=None):  # pylint: disable=redefined-builtin,arguments-differ
+        return [k for k in sorted(dict.keys(self))
+                if (min is None or k >= min) and (max is None or k <= max)]
+
+    def values(self, min=None, max=None):  # pylint: disable=redefined-builtin,arguments-differ
+        return [self[k] for k in self.keys(min, max)]
+
+    def items(self, min=None, max=None):  # pylint: disable=redefined-builtin,arguments-differ
+        return [(k, self[k]) for k in self.keys(min, max)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iterkeys(self, min=None, max=None):  # pylint: disable=redefined-builtin
+        return iter(self.keys(min, max))
+
+    def itervalues(self, min=None, max=None):  # pylint: disable=redefined-builtin
+        return iter(self.values(min, max))
+
+    def iteritems(self, min=None, max=None):  # pylint: disable=redefined-builtin
+        return iter(self.items(min, max))
+
+
+class _NoLength(object):
+    """
+    Stands in for the Length of a small container; ``len(data)`` is
+    used instead.
+    """
+
+    def change(self, delta):
+        pass
+
+    def __reduce__(self):
+        # Pickled as a reference to the module global
+        return '_NO_LENGTH'
+
+_NO_LENGTH = _NoLength()
+
+
+def _same(a, b):
+    """
+    Equality for the states seen in conflict resolution. Persistent
+    references only compare equal to themselves, so compare their OIDs.
+    """
+    if a is b:
+        return True
+    if isinstance(a, PersistentReference) or isinstance(b, PersistentReference):
+        return  isinstance(a, PersistentReference) \
+            and isinstance(b, PersistentReference) \
+            and (a.oid, a.database_name) == (b.oid, b.database_name)
+    if isinstance(a, _SmallItems) and isinstance(b, _SmallItems):
+        return  len(a) == len(b) \
+            and all(k in b and _same(v, b[k]) for k, v in dict.items(a))
+    return a == b
+
+
+def _is_last_modified(name):
+    return name.lower().endswith('lastmodified')
+
+
+class SmallLastModifiedBTreeContainer(CheckingLastModifiedBTreeContainer):
+    """
+    A container that stores its items inline while it is small.
+
+    Concurrent changes to different keys of a small container are
+    resolved like those to a BTree.
+    """
+
+    #: Once the container would hold more than this many items, they are
+    #: moved to a BTree. They never move back.
+    max_small_size = 32
+
+    def __init__(self, *args, **kwargs):
+        super(SmallLastModifiedBTreeContainer, self).__init__(*args, **kwargs)
+        self._BTreeContainer__len = _NO_LENGTH
+
+    def _newContainerData(self):
+        return _SmallItems()
+
+    @property
+    def small(self):
+        """
+        Whether the items are stored inline.
+        """
+        return isinstance(self._SampleContainer__data, _SmallItems)
+
+    def _upgrade(self):
+        data = self._SampleContainer__data
+        tree = OOBTree()
+        tree.update(data)
+        self._SampleContainer__data = tree
+        self._BTreeContainer__len = Length(len(data))
+        logger.debug("Moved %s items of %r to a BTree", len(data), self)
+
+    def __len__(self):
+        if self.small:
+            return len(self._SampleContainer__data)
+        return super(SmallLastModifiedBTreeContainer, self).__len__()
+
+    def _setitemf(self, key, value):
+        data = self._SampleContainer__data
+        if      self.small \
+            and len(data) >= self.max_small_size \
+            and key not in data:
+            self._upgrade()
+        super(SmallLastModifiedBTreeContainer, self)._setitemf(key, value)
+        if self.small:
+            self._p_changed = True
+
+    def __delitem__(self, key):
+        super(SmallLastModifiedBTreeContainer, self).__delitem__(key)
+        if self.small:
+            self._p_changed = True
+
+    def _p_resolveConflict(self, oldState, savedState, newState):
+        result = dict(newState)
+        for name in set(oldState) | set(savedState) | set(newState):
+            old = oldState.get(name, _marker)
+            saved = savedState.get(name, _marker)
+            new = newState.get(name, _marker)
+            if _same(saved, new) or _same(saved, old):
+                value = new
+            elif _same(new, old):
+                value = saved
+            elif _is_last_modified(name):
+                value = max(saved, new)
+            elif isinstance(old, _SmallItems) \
+                and isinstance(saved, _SmallItems) \
+                and isinstance(new, _SmallItems):
+                value = _merge_items(old, saved, new)
+            else:
+                raise ConflictError("Conflicting changes to %s" % name)
+            if value is _marker:
+                result.pop(name, None)
+            else:
+                result[name] = value
+        return result
+
+
+def _merge_items(old, saved, new):
+    """
+    Three-way merge of the items of a small container. Like a BTree
+    bucket, changes to different keys merge; changes to the same key
+    conflict unless they are identical.
+    """
+    result = _SmallItems(old)
+    for key in set(old) | set(saved) | set(new):
+        o = old.get(key, _marker)
+        s = saved.get(key, _marker)
+        n = new.get(key, _marker)
+        if _same(s, n) or _same(s, o):
+            value = n
+        elif _same(n, o):
+            value = s
+        else:
+            raise ConflictError("Conflicting changes to key %r" % (key,))
+        if value is _marker:
+            result.pop(key, None)
+        else:
+            result[key] = value
+    return result
+
+
+_lazy_lock = threading.Lock()
+_lazy_counts = {'proxies': 0, 'materialized': 0, 'avoided': 0}
+
+
+def _count_lazy(name, change=1):
+    with _lazy_lock:
+        _lazy_counts[name] += change
+
+
+def lazy_container_stats():
+    """
+    Return a dictionary counting the :class:`LazyContainer` objects
+    created (``proxies``), those that were written to and had to
+    create their container (``materialized``), and the container
+    creations ``avoided``: the proxies whose container, so far, nobody
+    has created.
+    """
+    with _lazy_lock:
+        return dict(_lazy_counts)
+
+
+@interface.implementer(IContainer, ILastModified, ILocation)
+class LazyContainer(collections.MutableMapping):
+    """
+    Stands in for a container of a storage that does not exist yet. It
+    reads as empty (or as the real container, once somebody creates
+    it). The first write creates the container with
+    ``storage.getOrCreateContainer`` and is applied to it, as are all
+    later operations.
+
+    It is located where the container will be: its ``__parent__`` is
+    the storage and its ``__name__`` the containerId.
+    """
+
+    def __init__(self, storage, containerId):
+        self.__parent__ = storage
+        self.__name__ = containerId
+        self._storage = storage
+        self._containerId = containerId
+        self._container = None
+        self._avoided = True
+        _count_lazy('proxies')
+        _count_lazy('avoided')
+
+    def _found(self, container):
+        """
+        Called when the container exists, whoever created it.
+        """
+        self._container = container
+        if self._avoided:
+            self._avoided = False
+            _count_lazy('avoided', -1)
+
+    def _target(self):
+        # Always ask the storage: the container we had may have been
+        # deleted, or its creation rolled back, and replaced.
+        container = self._storage.containers.get(self._containerId)
+        if container is None:
+            self._container = None
+        elif container is not self._container:
+            self._found(container)
+        return self._container
+
+    def _materialize(self):
+        if self._target() is None:
+            self._found(self._storage.getOrCreateContainer(self._containerId))
+            _count_lazy('materialized')
+        return self._container
+
+    @property
+    def materialized(self):
+        return self._target() is not None
+
+    # Reads
+
+    def __getitem__(self, key):
+        target = self._target()
+        if target is None:
+            raise KeyError(key)
+        return target[key]
+
+    def get(self, key, default=None):
+        target = self._target()
+        return default if target is None else target.get(key, default)
+
+    def __contains__(self, key):
+        target = self._target()
+        return target is not None and key in target
+
+    def __iter__(self):
+        target = self._target()
+        return iter(()) if target is None else iter(target)
+
+    def __len__(self):
+        target = self._target()
+        return 0 if target is None else len(target)
+
+    def keys(self, key=None):  # pylint: disable=arguments-differ
+        target = self._target()
+        return () if target is None else target.keys(key)
+
+    def values(self, key=None):  # pylint: disable=arguments-differ
+        target = self._target()
+        return () if target is None else target.values(key)
+
+    def items(self, key=None):  # pylint: disable=arguments-differ
+        target = self._target()
+        return () if target is None else target.items(key)
+
+    @property
+    def lastModified(self):
+        target = self._target()
+        return 0 if target is None else target.lastModified
+
+    @property
+    def createdTime(self):
+        target = self._target()
+        return 0 if target is None else getattr(target, 'createdTime', 0)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        target = self._target()
+        if target is None:
+            raise AttributeError(name)
+        return getattr(target, name)
+
+    # Writes
+
+    def __setitem__(self, key, value):
+        self._materialize()[key] = value
+
+    def __delitem__(self, key):
+        target = self._target()
+        if target is None:
+            raise KeyError(key)
+        del target[key]
+
+    def __repr__(self):
+        return "<%s %s materialized: %s>" % (self.__class__.__name__,
+                                             self._containerId,
+                                             self.materialized)
+
+
+def _member_key(value):
+    """
+    The key identifying the object that *value*, an object or a weak
+    reference to one, refers to: its OID, or, if it has none yet,
+    its ``id()``.
+    """
+    if isinstance(value, WeakRef):
+        if value.oid is not None:
+            return value.oid
+        value = value()
+    elif isinstance(value, weakref.ref):
+        referent = value()
+        if referent is None:
+            # Dead, so only equal to itself
+            return id(value)
+        value = referent
+    oid = getattr(value, '_p_oid', None)
+    return oid if oid is not None else id(value)
+
+
+def _referent(value):
+    """
+    The object that *value*, an object or a weak reference to one,
+    refers to.
+    """
+    if isinstance(value, (WeakRef, weakref.ref)):
+        return value()
+    return value
+
+
+class UniqueContainedList(PersistentExternalizableList):
+    """
+    A persistent list that holds each object at most once.
+
+    Objects are identified by their OID (or, until they have one, their
+    identity), looking through weak references, not by equality.
+    :meth:`append`, :meth:`extend` and :meth:`insert` skip objects that
+    are already present. Membership tests, :meth:`index` and
+    :meth:`remove` use a volatile map from object to position instead of
+    scanning the list; it is built the first time it is needed after
+    the list is loaded, and objects added before they had an OID are
+    moved to it when they are next looked up. Other changes, such as
+    slice assignment and sorting, rebuild the map, and are not checked
+    for duplicates.
+    """
+
+    #: Key to the position the object had when the map was built (or
+    #: when it was appended).
+    _v_positions = None
+    #: Sorted positions, in the same numbering, of the objects
+    #: removed since the map was built.
+    _v_removed = ()
+    _v_next = 0
+    #: How many keys are identities rather than OIDs.
+    _v_transient = 0
+    _v_duplicates = ()
+
+    #: Rebuild the map after this many removals.
+    max_removed = 1024
+
+    def __init__(self, initlist=None):
+        super(UniqueContainedList, self).__init__()
+        if initlist is not None:
+            self.extend(initlist)
+
+    def _positions(self):
+        positions = self._v_positions
+        if positions is None:
+            positions = {}
+            duplicates = set()
+            for i, value in enumerate(self.data):
+                key = _member_key(value)
+                if key in positions:
+                    duplicates.add(key)
+                else:
+                    positions[key] = i
+            if duplicates:
+                logger.debug("%d duplicate objects in %r", len(duplicates), self)
+            self._v_positions = positions
+            self._v_removed = []
+            self._v_next = len(self.data)
+            self._v_transient = sum(1 for key in positions
+                                    if isinstance(key, six.integer_types))
+            self._v_duplicates = duplicates
+        return positions
+
+    def _invalidate(self):
+        self._v_positions = None
+
+    def _find(self, item):
+        """
+        Return the key of *item* and its index, or -1.
+        """
+        key = _member_key(item)
+        position = self._positions().get(key)
+        if      position is None and self._v_transient \
+            and not isinstance(key, six.integer_types):
+            position = self._rekey(item, key)
+        if position is None:
+            return key, -1
+        return key, position - bisect.bisect_left(self._v_removed, position)
+
+    def _rekey(self, item, key):
+        """
+        If *item* was added before it was given its OID *key*, move
+        it to that key, returning its position.
+        """
+        positions = self._v_positions
+        referent = _referent(item)
+        transient = id(referent)
+        position = positions.get(transient)
+        if position is None:
+            return None
+        index = position - bisect.bisect_left(self._v_removed, position)
+        if _referent(self.data[index]) is not referent:
+            return None
+        positions[key] = positions.pop(transient)
+        self._v_transient -= 1
+        if transient in self._v_duplicates:
+            self._v_duplicates.discard(transient)
+            self._v_duplicates.add(key)
+        return position
+
+    def _forget(self, key):
+        position = self._v_positions.pop(key)
+        bisect.insort(self._v_removed, position)
+        if isinstance(key, six.integer_types):
+            self._v_transient -= 1
+        if      key in self._v_duplicates \
+            or len(self._v_removed) > self.max_removed:
+            # Another copy is still present, or the map needs compacting
+            self._invalidate()
+
+    def __contains__(self, item):
+        return self._find(item)[1] >= 0
+
+    def index(self, item, *args):
+        if args:
+            return super(UniqueContainedList, self).index(item, *args)
+        index = self._find(item)[1]
+        if index < 0:
+            raise ValueError(item)
+        return index
+
+    def append(self, item):
+        key, index = self._find(item)
+        if index >= 0:
+            return
+        super(UniqueContainedList, self).append(item)
+        self._v_positions[key] = self._v_next
+        self._v_next += 1
+        if isinstance(key, six.integer_types):
+            self._v_transient += 1
+
+    def extend(self, other):
+        for item in other:
+            self.append(item)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def insert(self, i, item):
+        if item in self:
+            return
+        super(UniqueContainedList, self).insert(i, item)
+        self._invalidate()
+
+    def remove(self, item):
+        self.pop(self.index(item))
+
+    def pop(self, i=-1):
+        positions = self._positions()
+        key = self._find(self.data[i])[0]
+        index = i if i >= 0 else len(self.data) + i
+        result = super(UniqueContainedList, self).pop(i)
+        position = positions.get(key)
+        if      position is not None \
+            and position - bisect.bisect_left(self._v_removed, position) == index:
+            self._forget(key)
+        else:
+            self._invalidate()
+        return result
+
+    def __delitem__(self, i):
+        if isinstance(i, six.integer_types):
+            self.pop(i)
+        else:
+            super(UniqueContainedList, self).__delitem__(i)
+            self._invalidate()
+
+    def __setitem__(self, i, item):
+        if isinstance(i, six.integer_types):
+            index = self._find(item)[1]
+            if index >= 0 and index != (i if i >= 0 else len(self.data) + i):
+                raise ValueError("Already present", item)
+        super(UniqueContainedList, self).__setitem__(i, item)
+        self._invalidate()
+
+    def __imul__(self, n):
+        result = super(UniqueContainedList, self).__imul__(n)
+        self._invalidate()
+        return result
+
+    def reverse(self):
+        super(UniqueContainedList, self).reverse()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super(UniqueContainedList, self).sort(*args, **kwargs)
+        self._invalidate()
+
+    def clear(self):
+        del self[:]
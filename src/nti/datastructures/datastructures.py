@@ -11,9 +11,11 @@ from __future__ import absolute_import
 import six
 import logging
 import weakref
+import itertools
 import collections
 
 from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 
 from persistent.wref import WeakRef
 
@@ -37,19 +39,26 @@ from zope.location.interfaces import IContained as IZContained
 from nti.base.interfaces import ILastModified
 
 from nti.containers.containers import LastModifiedBTreeContainer
-from nti.containers.containers import CheckingLastModifiedBTreeContainer
 from nti.containers.containers import CaseInsensitiveLastModifiedBTreeContainer
 
 from nti.coremetadata.interfaces import IContained
 from nti.coremetadata.interfaces import INamedContainer
 
+from nti.datastructures.containers import LazyContainer
+from nti.datastructures.containers import SmallLastModifiedBTreeContainer
+from nti.datastructures.containers import UniqueContainedList
+
 from nti.datastructures.interfaces import IHTC_NEW_FACTORY
 from nti.datastructures.interfaces import IHomogeneousTypeContainer
 
+# BWC: these used to be defined here.
+from nti.datastructures.synthetic import _isMagicKey  # pylint: disable=unused-import
+from nti.datastructures.synthetic import _syntheticKeys
+from nti.datastructures.synthetic import isSyntheticKey  # pylint: disable=unused-import
+
 from nti.dublincore.time_mixins import ModDateTrackingObject
 
 from nti.externalization.interfaces import StandardInternalFields
-from nti.externalization.interfaces import StandardExternalFields
 
 from nti.ntiids.oids import to_external_ntiid_oid
 
@@ -59,24 +68,6 @@ from nti.zodb.persistentproperty import PropertyHoldingPersistent
 logger = __import__('logging').getLogger(__name__)
 
 
-def _syntheticKeys():
-    return (StandardExternalFields.ID,
-            StandardExternalFields.OID,
-            StandardExternalFields.CLASS,
-            StandardExternalFields.CREATOR,
-            StandardExternalFields.CONTAINER_ID,
-            StandardExternalFields.LAST_MODIFIED)
-
-
-def isSyntheticKey(key):
-    """
-    For our mixin objects that have special keys, defines
-    those keys that are special and not settable by the user.
-    """
-    return key in _syntheticKeys()
-_isMagicKey = isSyntheticKey
-
-
 # For speed and use in this function, we declare an 'inline'-able attribute
 _magic_keys = set(_syntheticKeys())
 
@@ -115,22 +106,42 @@ def _noop(*unused_args):
 class ContainedObjectValueError(ValueError):
     """
     A more naturally descriptive exception for contained objects.
+
+    The message, which includes the ``repr`` of the object, is only
+    formatted when it is needed, so rejecting objects is cheap for
+    callers that catch and discard the error.
     """
 
     def __init__(self, string, contained=None, **kwargs):
-        ctype = type(contained)
-        cstr = 'Unable to determine'
-        try:
-            cstr = repr(contained)
-        except Exception as e:  # pylint: disable=broad-except
-            cstr = u'{%s}' % e
-        super(_ContainedObjectValueError, self).__init__(
-            "%s [type: %s repr %s]%s" % (string, ctype, cstr, kwargs)
-        )
+        super(_ContainedObjectValueError, self).__init__(string)
+        self.contained = contained
+        self.kwargs = kwargs
+        self._message = None
+
+    def __str__(self):
+        if self._message is None:
+            contained = self.contained
+            try:
+                cstr = repr(contained)
+            except Exception as e:  # pylint: disable=broad-except
+                cstr = u'{%s}' % e
+            self._message = "%s [type: %s repr %s]%s" % (self.args[0],
+                                                         type(contained),
+                                                         cstr,
+                                                         self.kwargs)
+        return self._message
 _ContainedObjectValueError = ContainedObjectValueError
 
 
-def check_contained_object_for_storage(contained):
+#: Classes whose instances are known to provide the interfaces
+#: required by :func:`check_contained_object_for_storage`. Interfaces
+#: implemented by a class can't be removed from it or its instances,
+#: so only positive results are kept; other objects may provide the
+#: interfaces directly and are checked individually.
+_valid_contained_types = weakref.WeakKeyDictionary()
+
+
+def _check_contained_interfaces(contained):
     if not IZContained.providedBy(contained):
         raise ContainedObjectValueError("Contained object is not " + str(IZContained),
                                         contained)
@@ -139,6 +150,15 @@ def check_contained_object_for_storage(contained):
         raise ContainedObjectValueError("Contained object is not " + str(IContained),
                                         contained)
 
+
+def check_contained_object_for_storage(contained):
+    kind = type(contained)
+    if kind not in _valid_contained_types:
+        _check_contained_interfaces(contained)
+        spec = interface.implementedBy(kind)
+        if spec.isOrExtends(IZContained) and spec.isOrExtends(IContained):
+            _valid_contained_types[kind] = True
+
     if not getattr(contained, 'containerId'):
         raise ContainedObjectValueError("Contained object has empty containerId",
                                         contained)
@@ -161,6 +181,50 @@ class VolatileFunctionProperty(PropertyHoldingPersistent):
 _VolatileFunctionProperty = VolatileFunctionProperty
 
 
+def keys_from(mapping, start=None):
+    """
+    Iterate the keys of *mapping* beginning with *start* (inclusive), or all
+    of them if *start* is None, in order. BTrees (and BTree containers)
+    can seek directly to the key; the keys of other mappings are sorted,
+    so that *start* need not still be in the mapping.
+    """
+    return iter(_keys_between(mapping, start))
+
+
+def _keys_between(mapping, min_key=None, max_key=None):
+    """
+    Iterate the keys of *mapping* between *min_key* and *max_key*
+    (inclusive; either may be None), in order. BTrees (and BTree
+    containers) seek directly to *min_key*; other mappings are sorted.
+    """
+    try:
+        keys = mapping.keys(min_key)
+    except TypeError:
+        keys = sorted(k for k in mapping.keys()
+                      if min_key is None or k >= min_key)
+    if max_key is not None:
+        keys = itertools.takewhile(lambda k: k <= max_key, keys)
+    return keys
+
+
+def _type_filter(types):
+    """
+    Return a function testing whether the class of an object is one of
+    *types* (classes) or implements one of them (interfaces). Only the
+    class is examined, so ghosts are not activated.
+    """
+    if not isinstance(types, tuple):
+        types = (types,)
+    classes = tuple(t for t in types if isinstance(t, type))
+    ifaces = tuple(t for t in types if not isinstance(t, type))
+
+    def check(obj):
+        kind = type(obj)
+        return issubclass(kind, classes) \
+            or any(iface.implementedBy(kind) for iface in ifaces)
+    return check
+
+
 @interface.implementer(IZContained, ISublocations)
 class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
     """
@@ -180,12 +244,20 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
     __name__ = None
     __parent__ = None
 
+    # The ids of the containers we are the parent of. None in
+    # storages created before this was tracked, until the first
+    # call to sublocations.
+    _ownedContainerIds = None
+
+    # The live LazyContainer proxies handed out, by containerId.
+    _v_lazyContainers = None
+
     # TODO: Remove the containerType argument; nothing except tests uses it now,
     # everything else uses the standard type.
     # That will let us remove the complicated code to do different things based on
     # the type of container.
     def __init__(self, weak=False, create=False, containers=None,
-                 containerType=CheckingLastModifiedBTreeContainer,
+                 containerType=SmallLastModifiedBTreeContainer,
                  set_ids=True, containersType=OOBTree):
         """
         Creates a new container.
@@ -198,7 +270,8 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
         :param dict containers: Initial containers. We do not adopt these containers,
             they may already have a __parent__ (presumably an ancestor of ours as well)
         :param type containerType: The type for each created container. Should be a mapping
-            type, and should handle conflicts. The default value only allows comparable keys.
+            type, and should handle conflicts. The default value only allows comparable keys,
+            and stores small containers compactly (see :mod:`nti.datastructures.containers`).
             The type can also be a `list` type, though this use is deprecated and discouraged.
         :param type containersType: The mapping type factory that will hold the containers.
             Default is :class:`ModDateTrackingOOBTree`, another choice is
@@ -214,6 +287,7 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
         self.create = create  # read-only
         self.containerType = containerType  # read-only
         self.set_ids = set_ids  # read-only
+        self._ownedContainerIds = OOTreeSet()
         self._setup()
 
         for k, v in (containers or {}).items():
@@ -280,8 +354,10 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
                         del c[k]
                         return v
                 raise ValueError(d)
-            # Lists. Note that duplicates may have
-            # crept in. TODO: We should probably remove them all
+            # Lists. Note that duplicates may have crept in
+            # (except in a UniqueContainedList, which also finds
+            # the object without scanning). TODO: We should probably
+            # remove them all
             ix = c.index(d)
             d = c[ix]
             c.pop(ix)
@@ -338,31 +414,63 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
             raise TypeError('Container/Id cannot be None')
 
         self.containers[containerId] = container
+        self._invalidateFactoryForType(containerId)
+        proxy = self._v_lazyContainers.get(containerId) \
+                if self._v_lazyContainers is not None else None
+        if proxy is not None:
+            proxy._found(container)  # pylint: disable=protected-access
         if locate and ILocation.providedBy(container):
             loc_locate(container, self, containerId)
+            self._ownedContainerIdsForUpdate().add(containerId)
 
     def deleteContainer(self, containerId):
         """
         Removes an existing container, if one already exists.
         :raises: KeyError If no container exists.
         """
+        self._copyFrozenContainer(containerId)
         del self.containers[containerId]
+        self._invalidateFactoryForType(containerId)
+        if self._v_lazyContainers is not None:
+            # A new one is handed out if the container is missing again.
+            self._v_lazyContainers.pop(containerId, None)
+        owned = self._ownedContainerIds
+        if owned is not None and containerId in owned:
+            owned.remove(containerId)
+        for index in self._iterIndexes():
+            index.unindex_container(containerId)
+        self._recordChange('DELETE', containerId, None)
 
     def getContainer(self, containerId, defaultValue=None):
         """ 
         Given a container ID, returns the existing container, or
         the default value if there is no container. The returned
         value SHOULD NOT be modified. 
+        (:meth:`getFrozenContainer` returns a view that cannot be.)
         """
         # FIXME: handle unwrapping of the contained objects
         return self.containers.get(containerId, defaultValue)
 
-    def getOrCreateContainer(self, containerId):
+    def getOrCreateContainer(self, containerId, lazy=False):
         """
         Return a container for the given containerId. If one
         does not already exist, it will be created and stored.
+
+        :keyword bool lazy: If true, and the container does not exist,
+            return a :class:`.LazyContainer` that only creates and stores
+            it when something is written to it.
         """
         container = self.containers.get(containerId, None)
+        if container is None and lazy:
+            # Hand out one proxy per container, so that its creation
+            # is only counted as avoided once.
+            proxies = self._v_lazyContainers
+            if proxies is None:
+                proxies = self._v_lazyContainers = weakref.WeakValueDictionary()
+            proxy = proxies.get(containerId)
+            if proxy is None:
+                proxy = proxies[containerId] = LazyContainer(self, containerId)
+            return proxy
         if container is None:
             container = self.containerType()
             if IConnection(self, None) is not None and hasattr(container, '_p_jar'):
@@ -377,14 +485,55 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
         a new default instance and returns it. Otherwise returns
         None. 
         """
-        result = None
+        factory = self._getFactoryForType(datatype)
+        return factory(externalValue) if factory else None
+
+    def maybeCreateContainedObjectsWithTypes(self, pairs):
+        """
+        Like :meth:`maybeCreateContainedObjectWithType`, but for an
+        iterable of ``(datatype, externalValue)`` pairs.
+
+        :return: A list with the new object, or None, for each pair.
+        """
+        factory_for = self._getFactoryForType
+        result = []
+        for datatype, externalValue in pairs:
+            factory = factory_for(datatype)
+            result.append(factory(externalValue) if factory else None)
+        return result
+
+    def _getFactoryForType(self, datatype):
+        # Finding the factory can require loading the container, so cache
+        # it, along with the container it came from. Looking that up is
+        # cheap and doesn't load it, and tells us if the container has
+        # been replaced or removed, including by another transaction or
+        # an abort (which don't invalidate us, only our containers).
+        # Only factories are cached; a container that doesn't have one
+        # yet may be added at any time.
         container = self.containers.get(datatype)
+        if container is None:
+            return None
+        cache = getattr(self, '_v_factories', None)
+        if cache is None:
+            cache = self._v_factories = {}
+        cached = cache.get(datatype)
+        if cached is not None and cached[0] is container:
+            return cached[1]
+
+        factory = None
         if IHomogeneousTypeContainer.providedBy(container):
             contained_type = container.contained_type
             factory = contained_type.queryTaggedValue(IHTC_NEW_FACTORY)
-            if factory:
-                result = factory(externalValue)
-        return result
+        if factory is not None:
+            cache[datatype] = (container, factory)
+        else:
+            cache.pop(datatype, None)
+        return factory
+
+    def _invalidateFactoryForType(self, datatype):
+        cache = getattr(self, '_v_factories', None)
+        if cache:
+            cache.pop(datatype, None)
 
     def addContainedObject(self, contained):
         """
@@ -419,6 +568,8 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
                         # pylint: disable=unused-variable
                         __traceback_info__ = contained, existing
                         raise KeyError("Contained object uses existing ID %s" % contained.id)
+        elif isinstance(container, UniqueContainedList) and contained in container:
+            return contained  # Already present
 
         # Save
         if not contained.id and not self.set_ids:
@@ -455,14 +606,18 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
             raise ContainedObjectValueError("Unable to determine contained id",
                                             contained)
 
+        self._copyFrozenContainer(contained.containerId)
         self._v_putInContainer(container,
                                contained.id,
                                self._v_wrap(contained),
                                contained)
         # Synchronize the timestamps
         self._updateContainerLM(container)
+        self._indexContainedObject(container, contained)
+        self._recordChange('ADD', contained.containerId, contained.id)
 
         self.afterAddContainedObject(contained)
+        self._notifyHooks('ADD', contained)
         return contained
 
     def _updateContainerLM(self, container):
@@ -473,6 +628,25 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
 
     afterAddContainedObject = _VolatileFunctionProperty('_v_afterAdd')
 
+    @property
+    def hooks(self):
+        """
+        The :class:`.HookRegistry` for the events of this object. It is
+        volatile, like the ``after*`` hooks.
+        """
+        registry = getattr(self, '_v_hooks', None)
+        if registry is None:
+            from nti.datastructures.hooks import HookRegistry
+            registry = self._v_hooks = HookRegistry(self)
+        return registry
+
+    def _notifyHooks(self, event, contained):
+        # *event* names the event, as an attribute of the registry,
+        # so that the hooks module is only imported when it is used.
+        registry = getattr(self, '_v_hooks', None)
+        if registry:
+            registry.notify(getattr(registry, event), contained)
+
     def deleteContainedObject(self, containerId, containedId):
         """
         Given the ID of a container and something contained within it,
@@ -518,6 +692,9 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
             return None
 
         wrapped = self._v_wrap(contained)  # outside the catch
+        self._copyFrozenContainer(contained.containerId)
+        # Removal may clear the id
+        docid = (contained.containerId, contained.id)
         try:
             contained = self._v_unwrap(
                 self.doRemoveFromContainer(container, wrapped)
@@ -556,11 +733,80 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
             return None
         else:
             self._updateContainerLM(container)
+            self._unindexContainedObject(container, docid)
+            self._recordChange('DELETE', *docid)
             self.afterDeleteContainedObject(contained)
+            self._notifyHooks('DELETE', contained)
             return contained
 
     afterDeleteContainedObject = _VolatileFunctionProperty('_v_afterDel')
 
+    def sweepDanglingReferences(self, batch_size=100, cursor=None,
+                                log_level=logging.DEBUG):
+        """
+        Remove weak references to objects that no longer exist, examining
+        at most *batch_size* entries.
+
+        Without this, dangling references are only cleaned up when
+        :meth:`deleteEqualContainedObject` happens to trip over one (and then
+        only in list containers). This method is meant to be called
+        repeatedly, for example once per transaction by a background job,
+        passing back the returned cursor until it is None. It handles both
+        mapping and list containers. If we do not hold weak references,
+        there is nothing to do.
+
+        :param int batch_size: The maximum number of entries to examine.
+        :param cursor: The cursor returned by a previous call, or None to
+            start at the beginning.
+        :return: A tuple ``(removed, cursor)``. ``removed`` is a list of
+            ``(containerId, key)`` pairs that were removed; for list containers
+            the key is the index the reference had when it was removed.
+            ``cursor`` is None when the sweep is complete.
+        """
+        removed = []
+        if not self.weak:
+            return removed, None
+
+        start_cid, start_key = cursor if cursor is not None else (None, None)
+        remaining = batch_size
+        for cid in keys_from(self.containers, start_cid):
+            container = self.containers[cid]
+            start = start_key if cid == start_cid else None
+            is_mapping = isinstance(container, collections.Mapping)
+            if is_mapping:
+                entries = ((k, container[k]) for k in keys_from(container, start))
+            else:
+                entries = itertools.islice(enumerate(container), start, None)
+
+            dangling = []
+            next_key = None
+            for key, value in entries:
+                if remaining <= 0:
+                    next_key = key
+                    break
+                remaining -= 1
+                if self._v_unwrap(value) is None:
+                    dangling.append(key)
+
+            # Mutate only after we're done iterating; in lists, work
+            # backwards so the indexes we collected remain valid.
+            if dangling:
+                self._copyFrozenContainer(cid)
+            for key in (dangling if is_mapping else reversed(dangling)):
+                del container[key]
+                removed.append((cid, key))
+                logger.log(log_level,
+                           "Removed dangling reference %s from %s in %r",
+                           key, cid, self)
+            if dangling:
+                self._updateContainerLM(container)
+
+            if next_key is not None:
+                if not is_mapping:
+                    next_key -= len(dangling)
+                return removed, (cid, next_key)
+        return removed, None
+
     def getContainedObject(self, containerId, containedId, defaultValue=None):
         """ 
         Given a container ID and an id within that container,
@@ -580,14 +826,268 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
         if result is not defaultValue:
             result = self._v_unwrap(result)
             self.afterGetContainedObject(result)
+            self._notifyHooks('GET', result)
         return result
 
     afterGetContainedObject = _VolatileFunctionProperty('_v_afterGet')
 
+    def getContainedObjectSnapshot(self, containerId, containedId, cache,
+                                   defaultValue=None):
+        """
+        Like :meth:`getContainedObject`, but returns a read-only snapshot
+        of the object from *cache*, a :class:`.SharedSnapshotCache`. If the
+        snapshot of its current revision is already cached, it is not
+        made again, and the object is not unpickled.
+        :meth:`afterGetContainedObject` is not called.
+        """
+        container = self.containers.get(containerId)
+        if container is None:
+            return defaultValue
+        result = self._v_getInContainer(container, containedId, defaultValue)
+        if result is not defaultValue:
+            result = self._v_unwrap(result)
+            result = cache.get(result) if result is not None else defaultValue
+        return result
+
+    def getFrozenContainer(self, containerId, defaultValue=None):
+        """
+        Return a :class:`.FrozenContainer`, an immutable view of the
+        container, or *defaultValue*. The same view is returned until
+        the container's ``lastModified`` changes.
+        """
+        container = self.containers.get(containerId)
+        if container is None:
+            return defaultValue
+        views = getattr(self, '_v_frozen', None)
+        if views is None:
+            views = self._v_frozen = {}
+        view = views.get(containerId)
+        if     view is None or view.version is None \
+            or view.version != getattr(container, 'lastModified', None):
+            from nti.datastructures.frozen import FrozenContainer
+            view = views[containerId] = FrozenContainer(containerId, container,
+                                                        self._v_unwrap)
+        return view
+
+    def _copyFrozenContainer(self, containerId):
+        # Called before changing a container, so outstanding
+        # views keep their contents.
+        views = getattr(self, '_v_frozen', None)
+        view = views.pop(containerId, None) if views else None
+        if view is not None:
+            view._copy()
+
+    def getContainerSnapshot(self, containerId, cache, defaultValue=None):
+        """
+        Like :meth:`getContainer`, but returns a read-only snapshot of the
+        container from *cache*, a :class:`.SharedSnapshotCache`.
+
+        This relies on every change to the container being recorded by the
+        container object itself (as our updates to its ``lastModified`` do),
+        not just by its internal data structures.
+        """
+        container = self.containers.get(containerId)
+        return cache.get(container) if container is not None else defaultValue
+
+    # Change log. See :mod:`nti.datastructures.changelog`.
+
+    changeLog = None
+
+    def enableChangeLog(self, max_entries=10000):
+        """
+        Start recording changes in :attr:`changeLog`, a
+        :class:`.ChangeLog`, if we are not already.
+        """
+        if self.changeLog is None:
+            from nti.datastructures.changelog import ChangeLog
+            log = self.changeLog = ChangeLog(max_entries)
+            log.__parent__ = self
+            if IConnection(self, None) is not None:
+                # pylint: disable=too-many-function-args
+                IConnection(self).add(log)
+        return self.changeLog
+
+    def _recordChange(self, op, containerId, containedId):
+        # Like _notifyHooks, *op* names the operation.
+        log = self.changeLog
+        if log is not None:
+            log.record(getattr(log, op), containerId, containedId)
+
+    # Secondary indexes. See :mod:`nti.datastructures.index`.
+    # Only objects in mapping containers are indexed.
+
+    _indexes = None
+
+    def _iterIndexes(self):
+        return self._indexes.values() if self._indexes else ()
+
+    def addIndex(self, name, index):
+        """
+        Add a secondary index, replacing any existing index with
+        the same name.
+
+        Objects added, deleted or modified from now on are indexed. If we
+        already hold objects, the index is marked incomplete and
+        :meth:`rebuildIndex` must be called to index them.
+        """
+        if self._indexes is None:
+            self._indexes = OOBTree()
+        index.clear()
+        index.complete = not any(len(c) for c in self.containers.values())
+        self._indexes[name] = index
+        return index
+
+    def removeIndex(self, name):
+        """
+        Remove a secondary index.
+
+        :raises: KeyError If there is no such index.
+        """
+        if self._indexes is None:
+            raise KeyError(name)
+        return self._indexes.pop(name)
+
+    def getIndex(self, name, default=None):
+        return self._indexes.get(name, default) if self._indexes else default
+
+    def rebuildIndex(self, name, batch_size=1000, cursor=None):
+        """
+        Index the objects we hold in the named index, examining at most
+        *batch_size* of them.
+
+        Like :meth:`sweepDanglingReferences`, this is meant to be called
+        repeatedly (for example, once per transaction), passing back the
+        returned cursor until it is None, at which point the index is
+        marked complete.
+        """
+        index = self._indexes[name]
+        start_cid, start_key = cursor if cursor is not None else (None, None)
+        remaining = batch_size
+        for cid in keys_from(self.containers, start_cid):
+            container = self.containers[cid]
+            if not isinstance(container, collections.Mapping):
+                continue
+            start = start_key if cid == start_cid else None
+            for key in keys_from(container, start):
+                if remaining <= 0:
+                    return (cid, key)
+                remaining -= 1
+                value = self._v_unwrap(container[key])
+                if value is not None:
+                    index.index_doc((cid, key), value)
+        index.complete = True
+        return None
+
+    def _indexContainedObject(self, container, contained):
+        if self._indexes and isinstance(container, collections.Mapping):
+            docid = (contained.containerId, contained.id)
+            for index in self._indexes.values():
+                index.index_doc(docid, contained)
+
+    def _unindexContainedObject(self, container, docid):
+        if self._indexes and isinstance(container, collections.Mapping):
+            for index in self._indexes.values():
+                index.unindex_doc(docid)
+
+    def containedObjectModified(self, contained):
+        """
+        Update the indexes and change log for an object we hold that has
+        changed. This is called for
+        :class:`~zope.lifecycleevent.interfaces.IObjectModifiedEvent`.
+        """
+        if not self._indexes and self.changeLog is None:
+            return
+        container = self.containers.get(contained.containerId)
+        if container is None:
+            return
+        held = self._v_getInContainer(container, contained.id)
+        if held is not None and self._v_unwrap(held) is contained:
+            self._indexContainedObject(container, contained)
+            self._recordChange('MODIFY', contained.containerId,
+                               contained.id)
+
+    def findContainedObjects(self, docids):
+        """
+        Yield the objects for the document ids returned by index queries,
+        skipping any that no longer exist.
+        """
+        for containerId, containedId in docids:
+            result = self.getContainedObject(containerId, containedId)
+            if result is not None:
+                yield result
+
+    def queryContainedObjects(self, containerIds=None, min_key=None, max_key=None,
+                              provides=None, modified_after=None,
+                              modified_before=None, predicate=None, limit=None):
+        """
+        Yield the contained objects matching all of the given constraints,
+        stopping after *limit* of them.
+
+        Constraints are applied from cheapest to most expensive, so that
+        objects are only loaded from the database when they have to be:
+        only the named containers are examined, mapping containers seek
+        directly to the key range, and the type filter looks only at the
+        class of the (possibly ghost) object. The ``lastModified`` window
+        and the *predicate* require loading the object.
+
+        :keyword containerIds: An iterable of the containers to search, in
+            order. By default, all of them.
+        :keyword min_key: The smallest key (contained id) to return.
+            Key ranges apply to mapping containers; list containers are
+            skipped if either *min_key* or *max_key* is given.
+        :keyword max_key: The largest key to return.
+        :keyword provides: A class or interface (or tuple of them) that
+            the class of the objects must be or implement.
+        :keyword float modified_after: Only objects whose ``lastModified``
+            is at least this.
+        :keyword float modified_before: Only objects whose ``lastModified``
+            is less than this.
+        :keyword predicate: A callable taking the object and returning
+            whether to include it.
+        :keyword int limit: The maximum number of objects to return.
+        """
+        if containerIds is None:
+            containerIds = self.containers.keys()
+        ranged = min_key is not None or max_key is not None
+        check_type = _type_filter(provides) if provides is not None else None
+        remaining = limit
+        if remaining is not None and remaining <= 0:
+            return
+        for containerId in containerIds:
+            container = self.containers.get(containerId)
+            if container is None:
+                continue
+            if isinstance(container, collections.Mapping):
+                values = (container[k] for k in _keys_between(container, min_key, max_key))
+            elif ranged:
+                continue
+            else:
+                values = iter(container)
+            for value in values:
+                obj = self._v_unwrap(value)
+                if obj is None:
+                    continue
+                if check_type is not None and not check_type(obj):
+                    continue
+                if modified_after is not None or modified_before is not None:
+                    lm = getattr(obj, 'lastModified', 0)
+                    if modified_after is not None and lm < modified_after:
+                        continue
+                    if modified_before is not None and lm >= modified_before:
+                        continue
+                if predicate is not None and not predicate(obj):
+                    continue
+                yield obj
+                if remaining is not None:
+                    remaining -= 1
+                    if remaining <= 0:
+                        return
+
     def cleanBroken(self):
         result = 0
-        for container in self.itervalues():
+        for cid, container in self.iteritems():
             if isinstance(container, collections.Mapping):
+                self._copyFrozenContainer(cid)
                 for name, value in list(container.items()):
                     try:
                         value = self._v_wrap(value)
@@ -633,11 +1133,32 @@ class ContainedStorage(PersistentPropertyHolder, ModDateTrackingObject):
             for v in container.values():
                 yield v
 
+    def _findOwnedContainerIds(self):
+        # Recall that we could be holding containers given to __init__
+        # that we are not the parent of
+        return [containerId
+                for containerId, container in self.containers.items()
+                if ILocation.providedBy(container) and container.__parent__ is self]
+
+    def _ownedContainerIdsForUpdate(self):
+        """
+        The set of the ids of the containers we own. Storages from
+        before it was kept get it the first time they add a container.
+        """
+        if self._ownedContainerIds is None:
+            self._ownedContainerIds = OOTreeSet(self._findOwnedContainerIds())
+        return self._ownedContainerIds
+
     def sublocations(self):
-        for container in self.itervalues():
-            # Recall that we could be holding containers given to __init__
-            # that we are not the parent of
-            if ILocation.providedBy(container) and container.__parent__ is self:
+        owned = self._ownedContainerIds
+        if owned is None:
+            # A storage from before owned containers were tracked.
+            # Find them the slow way; this must not change us.
+            owned = self._findOwnedContainerIds()
+        # Only the containers we own are loaded.
+        for containerId in owned:
+            container = self.containers.get(containerId)
+            if container is not None:
                 yield container
 
     def __repr__(self):
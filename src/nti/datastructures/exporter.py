@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming export of a :class:`.ContainedStorage` as JSON lines.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import gzip
+import json
+import collections
+
+import six
+
+from nti.datastructures._util import deactivate
+
+from nti.datastructures.datastructures import keys_from
+
+from nti.externalization.externalization import toExternalObject
+
+from nti.externalization.representation import to_json_representation_externalized
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint written by :class:`ContainedStorageExporter`.
+
+    :return: The checkpoint, or None if *path* does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class ContainedStorageExporter(object):
+    """
+    Writes the externalized form of each object held by a
+    :class:`.ContainedStorage` to a binary file-like object, one JSON
+    object per line.
+
+    Containers are visited in key order, and the objects in each container
+    in key (or index) order. Objects are deactivated once they have been
+    written and the connection cache is periodically garbage collected, so
+    memory use is bounded by the cache size, not the size of the storage.
+
+    Every *checkpoint_interval* objects (and at the end, or when the
+    export fails) the output is flushed, and the position of the last
+    object written and the size of the output are saved to
+    *checkpoint_path*. When compressing, each checkpoint ends the current
+    gzip member, so the output up to a checkpoint is always a complete
+    gzip file.
+
+    An interrupted export can be continued by passing that checkpoint (see
+    :func:`load_checkpoint`) to :meth:`export` along with the same file,
+    opened for reading and writing (``'r+b'``). Anything written after
+    the checkpoint is truncated first, so no object is written twice;
+    a compressed export continues with a new gzip member, which gzip
+    readers handle transparently.
+    """
+
+    #: The default number of objects written between checkpoints.
+    checkpoint_interval = 1000
+
+    def __init__(self, storage, fp, compress=False,
+                 checkpoint_path=None, checkpoint_interval=None):
+        """
+        :param storage: The :class:`.ContainedStorage` to export.
+        :param fp: A file-like object opened for writing bytes.
+        :keyword bool compress: If true, the output is gzip compressed.
+        :keyword str checkpoint_path: If given, where to save checkpoints.
+        :keyword int checkpoint_interval: Overrides :attr:`checkpoint_interval`.
+        """
+        self.storage = storage
+        self.fp = fp
+        self.compress = compress
+        self.checkpoint_path = checkpoint_path
+        if checkpoint_interval is not None:
+            self.checkpoint_interval = checkpoint_interval
+        self._out = None
+        self._position = None
+        self.count = 0
+
+    def _iter_entries(self, containerId, container, after):
+        if isinstance(container, collections.Mapping):
+            for key in keys_from(container, after):
+                if key != after or after is None:
+                    yield key, container[key]
+        else:
+            start = 0 if after is None else after + 1
+            for index in range(start, len(container)):
+                yield index, container[index]
+
+    def _iter_objects(self, checkpoint):
+        storage = self.storage
+        start_cid = start_key = None
+        if checkpoint is not None:
+            start_cid = checkpoint['containerId']
+            start_key = checkpoint['key']
+        jar = getattr(storage, '_p_jar', None)
+        for containerId in keys_from(storage.containers, start_cid):
+            container = storage.containers[containerId]
+            after = start_key if containerId == start_cid else None
+            for key, value in self._iter_entries(containerId, container, after):
+                obj = storage._v_unwrap(value)
+                if obj is not None:
+                    yield containerId, key, obj
+            deactivate(container)
+            if jar is not None:
+                jar.cacheGC()
+
+    def _write(self, obj):
+        line = to_json_representation_externalized(toExternalObject(obj))
+        if isinstance(line, six.text_type):
+            line = line.encode('utf-8')
+        # One write, so that a failure doesn't leave part of a line
+        self._out.write(line + b'\n')
+
+    def _start(self):
+        self._out = self.fp
+        if self.compress:
+            self._out = gzip.GzipFile(fileobj=self.fp, mode='wb')
+
+    def _finish(self):
+        out, self._out = self._out, None
+        if out is not self.fp:
+            out.close()  # Writes the gzip trailer, leaves fp open
+        self.fp.flush()
+
+    def _offset(self):
+        try:
+            return self.fp.tell()
+        except (AttributeError, IOError, OSError):
+            # Not seekable; resuming will have to append
+            return None
+
+    def _save(self):
+        if self.checkpoint_path is None or self._position is None:
+            return
+        containerId, key = self._position
+        data = {'containerId': containerId, 'key': key, 'count': self.count,
+                'offset': self._offset()}
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, self.checkpoint_path)
+
+    def checkpoint(self):
+        """
+        Flush the output and save the current position and output size
+        to the checkpoint path.
+        """
+        exporting = self._out is not None
+        if exporting:
+            self._finish()
+        self._save()
+        if exporting:
+            self._start()
+
+    def export(self, checkpoint=None):
+        """
+        Write every object, or every object after *checkpoint*.
+
+        :param dict checkpoint: A checkpoint previously saved by this class.
+            If it records the size of the output, *fp* is truncated to it.
+        :return: The total number of objects written, including those counted
+            by *checkpoint*.
+        """
+        if checkpoint is not None:
+            self.count = checkpoint.get('count', 0)
+            self._position = (checkpoint['containerId'], checkpoint['key'])
+            offset = checkpoint.get('offset')
+            if offset is not None:
+                self.fp.seek(offset)
+                self.fp.truncate()
+        self._start()
+        try:
+            jar = getattr(self.storage, '_p_jar', None)
+            for containerId, key, obj in self._iter_objects(checkpoint):
+                self._write(obj)
+                deactivate(obj)
+                self.count += 1
+                self._position = (containerId, key)
+                if self.count % self.checkpoint_interval == 0:
+                    self.checkpoint()
+                    if jar is not None:
+                        jar.cacheGC()
+        finally:
+            # Also when failing, so that a resumed export doesn't
+            # repeat what was written since the last checkpoint.
+            self._finish()
+            self._save()
+        logger.info("Exported %d objects from %r", self.count, self.storage)
+        return self.count
+
+
+def export_contained_storage(storage, fp, **kwargs):
+    """
+    Export *storage* to *fp*. Keyword arguments are as for
+    :class:`ContainedStorageExporter`.
+
+    :return: The number of objects written.
+    """
+    return ContainedStorageExporter(storage, fp, **kwargs).export()
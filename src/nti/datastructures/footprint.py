@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reporting how much database space (and so memory, once loaded) the
+containers of :class:`.ContainedStorage` objects use.
+
+:func:`storage_footprint` produces one dictionary per container,
+giving:
+
+``count``
+    The number of entries in the container.
+``strong_refs``, ``weak_refs``, ``dangling_refs``, ``inline_values``
+    How the entries are held: as persistent objects, as weak references
+    (of which ``dangling_refs`` no longer exist), or as values stored in
+    the container's own records.
+``object_bytes``
+    The pickle sizes of the objects the entries refer to: the
+    ``total``, the largest (``max``) and the ``p50``, ``p90`` and
+    ``p99`` percentiles. The percentiles are exact for containers of up
+    to ``sample_size`` objects, and estimated from a uniform sample
+    of that many objects for larger ones.
+``container_bytes``
+    The size of the records of the container itself: the container, its
+    BTree nodes and length.
+``btree``
+    For containers that keep their entries in a BTree, its ``depth``,
+    number of ``buckets``, and ``fill``, the average fraction of each
+    bucket that is used. Otherwise None.
+``persistent_objects``
+    The number of records attributed to the container: its own records,
+    those of its (existing) entries, and records those refer to, up to
+    ``max_depth`` references away. References to the storage, to its
+    parent, and to containers are not followed. Records shared by several
+    containers are counted in each.
+
+The pickles are read directly from the storage, without loading the
+contained objects, and the records of each container are released
+before going on to the next, so memory use does not depend on the size
+of the storages.
+
+:func:`write_footprint` writes the dictionaries as JSON lines for a
+list (or random sample) of storages in a FileStorage; it is also
+available as the ``nti_datastructures_footprint`` console script.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import json
+import random
+import argparse
+import collections
+
+import six
+
+from persistent.wref import WeakRef
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.POSException import POSKeyError
+
+from ZODB.serialize import referencesf
+
+from ZODB.utils import z64
+from ZODB.utils import u64
+
+from nti.datastructures._util import as_oid
+from nti.datastructures._util import deactivate
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The default number of object sizes kept per container to compute
+#: percentiles.
+DEFAULT_SAMPLE_SIZE = 10000
+
+#: The default number of references followed from each contained object.
+DEFAULT_MAX_DEPTH = 2
+
+_PERCENTILES = (50, 90, 99)
+
+# The size of OO buckets before BTrees had max_leaf_size
+_DEFAULT_MAX_LEAF_SIZE = 30
+
+
+class _Sizes(object):
+    """
+    Accumulates sizes, keeping a uniform sample of at most *sample_size*
+    of them (reservoir sampling).
+    """
+
+    def __init__(self, sample_size, rng):
+        self.sample_size = sample_size
+        self.rng = rng
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.sample = []
+
+    def add(self, size):
+        self.count += 1
+        self.total += size
+        self.max = max(self.max, size)
+        if len(self.sample) < self.sample_size:
+            self.sample.append(size)
+        else:
+            i = self.rng.randrange(self.count)
+            if i < self.sample_size:
+                self.sample[i] = size
+
+    def summary(self):
+        result = {'total': self.total, 'max': self.max}
+        ordered = sorted(self.sample)
+        for p in _PERCENTILES:
+            value = 0
+            if ordered:
+                # Nearest rank
+                value = ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+            result['p%d' % p] = value
+        return result
+
+
+def _load(jar, oid):
+    """
+    The pickle of *oid*, or None if it doesn't exist.
+    """
+    try:
+        return jar.db().storage.load(oid, '')[0]
+    except POSKeyError:
+        return None
+
+
+def _btree_nodes(tree):
+    """
+    Yield ``(node, depth)`` for the nodes of a BTree below its root.
+    Buckets held inline by the root are not separate nodes.
+    """
+    state = tree.__getstate__()
+    if not state or len(state) < 2:
+        return
+    todo = [(child, 2) for child in state[0][::2]]
+    while todo:
+        node, depth = todo.pop()
+        yield node, depth
+        if isinstance(node, type(tree)):
+            todo.extend((child, depth + 1)
+                        for child in node.__getstate__()[0][::2])
+
+
+def _btree_stats(tree, structure):
+    """
+    Return the statistics of a BTree, adding its nodes to *structure*.
+    """
+    max_leaf_size = getattr(tree, 'max_leaf_size', _DEFAULT_MAX_LEAF_SIZE)
+    depth = 1
+    buckets = []
+    for node, node_depth in _btree_nodes(tree):
+        structure.append(node)
+        depth = max(depth, node_depth)
+        if not isinstance(node, type(tree)):
+            buckets.append(len(node))
+    if not buckets and len(tree):
+        # One bucket, stored inline
+        buckets.append(len(tree))
+    fill = sum(buckets) / (len(buckets) * max_leaf_size) if buckets else 0.0
+    return {'depth': depth if len(tree) else 0,
+            'buckets': len(buckets),
+            'fill': round(fill, 4)}
+
+
+def _data(container):
+    """
+    The BTree or other object holding the entries of a container.
+    """
+    return getattr(container, '_SampleContainer__data', None)
+
+
+def _values(container):
+    data = _data(container)
+    if data is not None and hasattr(data, 'values'):
+        return data.values()
+    if isinstance(container, collections.Mapping):
+        return container.values()
+    return container
+
+
+def container_footprint(storage, containerId, container,
+                        sample_size=DEFAULT_SAMPLE_SIZE,
+                        max_depth=DEFAULT_MAX_DEPTH,
+                        stop=(), rng=None):
+    """
+    Return the footprint dictionary (described in the module
+    documentation) of one container of *storage*, which must be
+    stored in a database.
+
+    :keyword stop: OIDs of records that are not followed.
+    :keyword rng: The :class:`random.Random` used for sampling.
+    """
+    jar = storage._p_jar
+    rng = rng or random.Random(0)
+    structure = [container]
+    data = _data(container)
+    btree = None
+    if data is not None and hasattr(data, '_p_oid') and hasattr(data, 'maxKey'):
+        structure.append(data)
+        btree = _btree_stats(data, structure)
+    length = getattr(container, '_BTreeContainer__len', None)
+    if getattr(length, '_p_oid', None) is not None:
+        structure.append(length)
+
+    structure_oids = set(obj._p_oid for obj in structure
+                         if obj._p_oid is not None)
+    container_bytes = sum(len(_load(jar, oid) or b'') for oid in structure_oids)
+
+    result = {
+        'containerId': containerId,
+        'type': type(container).__name__,
+        'count': 0,
+        'strong_refs': 0,
+        'weak_refs': 0,
+        'dangling_refs': 0,
+        'inline_values': 0,
+        'container_bytes': container_bytes,
+        'btree': btree,
+    }
+    sizes = _Sizes(sample_size, rng)
+    persistent_objects = len(structure_oids)
+    seen = set(stop) | structure_oids
+    for value in _values(container):
+        result['count'] += 1
+        if isinstance(value, WeakRef):
+            kind, oid = 'weak_refs', value.oid
+        elif getattr(value, '_p_oid', None) is not None:
+            kind, oid = 'strong_refs', value._p_oid
+        else:
+            result['inline_values'] += 1
+            continue
+        result[kind] += 1
+        pickle = _load(jar, oid)
+        if pickle is None:
+            result['dangling_refs'] += 1
+            continue
+        sizes.add(len(pickle))
+        if oid not in seen:
+            seen.add(oid)
+            persistent_objects += 1
+            persistent_objects += _count_references(jar, pickle, seen, max_depth)
+
+    result['object_bytes'] = sizes.summary()
+    result['persistent_objects'] = persistent_objects
+    for obj in reversed(structure):
+        deactivate(obj)
+    return result
+
+
+def _count_references(jar, pickle, seen, max_depth):
+    """
+    Count the records reachable from *pickle* within *max_depth*
+    references that are not in *seen*, adding them to it.
+    """
+    count = 0
+    todo = [(pickle, 1)]
+    while todo:
+        pickle, depth = todo.pop()
+        if depth > max_depth:
+            continue
+        for oid in referencesf(pickle):
+            if oid in seen:
+                continue
+            seen.add(oid)
+            child = _load(jar, oid)
+            if child is not None:
+                count += 1
+                todo.append((child, depth + 1))
+    return count
+
+
+def _stop_oids(storage):
+    stop = set([z64])
+    for obj in (storage, storage.containers, getattr(storage, '__parent__', None)):
+        oid = getattr(obj, '_p_oid', None)
+        if oid is not None:
+            stop.add(oid)
+    return stop
+
+
+def storage_footprint(storage, sample_size=DEFAULT_SAMPLE_SIZE,
+                      max_depth=DEFAULT_MAX_DEPTH, rng=None):
+    """
+    Iterate the footprints of the containers of *storage*, a
+    :class:`.ContainedStorage` that is stored in a database, in
+    containerId order. Each dictionary also has the ``storage`` OID, as
+    an integer.
+    """
+    jar = storage._p_jar
+    rng = rng or random.Random(0)
+    stop = _stop_oids(storage)
+    # Records of containers are attributed to them, not followed
+    # from other containers.
+    for container in storage.containers.values():
+        oid = getattr(container, '_p_oid', None)
+        if oid is not None:
+            stop.add(oid)
+    for containerId, container in storage.containers.items():
+        result = container_footprint(storage, containerId, container,
+                                     sample_size=sample_size,
+                                     max_depth=max_depth,
+                                     stop=stop, rng=rng)
+        result['storage'] = u64(storage._p_oid)
+        yield result
+        jar.cacheGC()
+
+
+def write_footprint(path, oids, fp, sample=None, seed=None, **kwargs):
+    """
+    Write the footprints of the containers of the storages with
+    *oids* in the FileStorage at *path* to *fp*, a file opened for
+    writing bytes, one JSON object per line.
+
+    :param oids: OIDs of :class:`.ContainedStorage` objects, as bytes or
+        integers.
+    :keyword int sample: If given, only report on this many of the
+        storages, chosen at random.
+    :keyword seed: The seed for the random choices.
+    :return: The number of containers reported.
+    Other keyword arguments are passed to :func:`storage_footprint`.
+    """
+    rng = random.Random(seed)
+    oids = list(oids)
+    if sample is not None and sample < len(oids):
+        oids = rng.sample(oids, sample)
+    db = DB(FileStorage(path, read_only=True))
+    count = 0
+    try:
+        conn = db.open()
+        try:
+            for oid in oids:
+                storage = conn.get(as_oid(oid))
+                for result in storage_footprint(storage, rng=rng, **kwargs):
+                    line = json.dumps(result, sort_keys=True)
+                    if isinstance(line, six.text_type):
+                        line = line.encode('utf-8')
+                    fp.write(line)
+                    fp.write(b'\n')
+                    count += 1
+                deactivate(storage.containers)
+                deactivate(storage)
+                conn.cacheGC()
+        finally:
+            conn.close()
+    finally:
+        db.close()
+    logger.info("Reported on %d containers of %d storages in %s",
+                count, len(oids), path)
+    return count
+
+
+def main(argv=None):
+    """
+    Console script: write the footprint of storages as JSON lines.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('path', help="The FileStorage file")
+    parser.add_argument('oids', nargs='*',
+                        help="OIDs of the storages (e.g., 0x2a). "
+                             "If none are given, they are read from stdin, "
+                             "one per line.")
+    parser.add_argument('--sample', type=int,
+                        help="Only report on this many of the storages")
+    parser.add_argument('--seed', type=int,
+                        help="The seed for random sampling")
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help="The number of object sizes sampled per container")
+    parser.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH,
+                        help="How many references to follow from each object")
+    args = parser.parse_args(argv)
+    oids = args.oids or [line.strip() for line in sys.stdin if line.strip()]
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    write_footprint(args.path, [int(oid, 0) for oid in oids], out,
+                    sample=args.sample, seed=args.seed,
+                    sample_size=args.sample_size, max_depth=args.max_depth)
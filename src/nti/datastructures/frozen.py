@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Immutable views of the containers of a :class:`.ContainedStorage`.
+
+:meth:`.ContainedStorage.getFrozenContainer` returns a
+:class:`FrozenContainer`, a read-only mapping of the contents of a
+container as of its current ``lastModified``, its *version*. The view
+shares the live container's data; it is only copied if the storage is
+about to change the container while the view is outstanding. Until the
+container changes, the storage keeps handing out the same view, so it
+can be cached and shared by everything that reads the container.
+
+Only membership is frozen: the values are the live contained objects.
+Changes to a container made other than through the storage (or by
+other transactions, for views kept past the end of a transaction)
+cannot be copied ahead of time; reading such a view raises
+:class:`StaleFrozenContainerError`.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import collections
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class StaleFrozenContainerError(ValueError):
+    """
+    Raised when reading a frozen view whose container has changed
+    without the view being copied first.
+    """
+
+
+class FrozenContainer(collections.Mapping):
+    """
+    A read-only, hashable, versioned view of a container. Lists are
+    presented as mappings from index to value.
+    """
+
+    __slots__ = ('containerId', 'version', '_container', '_unwrap',
+                 '_keys', '_data')
+
+    def __init__(self, containerId, container, unwrap):
+        self.containerId = containerId
+        self.version = getattr(container, 'lastModified', None)
+        self._container = container
+        self._unwrap = unwrap
+        self._keys = self._data = None
+        if not isinstance(container, collections.Mapping) or self.version is None:
+            # We can't detect changes to these
+            self._copy()
+
+    @property
+    def copied(self):
+        """
+        Whether the view has its own copy of the data.
+        """
+        return self._data is not None
+
+    def _copy(self):
+        """
+        Copy the data from the container, if we haven't already. Called
+        before the container changes.
+        """
+        if self._data is not None:
+            return
+        container = self._live()
+        if isinstance(container, collections.Mapping):
+            items = list(container.items())
+        else:
+            items = list(enumerate(container))
+        self._keys = tuple(k for k, _ in items)
+        self._data = dict(items)
+        self._container = None
+
+    def _live(self):
+        container = self._container
+        if getattr(container, 'lastModified', None) != self.version:
+            raise StaleFrozenContainerError(self.containerId, self.version)
+        return container
+
+    def _source(self):
+        return self._data if self._data is not None else self._live()
+
+    def __getitem__(self, key):
+        return self._unwrap(self._source()[key])
+
+    def __iter__(self):
+        return iter(self._keys if self._data is not None else self._live().keys())
+
+    def __len__(self):
+        return len(self._source())
+
+    def __contains__(self, key):
+        return key in self._source()
+
+    def __hash__(self):
+        return hash((self.containerId, self.version))
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenContainer):
+            return NotImplemented
+        return self.containerId == other.containerId \
+           and self.version == other.version \
+           and list(self.items()) == list(other.items())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return "<%s %s version: %s>" % (self.__class__.__name__,
+                                        self.containerId,
+                                        self.version)
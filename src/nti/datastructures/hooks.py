@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Subscribers for the changes made to a :class:`.ContainedStorage`.
+
+The ``afterAddContainedObject`` (and similar) hooks of a storage hold a
+single callable and run synchronously. A :class:`HookRegistry`, found in
+a storage's ``hooks`` attribute, holds any number of subscribers for
+each event. A subscriber can be *deferred*: instead of being called as
+each event happens, it is called after the transaction commits
+successfully, once for each event it is subscribed to that happened,
+as ``subscriber(event, objects)`` with the list of the objects for
+that event. Nothing is delivered if the transaction aborts or fails
+to commit.
+
+Deferred subscribers can also be handed to a queue (anything with a
+``put`` method, such as a :class:`queue.Queue`). After the commit, a
+``(subscriber, event, objects)`` tuple is put on the queue for a worker
+thread to call ``subscriber(event, objects)``. Note that the objects belong to the
+committing connection; workers should only read simple attributes such
+as ids from them, or load the objects in their own connection.
+
+Like the single hooks, the registry is volatile: it belongs to one
+in-memory copy of the storage and is lost if the storage is ghosted.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import transaction
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The events a :class:`HookRegistry` dispatches.
+ADD = 'add'
+DELETE = 'delete'
+GET = 'get'
+
+EVENTS = (ADD, DELETE, GET)
+
+
+class HookRegistry(object):
+    """
+    The subscribers for the events of one storage.
+    """
+
+    # The events, for callers that don't import this module.
+    ADD = ADD
+    DELETE = DELETE
+    GET = GET
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._subscribers = dict((event, []) for event in EVENTS)
+
+    def subscribe(self, event, subscriber, deferred=False, queue=None):
+        """
+        Call *subscriber* for *event*.
+
+        :param str event: One of :data:`ADD`, :data:`DELETE` or :data:`GET`.
+        :param subscriber: Called with each object as the event happens,
+            or, if deferred, with the event and a list of objects after
+            commit.
+        :keyword bool deferred: If true, deliver the events after
+            the transaction successfully commits.
+        :keyword queue: If given, the subscriber is deferred and is
+            put on this queue instead of being called.
+        """
+        if event not in self._subscribers:
+            raise ValueError(event)
+        deferred = deferred or queue is not None
+        self._subscribers[event].append((subscriber, deferred, queue))
+
+    def unsubscribe(self, event, subscriber):
+        """
+        Stop calling *subscriber* for *event*.
+
+        :raises: KeyError If it was not subscribed.
+        """
+        subscribers = self._subscribers[event]
+        for i, (sub, _, _) in enumerate(subscribers):
+            if sub == subscriber:
+                del subscribers[i]
+                return
+        raise KeyError(subscriber)
+
+    def __bool__(self):
+        return any(self._subscribers.values())
+    __nonzero__ = __bool__
+
+    def _transaction(self):
+        jar = getattr(self.storage, '_p_jar', None)
+        manager = getattr(jar, 'transaction_manager', None) or transaction.manager
+        return manager.get()
+
+    def _pending(self):
+        """
+        The events waiting for the current transaction to commit, as a
+        list of ``(event, subscriber, queue, object)``.
+        """
+        txn = self._transaction()
+        try:
+            return txn.data(self)
+        except KeyError:
+            pending = []
+            txn.set_data(self, pending)
+            txn.addAfterCommitHook(self._after_commit, (pending,))
+            return pending
+
+    def notify(self, event, obj):
+        """
+        Deliver *event* for *obj* to the subscribers.
+        """
+        pending = None
+        for subscriber, deferred, queue in self._subscribers[event]:
+            if deferred:
+                if pending is None:
+                    pending = self._pending()
+                pending.append((event, subscriber, queue, obj))
+            else:
+                subscriber(obj)
+
+    def _after_commit(self, status, pending):
+        if not status:
+            return
+        # Group the objects by event and subscriber, keeping their order.
+        batches = []
+        for event, subscriber, queue, obj in pending:
+            for batch in batches:
+                if      batch[0] == event and batch[1] is subscriber \
+                    and batch[2] is queue:
+                    batch[3].append(obj)
+                    break
+            else:
+                batches.append((event, subscriber, queue, [obj]))
+        for event, subscriber, queue, objects in batches:
+            try:
+                if queue is not None:
+                    queue.put((subscriber, event, objects))
+                else:
+                    subscriber(event, objects)
+            except Exception:  # pylint: disable=broad-except
+                # The transaction is committed; there's nothing
+                # to undo, and the other subscribers must still run.
+                logger.exception("Failed to deliver events to %r", subscriber)
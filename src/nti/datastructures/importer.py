@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming bulk import of external objects into a :class:`.ContainedStorage`.
+
+This is the counterpart of :mod:`nti.datastructures.exporter`.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import time
+import heapq
+import itertools
+import collections
+
+import six
+
+import transaction
+
+from zope.interface import Invalid
+
+from nti.externalization.interfaces import StandardExternalFields
+
+from nti.externalization.internalization import update_from_external_object
+
+ID = StandardExternalFields.ID
+CONTAINER_ID = StandardExternalFields.CONTAINER_ID
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class _Unparsable(object):
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+class ImportResult(object):
+    """
+    Summarizes an import.
+    """
+
+    #: The number of objects added to the storage.
+    count = 0
+
+    #: The number of objects rejected.
+    rejected = 0
+
+    #: Seconds spent importing.
+    elapsed = 0.0
+
+    def __init__(self):
+        #: A list of ``(index, reason)`` pairs describing the first
+        #: rejected objects, in input order. ``index`` is the zero-based
+        #: position of the object in the input (not counting blank lines).
+        self.rejects = []
+
+    @property
+    def rate(self):
+        """
+        Objects added per second.
+        """
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return "<%s count: %s rejected: %s rate: %.1f/s>" % (self.__class__.__name__,
+                                                             self.count,
+                                                             self.rejected,
+                                                             self.rate)
+
+
+class ContainedStorageImporter(object):
+    """
+    Creates objects from their external form and adds them to a
+    :class:`.ContainedStorage`.
+
+    Objects are created with the factories registered on the
+    homogeneous containers of the storage, exactly as
+    :meth:`.ContainedStorage.maybeCreateContainedObjectWithType` does, so
+    each external object must have a ``ContainerId`` naming such a
+    container. Objects are buffered and added to the storage in groups
+    per container. Every *savepoint_interval* objects read, all the
+    buffered groups are added and an optimistic savepoint is taken, so
+    that neither the buffers nor the changed objects accumulate in
+    memory for the whole import.
+
+    Objects that can't be created, updated or added are counted and
+    reported, not raised.
+    """
+
+    #: The default number of objects added between savepoints.
+    savepoint_interval = 1000
+
+    #: The default number of objects buffered for a single container.
+    group_size = 100
+
+    #: How many rejects to describe in the :class:`ImportResult`.
+    max_rejects = 1000
+
+    #: The exceptions that cause an object to be rejected. ``Invalid``
+    #: includes the ``ValidationError`` of schema fields.
+    reject_errors = (ValueError, KeyError, TypeError, AttributeError, Invalid)
+
+    def __init__(self, storage, savepoint_interval=None, group_size=None,
+                 notify=False):
+        """
+        :param storage: The :class:`.ContainedStorage` to add to.
+        :keyword int savepoint_interval: Overrides :attr:`savepoint_interval`.
+        :keyword int group_size: Overrides :attr:`group_size`.
+        :keyword bool notify: Passed to
+            :func:`~nti.externalization.internalization.update_from_external_object`.
+            Defaults to False, because bulk loads usually don't want an
+            event for every object.
+        """
+        self.storage = storage
+        if savepoint_interval is not None:
+            self.savepoint_interval = savepoint_interval
+        if group_size is not None:
+            self.group_size = group_size
+        self.notify = notify
+        self.result = None
+        self._groups = None
+        self._rejects = None
+        self._since_savepoint = 0
+
+    def _reject(self, index, reason):
+        self.result.rejected += 1
+        # Groups are added out of input order, so keep the
+        # max_rejects lowest indexes in a heap (of their negatives)
+        if self.max_rejects > 0:
+            heapq.heappush(self._rejects, (-index, reason))
+            if len(self._rejects) > self.max_rejects:
+                heapq.heappop(self._rejects)
+
+    def _create(self, containerId, external):
+        obj = self.storage.maybeCreateContainedObjectWithType(containerId,
+                                                              external)
+        if obj is None:
+            raise TypeError("No factory for container %s" % containerId)
+        update_from_external_object(obj, external, notify=self.notify)
+        obj.containerId = containerId
+        if external.get(ID) and not getattr(obj, 'id', None):
+            obj.id = external[ID]
+        return obj
+
+    def _flush_group(self, containerId):
+        group = self._groups.pop(containerId, ())
+        for index, external in group:
+            try:
+                obj = self._create(containerId, external)
+                self.storage.addContainedObject(obj)
+            except self.reject_errors as e:
+                logger.debug("Rejecting object %s", index, exc_info=True)
+                self._reject(index, str(e))
+            else:
+                self.result.count += 1
+
+    def _flush(self):
+        for containerId in list(self._groups):
+            self._flush_group(containerId)
+
+    def _savepoint(self):
+        self._flush()
+        jar = getattr(self.storage, '_p_jar', None)
+        manager = getattr(jar, 'transaction_manager', None) or transaction.manager
+        manager.savepoint(True)
+        if jar is not None:
+            jar.cacheGC()
+        self._since_savepoint = 0
+
+    def import_objects(self, externals):
+        """
+        Import each external mapping in the iterable *externals*.
+
+        :return: An :class:`ImportResult`.
+        """
+        self.result = result = ImportResult()
+        self._groups = collections.OrderedDict()
+        self._rejects = []
+        self._since_savepoint = 0
+        start = time.time()
+        for index, external in enumerate(externals):
+            if isinstance(external, _Unparsable):
+                self._reject(index, external.reason)
+                continue
+            if not isinstance(external, collections.Mapping):
+                self._reject(index, "Not a mapping")
+                continue
+            containerId = external.get(CONTAINER_ID)
+            if not containerId:
+                self._reject(index, "No %s" % CONTAINER_ID)
+                continue
+            group = self._groups.setdefault(containerId, [])
+            group.append((index, external))
+            # Buffered objects count too, or many small groups would
+            # never be added until the end
+            self._since_savepoint += 1
+            if len(group) >= self.group_size:
+                self._flush_group(containerId)
+            if self._since_savepoint >= self.savepoint_interval:
+                self._savepoint()
+        self._flush()
+        result.rejects = sorted((-i, reason) for i, reason in self._rejects)
+        result.elapsed = time.time() - start
+        logger.info("Imported into %r: %r", self.storage, result)
+        return result
+
+    def import_lines(self, lines):
+        """
+        Import from an iterable of JSON lines, such as an open file
+        (which may be a :class:`gzip.GzipFile`). Blank lines are ignored,
+        and lines that are not valid JSON are rejected.
+
+        :return: An :class:`ImportResult`.
+        """
+        def externals():
+            for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield _Unparsable(str(e))
+        return self.import_objects(externals())
+
+
+def import_contained_storage(storage, source, **kwargs):
+    """
+    Import into *storage* from *source*, which is either an iterable of
+    JSON lines or of external mappings. Keyword arguments are as for
+    :class:`ContainedStorageImporter`.
+
+    :return: An :class:`ImportResult`.
+    """
+    importer = ContainedStorageImporter(storage, **kwargs)
+    source = iter(source)
+    try:
+        first = next(source)
+    except StopIteration:
+        return importer.import_objects(())
+    source = itertools.chain((first,), source)
+    if isinstance(first, (six.text_type, bytes)):
+        return importer.import_lines(source)
+    return importer.import_objects(source)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Secondary indexes over the objects held by a :class:`.ContainedStorage`.
+
+Indexes are added to a storage with
+:meth:`.ContainedStorage.addIndex`, after which the storage keeps them
+up to date as objects are added, deleted and modified. Objects are
+identified in an index by their *document id*, the pair
+``(containerId, id)``. Queries return sets of document ids (BTree sets),
+which can be combined with :func:`intersection` and :func:`union` and
+resolved with :meth:`.ContainedStorage.findContainedObjects`.
+
+Indexed values become keys in BTrees, so all the values in one index
+must be mutually comparable.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import functools
+import itertools
+
+from BTrees.Length import Length
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from BTrees.OOBTree import union as _union
+from BTrees.OOBTree import intersection as _intersection
+
+from persistent import Persistent
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def intersection(*sets):
+    """
+    Return the document ids present in all of *sets*.
+    """
+    if not sets:
+        return OOTreeSet()
+    if len(sets) == 1:
+        return OOTreeSet(sets[0])
+    return functools.reduce(_intersection, sets) or OOTreeSet()
+
+
+def union(*sets):
+    """
+    Return the document ids present in any of *sets*.
+    """
+    return functools.reduce(_union, sets, OOTreeSet())
+
+
+class AbstractIndex(Persistent):
+    """
+    Base class for indexes. Maps each indexed value to the set of
+    documents having it (the forward index) and each document to its
+    values (the reverse index).
+
+    The values for an object come from its *attribute*, or from calling
+    *discriminator* (which must be picklable, for example a module-level
+    function) with the object. Objects with a value of None are not
+    indexed. Subclasses define ``_values(value)`` to return a tuple of
+    the values to index for the discriminated *value*.
+    """
+
+    #: False while an index added to a non-empty storage is being
+    #: rebuilt; queries may then be missing results.
+    complete = True
+
+    def __init__(self, attribute=None, discriminator=None):
+        if (attribute is None) == (discriminator is None):
+            raise TypeError("Exactly one of attribute or discriminator is required")
+        self.attribute = attribute
+        self.discriminator = discriminator
+        self.clear()
+
+    def clear(self):
+        self._fwd = OOBTree()
+        self._rev = OOBTree()
+        self._num_docs = Length()
+
+    def __len__(self):
+        return self._num_docs()
+
+    def _value(self, obj):
+        if self.discriminator is not None:
+            return self.discriminator(obj)
+        return getattr(obj, self.attribute, None)
+
+    def index_doc(self, docid, obj):
+        value = self._value(obj)
+        values = self._values(value) if value is not None else ()
+        old = self._rev.get(docid)
+        if old == values:
+            return
+        if old is not None:
+            self.unindex_doc(docid)
+        if not values:
+            return
+        for value in values:
+            docs = self._fwd.get(value)
+            if docs is None:
+                docs = self._fwd[value] = OOTreeSet()
+            docs.add(docid)
+        self._rev[docid] = values
+        self._num_docs.change(1)
+
+    def unindex_doc(self, docid):
+        values = self._rev.pop(docid, None)
+        if values is None:
+            return
+        for value in values:
+            docs = self._fwd.get(value)
+            if docs is not None:
+                docs.remove(docid)
+                if not docs:
+                    del self._fwd[value]
+        self._num_docs.change(-1)
+
+    def unindex_container(self, containerId):
+        """
+        Unindex all the documents from one container.
+        """
+        docids = itertools.takewhile(lambda docid: docid[0] == containerId,
+                                     self._rev.keys((containerId,)))
+        for docid in list(docids):
+            self.unindex_doc(docid)
+
+    def values(self):
+        """
+        The distinct indexed values, in order.
+        """
+        return self._fwd.keys()
+
+    def documentValues(self, docid, default=None):
+        """
+        The values indexed for *docid*.
+        """
+        return self._rev.get(docid, default)
+
+    def _docs(self, value):
+        # The index's own set; don't return it to callers.
+        return self._fwd.get(value, None) or OOTreeSet()
+
+
+class FieldIndex(AbstractIndex):
+    """
+    Indexes a single value per object.
+    """
+
+    def _values(self, value):
+        return (value,)
+
+    def apply(self, value):
+        """
+        Documents whose value equals *value*.
+        """
+        return OOTreeSet(self._docs(value))
+
+    def applyRange(self, min=None, max=None):  # pylint: disable=redefined-builtin
+        """
+        Documents whose value is between *min* and *max*, inclusive.
+        Either bound may be None.
+        """
+        return union(*self._fwd.values(min, max))
+
+
+class KeywordIndex(AbstractIndex):
+    """
+    Indexes each of a collection of values per object (for example, the
+    users an object is shared with).
+    """
+
+    def _values(self, value):
+        return tuple(sorted(set(value)))
+
+    def apply(self, values, operator='or'):
+        """
+        Documents that have any (*operator* ``'or'``) or all
+        (*operator* ``'and'``) of *values*.
+        """
+        sets = [self._docs(v) for v in values]
+        if operator == 'and':
+            return intersection(*sets)
+        if operator == 'or':
+            return union(*sets)
+        raise ValueError(operator)
+
+
+class SetIndex(AbstractIndex):
+    """
+    Tracks the set of objects for which the discriminated value is
+    true (for example, ``discriminator=is_shared``).
+    """
+
+    def _values(self, value):
+        return (True,) if value else ()
+
+    def apply(self):
+        """
+        All documents in the set.
+        """
+        return OOTreeSet(self._docs(True))
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A compact, read-only index of which keys the containers of
+:class:`.ContainedStorage` objects have, and the OIDs of the objects
+they refer to, that can be searched without a database connection.
+
+:func:`write_index` exports the ``(storage, containerId, key) -> OID``
+entries of a set of storages to a file. :class:`KeyIndex` memory-maps
+that file and binary-searches it in place: nothing is unpickled or read
+into memory up front, so opening it is cheap, and any number of worker
+processes that map the same file share one copy in the operating
+system's page cache.
+
+The file is made of four parts, all integers big-endian:
+
+``header``
+    The magic ``NTIKEYX1``, then the number of storages, the number
+    of entries and the size of the key data.
+``storages``
+    One fixed-size record per storage, sorted by OID: the OID, the
+    storage's ``lastModified`` when it was exported, and the position
+    and number of its entries.
+``entries``
+    One fixed-size record per entry, sorted by storage and then by key:
+    the offset and length of the key in the key data and the OID.
+``keys``
+    The containerId and key of each entry, encoded in UTF-8 and
+    separated by a NUL byte, so that their bytes sort like the pairs.
+
+Only entries that refer to persistent objects, directly or through
+weak references, are exported; the keys of list containers are
+their positions, which are not worth indexing.
+
+Passing the previous index to :func:`write_index` makes it
+incremental: the entries of storages whose ``lastModified`` hasn't
+changed are copied from it, and only the other storages' containers are
+loaded. The storage's ``lastModified`` changes when objects are added to
+or deleted from it, but not when containers are added with
+``addContainer`` or removed with ``deleteContainer``; storages changed
+that way must be given as *force*. The new index replaces the old file
+atomically, so readers can keep using the old one until they
+:meth:`~KeyIndex.reload`.
+
+:func:`build_index` does this for storages in a FileStorage; it is also
+available as the ``nti_datastructures_keyindex`` console script.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import mmap
+import struct
+import shutil
+import argparse
+import tempfile
+import collections
+
+import six
+
+from persistent.wref import WeakRef
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from nti.datastructures._util import as_oid
+from nti.datastructures._util import deactivate
+
+logger = __import__('logging').getLogger(__name__)
+
+MAGIC = b'NTIKEYX1'
+
+_HEADER = struct.Struct('>8sQQQ')
+_STORAGE = struct.Struct('>8sdQQ')
+_ENTRY = struct.Struct('>QI8s')
+
+_SEPARATOR = b'\x00'
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return six.text_type(value).encode('utf-8')
+
+
+def _key(containerId, key):
+    return _text(containerId) + _SEPARATOR + _text(key)
+
+
+def _value_oid(value):
+    if isinstance(value, WeakRef):
+        return value.oid
+    return getattr(value, '_p_oid', None)
+
+
+def storage_entries(storage):
+    """
+    Return the sorted list of ``(key, oid)`` pairs of *storage*, where
+    *key* is the encoded containerId and key. Only the containers (and
+    their BTrees) are loaded, not the objects they hold.
+    """
+    result = []
+    for containerId, container in storage.containers.items():
+        if isinstance(container, collections.Mapping):
+            for key, value in container.items():
+                oid = _value_oid(value)
+                if oid is not None:
+                    result.append((_key(containerId, key), oid))
+        deactivate(container)
+    result.sort()
+    return result
+
+
+class KeyIndex(object):
+    """
+    A memory-mapped index written by :func:`write_index`.
+
+    Storages are identified by their OIDs, as bytes or integers. The
+    OIDs returned are bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            self._stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._storage_count, self._entry_count, _ = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError("Not a key index", self.path)
+        self._storages_start = _HEADER.size
+        self._entries_start = self._storages_start \
+                            + self._storage_count * _STORAGE.size
+        self._keys_start = self._entries_start \
+                         + self._entry_count * _ENTRY.size
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def reload(self):
+        """
+        If the file has been replaced since it was opened, open the new
+        one. Return whether it was.
+        """
+        stat = os.stat(self.path)
+        if      (stat.st_ino, stat.st_mtime, stat.st_size) \
+            == (self._stat.st_ino, self._stat.st_mtime, self._stat.st_size):
+            return False
+        old = self._map
+        self._open()
+        old.close()
+        return True
+
+    def __len__(self):
+        return self._entry_count
+
+    def _storage_record(self, i):
+        return _STORAGE.unpack_from(self._map,
+                                    self._storages_start + i * _STORAGE.size)
+
+    def _find_storage(self, storage):
+        oid = as_oid(storage)
+        lo, hi = 0, self._storage_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._storage_record(mid)
+            if record[0] < oid:
+                lo = mid + 1
+            elif record[0] > oid:
+                hi = mid
+            else:
+                return record
+        return None
+
+    def storages(self):
+        """
+        Iterate the OIDs of the storages in the index, in order.
+        """
+        for i in range(self._storage_count):
+            yield self._storage_record(i)[0]
+
+    def lastModified(self, storage):
+        """
+        The ``lastModified`` of *storage* when it was indexed, or None
+        if it is not in the index.
+        """
+        record = self._find_storage(storage)
+        return record[1] if record is not None else None
+
+    def _entry(self, i):
+        offset, length, oid = _ENTRY.unpack_from(
+            self._map, self._entries_start + i * _ENTRY.size)
+        start = self._keys_start + offset
+        return self._map[start:start + length], oid
+
+    def _range(self, storage):
+        record = self._find_storage(storage)
+        if record is None:
+            return 0, 0
+        return record[2], record[2] + record[3]
+
+    def _lower_bound(self, lo, hi, key):
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, storage, containerId, key, default=None):
+        """
+        Return the OID of the object with *key* in the container
+        *containerId* of *storage*, or *default*.
+        """
+        lo, hi = self._range(storage)
+        target = _key(containerId, key)
+        i = self._lower_bound(lo, hi, target)
+        if i < hi:
+            found, oid = self._entry(i)
+            if found == target:
+                return oid
+        return default
+
+    def items(self, storage, containerId=None):
+        """
+        Iterate the ``(containerId, key, oid)`` entries of *storage*,
+        or just of its container *containerId*, in order. The
+        containerIds and keys are text.
+        """
+        lo, hi = self._range(storage)
+        prefix = b''
+        if containerId is not None:
+            prefix = _text(containerId) + _SEPARATOR
+            lo = self._lower_bound(lo, hi, prefix)
+        for i in range(lo, hi):
+            data, oid = self._entry(i)
+            if not data.startswith(prefix):
+                break
+            cid, key = data.split(_SEPARATOR, 1)
+            yield cid.decode('utf-8'), key.decode('utf-8'), oid
+
+
+class _Writer(object):
+    """
+    Writes the entries and keys to temporary files as they are
+    added, then puts the parts together.
+    """
+
+    def __init__(self, directory):
+        self._entries = tempfile.TemporaryFile(dir=directory)
+        self._keys = tempfile.TemporaryFile(dir=directory)
+        self._storages = []
+        self._entry_count = 0
+        self._keys_size = 0
+
+    def add(self, oid, lastModified, entries):
+        first = self._entry_count
+        for key, value in entries:
+            self._entries.write(_ENTRY.pack(self._keys_size, len(key), value))
+            self._keys.write(key)
+            self._keys_size += len(key)
+            self._entry_count += 1
+        self._storages.append(_STORAGE.pack(oid, lastModified, first,
+                                            self._entry_count - first))
+
+    def write(self, fp):
+        fp.write(_HEADER.pack(MAGIC, len(self._storages),
+                              self._entry_count, self._keys_size))
+        for record in self._storages:
+            fp.write(record)
+        for part in (self._entries, self._keys):
+            part.seek(0)
+            shutil.copyfileobj(part, fp)
+            part.close()
+
+
+def write_index(path, storages, previous=None, force=()):
+    """
+    Write the index of *storages* to *path*, replacing it if it
+    exists.
+
+    :param storages: :class:`.ContainedStorage` objects stored in a
+        database, or callables returning them, in a mapping from their
+        OIDs (as for :class:`KeyIndex`).
+    :keyword previous: A :class:`KeyIndex` (such as the one at *path*)
+        whose entries are reused for storages that have the same
+        ``lastModified``; their containers aren't loaded.
+    :keyword force: OIDs of storages not to reuse.
+    :return: The number of storages that were exported rather than
+        reused.
+    """
+    force = set(as_oid(oid) for oid in force)
+    ordered = sorted((as_oid(oid), storage) for oid, storage in storages.items())
+    directory = os.path.dirname(os.path.abspath(path))
+    writer = _Writer(directory)
+    exported = 0
+    for oid, storage in ordered:
+        if callable(storage):
+            storage = storage()
+        lastModified = storage.lastModified
+        if      previous is not None and oid not in force \
+            and previous.lastModified(oid) == lastModified:
+            lo, hi = previous._range(oid)
+            entries = (previous._entry(i) for i in range(lo, hi))
+        else:
+            entries = storage_entries(storage)
+            exported += 1
+        writer.add(oid, lastModified, entries)
+        jar = getattr(storage, '_p_jar', None)
+        deactivate(storage.containers)
+        deactivate(storage)
+        if jar is not None:
+            jar.cacheGC()
+
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            writer.write(fp)
+        _replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    logger.info("Indexed %d storages (%d exported) in %s",
+                len(ordered), exported, path)
+    return exported
+
+
+def build_index(db_path, oids, path, refresh=False, force=()):
+    """
+    Write the index of the storages with *oids* in the FileStorage at
+    *db_path* to *path*.
+
+    :keyword bool refresh: If true, and *path* exists, reuse its
+        entries for storages that haven't changed. If *oids* is empty,
+        refresh the storages already in the index.
+    :return: The number of storages that were exported.
+    """
+    previous = None
+    if refresh and os.path.exists(path):
+        previous = KeyIndex(path)
+        oids = list(oids) or list(previous.storages())
+    db = DB(FileStorage(db_path, read_only=True))
+    try:
+        conn = db.open()
+        try:
+            storages = dict((as_oid(oid), lambda oid=oid: conn.get(as_oid(oid)))
+                            for oid in oids)
+            return write_index(path, storages, previous, force)
+        finally:
+            conn.close()
+    finally:
+        db.close()
+        if previous is not None:
+            previous.close()
+
+
+def main(argv=None):
+    """
+    Console script: write or refresh a key index of storages.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('db_path', help="The FileStorage file")
+    parser.add_argument('path', help="The index file")
+    parser.add_argument('oids', nargs='*',
+                        help="OIDs of the storages (e.g., 0x2a). "
+                             "If none are given, they are read from stdin, "
+                             "one per line, unless refreshing.")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Reuse the entries of unchanged storages")
+    parser.add_argument('--force', action='append', default=[],
+                        help="The OID of a storage not to reuse")
+    args = parser.parse_args(argv)
+    oids = args.oids
+    if not oids and not args.refresh:
+        oids = [line.strip() for line in sys.stdin if line.strip()]
+    build_index(args.db_path, [int(oid, 0) for oid in oids],
+                args.path, refresh=args.refresh,
+                force=[int(oid, 0) for oid in args.force])
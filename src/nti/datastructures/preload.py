@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Warming ZODB caches with :class:`.ContainedStorage` objects.
+
+After a restart, the first requests for each active user are slow
+because the storage, the buckets of its ``containers`` BTree and its
+containers all have to be loaded. A :class:`ContainedStoragePreloader`
+loads them ahead of time on background threads.
+
+Each thread uses its own connection; when it is done, the connection
+(and its now warm cache) is returned to the database's pool to be
+reused by requests. Storages that support prefetching (such as ZEO and
+RelStorage) also warm their shared caches.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import time
+import itertools
+import threading
+import collections
+
+from six.moves import queue
+
+import transaction
+
+from persistent.TimeStamp import TimeStamp
+
+from ZODB.utils import get_pickle_metadata
+
+from nti.datastructures._util import as_oid
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The classes :func:`recently_modified_storages` looks for by default.
+STORAGE_CLASSES = (
+    ('nti.datastructures.datastructures', 'ContainedStorage'),
+)
+
+
+def recently_modified_storages(storage, since, classes=STORAGE_CLASSES):
+    """
+    Find storages that were modified since a given time by reading the
+    transaction log of *storage* (a ZODB storage that supports
+    iteration, such as a FileStorage). Only the class of each record is
+    examined; nothing is unpickled.
+
+    A :class:`.ContainedStorage` is rewritten whenever its ``lastModified``
+    changes, that is, whenever an object is added or removed.
+
+    :param float since: A time, as returned by :func:`time.time`.
+    :keyword classes: A sequence of ``(module, class name)`` pairs.
+    :return: A list of OIDs, most recently modified first.
+    """
+    classes = frozenset(classes)
+    gmt = time.gmtime(since)
+    start = TimeStamp(*(gmt[:5] + (gmt[5] + since % 1,))).raw()
+    found = collections.OrderedDict()
+    for txn in storage.iterator(start):
+        for record in txn:
+            if record.data and get_pickle_metadata(record.data) in classes:
+                # Keep the most recent at the end
+                found.pop(record.oid, None)
+                found[record.oid] = txn.tid
+    return list(reversed(found))
+
+
+def _activate(obj):
+    activate = getattr(obj, '_p_activate', None)
+    if activate is not None:
+        activate()
+
+
+class ContainedStoragePreloader(object):
+    """
+    Loads storages, their containers and the first few entries of each
+    container into ZODB caches using background threads.
+
+    Call :meth:`start` to begin, and :meth:`join` to wait for the work to
+    finish. The work stops early if :meth:`cancel` is called or if the
+    estimated size of the caches of the connections we use exceeds
+    *memory_budget*.
+    """
+
+    def __init__(self, db, oids, entries=10, threads=4, memory_budget=None):
+        """
+        :param db: The :class:`ZODB.DB`.
+        :param oids: An iterable of storage OIDs (bytes or ints), for
+            example from :func:`recently_modified_storages`. They are
+            warmed in the order given.
+        :keyword int entries: How many of the entries of each container
+            to load.
+        :keyword int threads: The number of threads (and connections).
+        :keyword int memory_budget: If given, stop once the connection
+            caches are estimated to hold this many bytes.
+        """
+        self.db = db
+        self.entries = entries
+        self.threads = threads
+        self.memory_budget = memory_budget
+        self._queue = queue.Queue()
+        for oid in oids:
+            self._queue.put(as_oid(oid))
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._workers = []
+        self.storages_loaded = 0
+        self.objects_loaded = 0
+
+    def cancel(self):
+        """
+        Stop as soon as possible.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _estimated_size(self):
+        with self._lock:
+            return sum(c._cache.total_estimated_size for c in self._connections)
+
+    def _over_budget(self):
+        if self.memory_budget is not None \
+            and self._estimated_size() >= self.memory_budget:
+            logger.info("Stopping preload; memory budget of %s exhausted",
+                        self.memory_budget)
+            self.cancel()
+        return self.cancelled
+
+    def _load(self, conn, objects):
+        objects = [o for o in objects if o is not None]
+        conn.prefetch(*[o for o in objects if getattr(o, '_p_oid', None)])
+        for obj in objects:
+            _activate(obj)
+        with self._lock:
+            self.objects_loaded += len(objects)
+
+    def _warm(self, conn, oid):
+        storage = conn.get(oid)
+        _activate(storage)
+        containers = list(storage.containers.values())
+        self._load(conn, containers)
+        for container in containers:
+            if self._over_budget():
+                return
+            if isinstance(container, collections.Mapping):
+                values = itertools.islice(container.values(), self.entries)
+            else:
+                values = container[:self.entries]
+            self._load(conn, [storage._v_unwrap(v) for v in values])
+        with self._lock:
+            self.storages_loaded += 1
+
+    def _run(self):
+        conn = self.db.open(transaction.TransactionManager())
+        with self._lock:
+            self._connections.append(conn)
+        try:
+            while not self._over_budget():
+                try:
+                    oid = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._warm(conn, oid)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Failed to preload %r", oid)
+        finally:
+            conn.transaction_manager.abort()
+            conn.close()
+
+    def start(self):
+        """
+        Start the background threads.
+        """
+        for i in range(self.threads):
+            worker = threading.Thread(target=self._run,
+                                      name='ContainedStoragePreloader-%s' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def join(self, timeout=None):
+        """
+        Wait for the background threads to finish.
+
+        :return: True if they have all finished.
+        """
+        for worker in self._workers:
+            worker.join(timeout)
+        return not any(w.is_alive() for w in self._workers)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Finding the most recently modified objects across many
+:class:`.ContainedStorage` objects, such as the activity of all the
+members of a group, without reading all of their objects.
+
+:func:`most_recent` performs a lazy k-way merge of its sources, newest
+first. It reads a source only when that source could contain the next
+newest object:
+
+* A storage with a complete :class:`.FieldIndex` on ``lastModified``
+  (see :meth:`.ContainedStorage.addIndex`) is read in index order, one
+  object at a time.
+* Otherwise, each container is used as a source. The ``lastModified``
+  of a container bounds that of the objects added to it, so the
+  container is only loaded (and sorted) once everything newer has been
+  returned. Objects that were modified in place after being added may
+  be newer than their container; use an index if that matters.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import collections
+
+from nti.datastructures.datastructures import ContainedStorage
+
+logger = __import__('logging').getLogger(__name__)
+
+_INFINITY = float('inf')
+
+_EXPAND = 0
+_ITEM = 1
+
+
+def _lastModified(obj):
+    return getattr(obj, 'lastModified', 0) or 0
+
+
+def _identity(obj):
+    return obj
+
+
+def _container_source(container, unwrap):
+    values = container.values() if isinstance(container, collections.Mapping) else container
+    objects = [o for o in (unwrap(v) for v in values) if o is not None]
+    objects.sort(key=_lastModified, reverse=True)
+    return ((_lastModified(o), o) for o in objects)
+
+
+def _index_source(storage, index, containerId):
+    for value in reversed(index.values()):
+        for docid in index.apply(value):
+            if containerId is None or docid[0] == containerId:
+                obj = storage.getContainedObject(*docid)
+                if obj is not None:
+                    yield value, obj
+
+
+def _container_bound(container):
+    return getattr(container, 'lastModified', 0) or _INFINITY
+
+
+def _sources(source, containerId, index_name):
+    """
+    Yield ``(bound, thunk)`` pairs, where *thunk* returns an iterator of
+    ``(lastModified, object)`` pairs, newest first, none newer than
+    *bound*.
+    """
+    if not isinstance(source, ContainedStorage):
+        yield (_container_bound(source),
+               lambda: _container_source(source, _identity))
+        return
+
+    index = source.getIndex(index_name)
+    if index is not None and index.complete:
+        if len(index):
+            yield (index.values()[-1],
+                   lambda: _index_source(source, index, containerId))
+        return
+
+    if containerId is None:
+        containers = source.containers.values()
+    else:
+        containers = [source.containers.get(containerId)]
+    for container in containers:
+        if container is not None:
+            # Bind the loop variable now
+            def thunk(container=container):
+                return _container_source(container, source._v_unwrap)
+            yield _container_bound(container), thunk
+
+
+def most_recent(sources, k=None, containerId=None, index_name='lastModified'):
+    """
+    Lazily iterate the objects in *sources*, most recently modified
+    first.
+
+    :param sources: An iterable of :class:`.ContainedStorage` objects
+        and/or containers.
+    :keyword int k: If given, stop after this many objects.
+    :keyword containerId: If given, only objects in the container with
+        this id are returned from storages.
+    :keyword str index_name: The name of the ``lastModified`` index to use
+        in storages that have one.
+    """
+    heap = []
+    counter = itertools.count()
+    for source in sources:
+        for bound, thunk in _sources(source, containerId, index_name):
+            heap.append((-bound, next(counter), _EXPAND, thunk))
+    heapq.heapify(heap)
+
+    def _push_next(entries):
+        for lastModified, obj in entries:
+            heapq.heappush(heap, (-lastModified, next(counter), _ITEM, (obj, entries)))
+            break
+
+    def _merge():
+        while heap:
+            _, _, kind, payload = heapq.heappop(heap)
+            if kind == _EXPAND:
+                _push_next(iter(payload()))
+            else:
+                obj, entries = payload
+                yield obj
+                _push_next(entries)
+
+    return itertools.islice(_merge(), k)
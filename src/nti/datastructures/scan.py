@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scanning the containers of a :class:`.ContainedStorage` in parallel,
+using a pool of processes that each open their own connection to
+a :class:`~ZODB.FileStorage.FileStorage`.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import functools
+import multiprocessing
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from nti.datastructures._util import as_oid
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def partition_keys(keys, count):
+    """
+    Divide the sorted sequence *keys* into at most *count* contiguous
+    lists of roughly equal size.
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+    count = max(1, min(count, len(keys)))
+    size, extra = divmod(len(keys), count)
+    result = []
+    index = 0
+    for i in range(count):
+        end = index + size + (1 if i < extra else 0)
+        result.append(keys[index:end])
+        index = end
+    return result
+
+
+def _open_db(path):
+    return DB(FileStorage(path, read_only=True))
+
+
+#: The database of a worker process, opened once by :func:`_init_worker`.
+_worker_db = None
+
+
+def _init_worker(path):
+    # The pool's initializer. The database is never closed explicitly;
+    # it is read-only, and goes away with the process.
+    global _worker_db
+    _worker_db = _open_db(path)
+
+
+def _scan_containers(args):
+    oid, containerIds, map_func, reduce_func = args
+    conn = _worker_db.open()
+    try:
+        containers = conn.get(as_oid(oid)).containers
+        results = []
+        for containerId in containerIds:
+            container = containers.get(containerId)
+            if container is not None:
+                results.append(map_func(containerId, container))
+            conn.cacheGC()
+        if reduce_func is None or not results:
+            return results
+        # Wrapped so the parent can tell an empty range from a result
+        return [functools.reduce(reduce_func, results)]
+    finally:
+        conn.close()
+
+
+def container_ids(path, oid):
+    """
+    Return a sorted list of the containerIds in the storage with *oid*
+    in the FileStorage at *path*.
+    """
+    db = _open_db(path)
+    try:
+        conn = db.open()
+        try:
+            return sorted(conn.get(as_oid(oid)).containers.keys())
+        finally:
+            conn.close()
+    finally:
+        db.close()
+
+
+def parallel_scan(path, oid, map_func, reduce_func=None, initial=None,
+                  processes=None, partitions=None):
+    """
+    Call *map_func* for each container of a :class:`.ContainedStorage`,
+    using a pool of worker processes, and combine the results.
+
+    The sorted containerIds are split into contiguous lists which are
+    handed out to the workers. Each worker opens the storage read-only
+    once, and for each list it is given, calls ``map_func(containerId,
+    container)`` for each container (that still exists) and reduces the
+    results with *reduce_func*. The containers may be held in any
+    mapping, not only a BTree.
+    The parent then reduces the results of the workers, starting with
+    *initial*. Because results are combined in an unspecified order,
+    *reduce_func* should be associative and commutative.
+
+    *map_func* and *reduce_func* must be picklable (e.g., module-level
+    functions). Changes made by workers are never committed.
+
+    :param str path: The path to the FileStorage file.
+    :param oid: The OID of the :class:`.ContainedStorage`, as bytes or an int.
+    :keyword reduce_func: A function of two arguments. If not given, the
+        result is a list of all the values returned by *map_func*, in no
+        particular order.
+    :keyword int processes: The number of worker processes. Defaults to the
+        number of CPUs.
+    :keyword int partitions: The number of lists to divide the containers into.
+        Defaults to four per process, to balance uneven containers.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    partitions = partitions or processes * 4
+    tasks = [(oid, containerIds, map_func, reduce_func)
+             for containerIds in partition_keys(container_ids(path, oid),
+                                                partitions)]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(path,))
+    try:
+        results = list(pool.imap_unordered(_scan_containers, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    logger.info("Scanned %d ranges of %s using %d processes",
+                len(tasks), path, processes)
+    results = [value for values in results for value in values]
+    if reduce_func is None:
+        return results
+    return functools.reduce(reduce_func, results, initial)
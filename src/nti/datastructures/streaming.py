@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming externalization of large containers.
+
+Externalizing a container with ``toExternalObject`` builds the external
+form of every item, and then the whole JSON document, in memory. The
+functions here produce the same kind of document incrementally: first
+the container-level fields (``Class``, ``Last Modified``, ``Links``
+and the other standard fields, as decorated), then the ``Items``,
+externalized and encoded *chunk_size* at a time. Items are deactivated
+once they have been encoded and the connection cache is garbage
+collected between chunks, so memory use depends on the chunk size, not
+the size of the container.
+
+:func:`iter_container_json` is suitable as the ``app_iter`` of a WSGI
+response; :func:`write_container_json` writes to a file-like object.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import collections
+
+import six
+
+from nti.datastructures._util import deactivate
+
+from nti.externalization.externalization import toExternalObject
+from nti.externalization.externalization import to_standard_external_dictionary
+
+from nti.externalization.interfaces import StandardExternalFields
+
+from nti.externalization.representation import to_json_representation_externalized
+
+ITEMS = StandardExternalFields.ITEMS
+
+logger = __import__('logging').getLogger(__name__)
+
+#: The default number of items externalized at a time.
+DEFAULT_CHUNK_SIZE = 100
+
+
+def _identity(obj):
+    return obj
+
+
+def _values(container):
+    if isinstance(container, collections.Mapping):
+        return container.values()
+    return container
+
+
+def iter_container_chunks(container, chunk_size=DEFAULT_CHUNK_SIZE,
+                          unwrap=_identity, **kwargs):
+    """
+    Iterate the external form of *container* in pieces.
+
+    The first value is the dictionary of container-level fields. It is
+    followed by lists of at most *chunk_size* externalized items, in
+    container order.
+
+    :keyword unwrap: Called with each value of the container to get the
+        object to externalize, such as the ``_v_unwrap`` of a
+        :class:`.ContainedStorage` holding weak references. Values for
+        which this returns None are skipped.
+    Other keyword arguments are passed to ``toExternalObject`` and
+    ``to_standard_external_dictionary``.
+    """
+    yield to_standard_external_dictionary(container, **kwargs)
+
+    jar = getattr(container, '_p_jar', None)
+    chunk = []
+    for value in _values(container):
+        obj = unwrap(value)
+        if obj is None:
+            continue
+        chunk.append(toExternalObject(obj, **kwargs))
+        deactivate(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+            if jar is not None:
+                jar.cacheGC()
+    if chunk:
+        yield chunk
+
+
+def _encode(value):
+    result = to_json_representation_externalized(value)
+    if isinstance(result, six.text_type):
+        result = result.encode('utf-8')
+    return result
+
+
+def iter_container_json(container, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+    """
+    Iterate the JSON encoding of *container* as bytes: a JSON object
+    with the container-level fields, followed by the ``Items`` as a list.
+
+    Arguments are as for :func:`iter_container_chunks`.
+    """
+    chunks = iter_container_chunks(container, chunk_size, **kwargs)
+    header = next(chunks)
+    header.pop(ITEMS, None)
+    parts = [_encode(six.text_type(key)) + b':' + _encode(value)
+             for key, value in sorted(header.items())]
+    parts.append(_encode(ITEMS) + b':[')
+    yield b'{' + b','.join(parts)
+
+    first = True
+    for chunk in chunks:
+        encoded = b','.join(_encode(item) for item in chunk)
+        yield encoded if first else b',' + encoded
+        first = False
+    yield b']}'
+
+
+def write_container_json(container, fp, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+    """
+    Write the JSON encoding of *container* to *fp*, a file-like object
+    (such as the ``body_file`` of a response) opened for writing bytes.
+
+    Arguments are as for :func:`iter_container_chunks`.
+
+    :return: The number of bytes written.
+    """
+    count = 0
+    for data in iter_container_json(container, chunk_size, **kwargs):
+        fp.write(data)
+        count += len(data)
+    return count
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope import component
+
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+
+from nti.coremetadata.interfaces import IContained
+
+from nti.datastructures.datastructures import ContainedStorage
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@component.adapter(IContained, IObjectModifiedEvent)
+def _reindex_modified_contained(contained, unused_event=None):
+    """
+    Keep the secondary indexes of the :class:`.ContainedStorage` holding
+    a modified object up to date. Objects in a storage's mapping
+    containers are parented to the container, which is parented to the
+    storage.
+    """
+    container = getattr(contained, '__parent__', None)
+    storage = getattr(container, '__parent__', None)
+    if isinstance(storage, ContainedStorage):
+        storage.containedObjectModified(contained)
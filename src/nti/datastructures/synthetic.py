@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The keys of external objects that are synthesized by the
+externalization process and can't be set by users.
+
+This module is deliberately kept light: it must not import ZODB or
+anything else that requires the persistence machinery, so that tools
+and worker processes that only need these functions (or
+:mod:`nti.datastructures.interfaces`) don't pay to import them. This is
+enforced by the tests.
+
+.. $Id$
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# These are the values of the corresponding
+# nti.externalization.interfaces.StandardExternalFields (ID, OID, CLASS,
+# CREATOR, CONTAINER_ID, LAST_MODIFIED). Importing that module
+# imports persistent and ZODB, so we can't use it here.
+_SYNTHETIC_KEYS = (u'ID',
+                   u'OID',
+                   u'Class',
+                   u'Creator',
+                   u'ContainerId',
+                   u'Last Modified')
+
+
+def _syntheticKeys():
+    return _SYNTHETIC_KEYS
+
+
+def isSyntheticKey(key):
+    """
+    For our mixin objects that have special keys, defines
+    those keys that are special and not settable by the user.
+    """
+    return key in _SYNTHETIC_KEYS
+_isMagicKey = isSyntheticKey
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+
+import unittest
+
+import transaction
+
+from ZODB.DB import DB
+
+from ZODB.DemoStorage import DemoStorage
+
+from ZODB.utils import u64
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SamplePersistentContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
+else:
+    from nti.datastructures.aio import AsyncContainedStorageReader
+
+
+def _snapshot(obj):
+    return getattr(obj, 'id', None) or type(obj).__name__
+
+
+def _drain(loop, iterator):
+    iterator = iterator.__aiter__()
+    result = []
+    while True:
+        try:
+            result.append(loop.run_until_complete(iterator.__anext__()))
+        except StopAsyncIteration:  # pylint: disable=undefined-variable
+            return result
+
+
+@unittest.skipIf(asyncio is None, "Requires asyncio")
+class TestAsyncContainedStorageReader(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.db = DB(DemoStorage())
+        conn = self.db.open()
+        storage = ContainedStorage(
+            containers={u'list': PersistentExternalizableList()})
+        conn.root()['storage'] = storage
+        self.ids = []
+        for cid in (u'foo', u'list'):
+            for _ in range(5):
+                obj = SamplePersistentContained()
+                obj.containerId = cid
+                storage.addContainedObject(obj)
+                if cid == u'foo':
+                    self.ids.append(obj.id)
+        transaction.commit()
+        self.oid = storage._p_oid
+        conn.close()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.reader = AsyncContainedStorageReader(self.db, u64(self.oid),
+                                                  max_workers=2,
+                                                  snapshot=_snapshot)
+
+    def tearDown(self):
+        self.reader.close()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.db.close()
+
+    def _run(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def test_gets(self):
+        oid = self.ids[0]
+        assert_that(self._run(self.reader.getContainedObject(u'foo', oid)),
+                    is_(oid))
+        assert_that(self._run(self.reader.getContainedObject(u'foo', u'x')),
+                    is_(none()))
+        assert_that(self._run(self.reader.getContainedObjects([(u'foo', oid),
+                                                               (u'bar', oid)],
+                                                              u'missing')),
+                    is_([oid, u'missing']))
+        assert_that(self._run(self.reader.getContainer(u'foo')),
+                    is_('SmallLastModifiedBTreeContainer'))
+        assert_that(self._run(self.reader.getContainer(u'bar')),
+                    is_(none()))
+
+    def test_running_loop(self):
+        # Called with a loop running, as from a coroutine, we use
+        # that loop, not the current one.
+        asyncio.set_event_loop(None)
+        oid = self.ids[0]
+        result = self.loop.create_future()
+
+        def call():
+            future = self.reader.getContainedObject(u'foo', oid)
+            future.add_done_callback(lambda f: result.set_result(f.result()))
+        self.loop.call_soon(call)
+        assert_that(self.loop.run_until_complete(result), is_(oid))
+
+    def test_iteration(self):
+        items = _drain(self.loop, self.reader.iterContainer(u'foo', batch_size=2))
+        assert_that([k for k, _ in items], is_(sorted(self.ids)))
+
+        items = _drain(self.loop, self.reader.iterContainer(u'list', batch_size=5))
+        assert_that(items, has_length(5))
+        assert_that(items[-1][0], is_(4))
+
+        assert_that(_drain(self.loop, self.reader.iterContainer(u'bar')),
+                    is_([]))
+
+    def test_errors_propagate(self):
+        def _broken(unused_obj):
+            raise ValueError()
+        self.reader.snapshot = _broken
+        with self.assertRaises(ValueError):
+            _drain(self.loop, self.reader.iterContainer(u'foo'))
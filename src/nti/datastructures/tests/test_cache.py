@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_entry
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import has_property
+from hamcrest import same_instance
+
+import gc
+import unittest
+
+from transaction import TransactionManager
+
+from ZODB.DB import DB
+
+from ZODB.DemoStorage import DemoStorage
+
+from nti.datastructures.cache import SharedSnapshotCache
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SampleContained
+from nti.datastructures.tests.test_datastructures import SamplePersistentContained
+
+
+def _snapshot(obj):
+    return {'class': type(obj).__name__,
+            'lastModified': obj.lastModified}
+
+
+class TestSharedSnapshotCache(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.db = DB(DemoStorage())
+        self.tm1 = TransactionManager()
+        self.conn1 = self.db.open(self.tm1)
+        self.storage = ContainedStorage()
+        self.conn1.root()['storage'] = self.storage
+        self.obj = SamplePersistentContained()
+        self.obj.containerId = u'foo'
+        self.storage.addContainedObject(self.obj)
+        self.tm1.commit()
+
+        self.tm2 = TransactionManager()
+        self.conn2 = self.db.open(self.tm2)
+
+    def tearDown(self):
+        self.conn1.close()
+        self.conn2.close()
+        self.db.close()
+
+    def test_shared_between_connections(self):
+        cache = SharedSnapshotCache(maxsize=2, snapshot=_snapshot)
+        oid = self.obj.id
+        first = self.storage.getContainedObjectSnapshot(u'foo', oid, cache)
+        assert_that(cache, has_property('misses', 1))
+
+        storage2 = self.conn2.root()['storage']
+        obj2 = storage2.getContainer(u'foo')[oid]
+        assert_that(obj2, has_property('_p_changed', none()))
+        loads = []
+        setstate = self.conn2.setstate
+        self.conn2.setstate = lambda obj: loads.append(obj) or setstate(obj)
+        second = storage2.getContainedObjectSnapshot(u'foo', oid, cache)
+        assert_that(second, is_(same_instance(first)))
+        assert_that(cache, has_property('hits', 1))
+        # The second connection didn't have to load the object
+        assert_that(loads, is_([]))
+        assert_that(obj2, has_property('_p_changed', none()))
+        del self.conn2.setstate
+
+        # Modified objects bypass the cache
+        self.obj.lastModified = 42
+        modified = self.storage.getContainedObjectSnapshot(u'foo', oid, cache)
+        assert_that(modified, has_entry('lastModified', 42))
+        assert_that(modified, is_(_snapshot(self.obj)))
+        assert_that(cache, has_property('bypasses', 1))
+        self.tm1.commit()
+
+        # Until the second connection moves forward, it still sees
+        # the old revision
+        assert_that(storage2.getContainedObjectSnapshot(u'foo', oid, cache),
+                    is_(same_instance(first)))
+        self.tm2.begin()
+        current = storage2.getContainedObjectSnapshot(u'foo', oid, cache)
+        assert_that(current, has_entry('lastModified', 42))
+        assert_that(cache, has_property('misses', 2))
+
+        # The container, and eviction
+        storage2.getContainerSnapshot(u'foo', cache)
+        assert_that(cache, has_length(2))
+        cache.clear()
+        assert_that(cache, has_length(0))
+
+    def test_savepoint(self):
+        cache = SharedSnapshotCache(snapshot=_snapshot)
+        oid = self.obj.id
+        self.storage.getContainedObjectSnapshot(u'foo', oid, cache)
+        self.obj.lastModified = 42
+        self.tm1.savepoint()
+        assert_that(self.obj, has_property('_p_changed', False))
+        snapshot = self.storage.getContainedObjectSnapshot(u'foo', oid, cache)
+        assert_that(snapshot, has_entry('lastModified', 42))
+        assert_that(cache, has_property('bypasses', 1))
+        self.tm1.abort()
+
+    def test_missing(self):
+        cache = SharedSnapshotCache(snapshot=_snapshot)
+        assert_that(self.storage.getContainedObjectSnapshot(u'bar', u'x', cache),
+                    is_(none()))
+        assert_that(self.storage.getContainedObjectSnapshot(u'foo', u'x', cache),
+                    is_(none()))
+        assert_that(self.storage.getContainerSnapshot(u'bar', cache, 1),
+                    is_(1))
+
+    def test_unsaved_and_dangling(self):
+        cache = SharedSnapshotCache(snapshot=_snapshot)
+        storage = ContainedStorage(weak=True)
+        obj = SampleContained()
+        obj.containerId = u'foo'
+        storage.addContainedObject(obj)
+        assert_that(storage.getContainerSnapshot(u'foo', cache),
+                    has_entry('class', 'SmallLastModifiedBTreeContainer'))
+        assert_that(cache, has_property('bypasses', 1))
+
+        oid = obj.id
+        del obj
+        gc.collect()
+        assert_that(storage.getContainedObjectSnapshot(u'foo', oid, cache),
+                    is_(none()))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import same_instance
+from hamcrest import greater_than
+from hamcrest import contains_inanyorder
+
+import os
+import time
+import random
+import shutil
+import tempfile
+import unittest
+
+import transaction
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.MappingStorage import MappingStorage
+
+from ZODB.POSException import ConflictError
+
+from zope import lifecycleevent
+
+from nti.datastructures import changelog
+
+from nti.datastructures.changelog import ADD
+from nti.datastructures.changelog import MODIFY
+from nti.datastructures.changelog import DELETE
+from nti.datastructures.changelog import ChangeLog
+from nti.datastructures.changelog import ChangeTokenExpired
+from nti.datastructures.changelog import _Floor
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SampleContained
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+class _Random(object):
+
+    def __init__(self):
+        self.last = 0
+
+    def getrandbits(self, unused_bits):
+        self.last += 1
+        return self.last
+
+
+class TestChangeLog(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        transaction.begin()
+        self.clock = _Clock()
+        changelog.time = self.clock
+        changelog.random = _Random()
+
+    def tearDown(self):
+        transaction.abort()
+        changelog.time = time
+        changelog.random = random
+
+    def _commit(self, manager=transaction):
+        # Commit, and let the window pass
+        manager.commit()
+        self.clock.now += ChangeLog.window + 1
+
+    def _add(self, storage, containerId):
+        obj = SampleContained()
+        obj.containerId = containerId
+        return storage.addContainedObject(obj)
+
+    def _ops(self, changes):
+        return [change[1:] for change in changes]
+
+    def test_storage_changes(self):
+        storage = ContainedStorage()
+        assert_that(storage.changeLog, is_(none()))
+        self._add(storage, u'foo')
+        log = storage.enableChangeLog()
+        assert_that(storage.enableChangeLog(), is_(same_instance(log)))
+        assert_that(log.__parent__, is_(same_instance(storage)))
+        token = log.token
+        assert_that(token, is_(0))
+        assert_that(log.changesSince(token), is_(([], token)))
+
+        o1 = self._add(storage, u'foo')
+        o2 = self._add(storage, u'foo')
+        o3 = self._add(storage, u'bar')
+        lifecycleevent.modified(o1)
+        o2_id = o2.id
+        storage.deleteEqualContainedObject(o2)
+        # Not until committed
+        assert_that(log.changesSince(token), is_(([], token)))
+        self._commit()
+        changes, token = log.changesSince(token)
+        assert_that(self._ops(changes),
+                    is_([(ADD, u'bar', o3.id),
+                         (MODIFY, u'foo', o1.id),
+                         (DELETE, u'foo', o2_id)]))
+        assert_that(token, is_(changes[-1][0]))
+        assert_that(log, has_length(5))
+
+        storage.deleteContainer(u'bar')
+        self._commit()
+        changes, new_token = log.changesSince(token)
+        assert_that(self._ops(changes), is_([(DELETE, u'bar', None)]))
+        assert_that(new_token, is_(greater_than(token)))
+        assert_that(new_token, is_(log.token))
+
+        # Objects we don't hold aren't recorded
+        storage.containedObjectModified(o2)
+        stranger = SampleContained()
+        stranger.containerId = u'baz'
+        storage.containedObjectModified(stranger)
+        self._commit()
+        assert_that(log.changesSince(new_token), is_(([], new_token)))
+
+    def test_window(self):
+        log = ChangeLog()
+        log.record(ADD, u'foo', u'0')
+        transaction.commit()
+        # Tokens lag behind recent changes, which are seen again
+        token = log.token
+        assert_that(token, is_(changelog._sequence(self.clock.now - log.window)))
+        changes, token = log.changesSince(token)
+        assert_that(self._ops(changes), is_([(ADD, u'foo', u'0')]))
+        assert_that(log.changesSince(token), is_((changes, token)))
+        self.clock.now += 10
+        log.record(ADD, u'foo', u'1')
+        transaction.commit()
+        self.clock.now += log.window - 5
+        changes, token = log.changesSince(token)
+        assert_that(changes, has_length(2))
+        assert_that(token, is_(greater_than(changes[0][0])))
+        assert_that(changes[1][0], is_(greater_than(token)))
+        changes, token = log.changesSince(token)
+        assert_that(self._ops(changes), is_([(ADD, u'foo', u'1')]))
+
+        # Transactions that take too long to commit are refused
+        log.record(ADD, u'foo', u'2')
+
+        def slow():
+            self.clock.now += log.window
+        transaction.get().addBeforeCommitHook(slow)
+        with self.assertRaises(ConflictError):
+            transaction.commit()
+
+    def test_bounded(self):
+        log = ChangeLog(max_entries=10)
+        first = log.token
+        for i in range(11):
+            log.record(ADD, u'foo', u'%s' % i)
+        self._commit()
+        # Allowed to grow a little
+        assert_that(log, has_length(11))
+        assert_that(log.changesSince(first)[0], has_length(11))
+        log.record(ADD, u'foo', u'11')
+        self._commit()
+        assert_that(log, has_length(10))
+        with self.assertRaises(ChangeTokenExpired):
+            log.changesSince(first)
+        changes, _ = log.changesSince(log._floor.value)
+        assert_that(changes, has_length(10))
+
+        # Changes within the window aren't discarded
+        log = ChangeLog(max_entries=0)
+        log.record(ADD, u'foo', u'0')
+        transaction.commit()
+        log.record(ADD, u'foo', u'1')
+        self._commit()
+        assert_that(log, has_length(2))
+        log.record(ADD, u'foo', u'2')
+        self._commit()
+        assert_that(log, has_length(1))
+        changes, _ = log.changesSince(log._floor.value)
+        assert_that(self._ops(changes), is_([(ADD, u'foo', u'2')]))
+        assert_that(log.token, is_(changes[0][0]))
+
+    def test_savepoints_and_hooks(self):
+        db = DB(MappingStorage())
+        conn = db.open()
+        self.addCleanup(db.close)
+        self.addCleanup(conn.close)
+        self.addCleanup(transaction.abort)
+        log = conn.root()['log'] = ChangeLog()
+        log.record(ADD, u'foo', u'0')
+        savepoint = transaction.savepoint()
+        log.record(ADD, u'foo', u'1')
+        savepoint.rollback()
+        # A change recorded by a hook after ours ran
+        transaction.get().addBeforeCommitHook(log.record,
+                                              (ADD, u'foo', u'2'))
+        self._commit()
+        changes, token = log.changesSince(0)
+        assert_that(self._ops(changes), is_([(ADD, u'foo', u'0'),
+                                             (ADD, u'foo', u'2')]))
+        assert_that(token, is_(changes[-1][0]))
+        assert_that(log, has_length(2))
+
+    def test_old_log(self):
+        # Logs used to be numbered by microseconds alone
+        log = ChangeLog()
+        log._entries[1000] = (ADD, u'foo', u'0')
+        log._size.change(1)
+        assert_that(log.token, is_(1000))
+        log.record(ADD, u'foo', u'1')
+        self._commit()
+        changes, _ = log.changesSince(1000)
+        assert_that(self._ops(changes), is_([(ADD, u'foo', u'1')]))
+
+    def test_concurrent(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+        self.addCleanup(db.close)
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(tm1)
+        self.addCleanup(conn1.close)
+        self.addCleanup(tm1.abort)
+        log = conn1.root()['log'] = ChangeLog()
+        self._commit(tm1)
+        conn2 = db.open(tm2)
+        self.addCleanup(conn2.close)
+        self.addCleanup(tm2.abort)
+        log2 = conn2.root()['log']
+        token = log2.token
+
+        # Both commit, and in the same microsecond
+        log.record(ADD, u'foo', u'1')
+        log2.record(ADD, u'bar', u'2')
+        tm2.commit()
+        tm1.commit()
+        self.clock.now += log.window + 1
+        tm2.begin()
+        changes, _ = log2.changesSince(token)
+        assert_that(self._ops(changes),
+                    contains_inanyorder((ADD, u'foo', u'1'), (ADD, u'bar', u'2')))
+        assert_that(log2, has_length(2))
+
+    def test_transaction_manager(self):
+        db = DB(MappingStorage())
+        self.addCleanup(db.close)
+        manager = transaction.TransactionManager()
+        conn = db.open(manager)
+        self.addCleanup(conn.close)
+        self.addCleanup(manager.abort)
+        storage = conn.root()['storage'] = ContainedStorage()
+        manager.commit()
+        log = storage.enableChangeLog()
+        assert_that(log._p_jar, is_(same_instance(conn)))
+        self._add(storage, u'foo')
+        self._commit(manager)
+        assert_that(log._entries.minKey(), is_(greater_than(0)))
+
+        # Or through the storage
+        log = ChangeLog()
+        log.__parent__ = storage
+        log.record(ADD, u'foo', u'1')
+        self._commit(manager)
+        assert_that(log._entries.minKey(), is_(greater_than(0)))
+
+    def test_floor_conflicts(self):
+        floor = _Floor()
+        assert_that(floor._p_resolveConflict({}, {'value': 5}, {'value': 3}),
+                    is_({'value': 5}))
+        assert_that(floor._p_resolveConflict({}, {}, {'value': 3}),
+                    is_({'value': 3}))
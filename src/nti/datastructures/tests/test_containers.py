@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import is_not
+from hamcrest import has_key
+from hamcrest import not_none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import has_property
+from hamcrest import instance_of
+from hamcrest import same_instance
+
+from nti.testing.matchers import verifiably_provides
+
+import os
+import shutil
+import weakref
+import tempfile
+import unittest
+
+import transaction
+
+from BTrees.Length import Length
+
+from BTrees.OOBTree import OOBTree
+
+from ZODB.DB import DB
+
+from ZODB.DemoStorage import DemoStorage
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.ConflictResolution import PersistentReference
+
+from ZODB.POSException import ConflictError
+
+from zope.container.interfaces import IContainer
+
+from zope.location.interfaces import ILocation
+
+from nti.base.interfaces import ILastModified
+
+from persistent.wref import WeakRef
+
+from nti.datastructures.containers import _same
+from nti.datastructures.containers import LazyContainer
+from nti.datastructures.containers import lazy_container_stats
+from nti.datastructures.containers import UniqueContainedList
+from nti.datastructures.containers import SmallLastModifiedBTreeContainer
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SamplePersistentContained
+
+
+class TestSmallContainer(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _obj(self, containerId=u'foo'):
+        obj = SamplePersistentContained()
+        obj.containerId = containerId
+        return obj
+
+    def test_small_and_upgrade(self):
+        container = SmallLastModifiedBTreeContainer()
+        container.max_small_size = 3
+        for key in (u'c', u'a', u'b'):
+            container[key] = self._obj()
+        assert_that(container, has_property('small', True))
+        assert_that(container, has_length(3))
+        assert_that(list(container), is_([u'a', u'b', u'c']))
+        assert_that(list(container.keys(u'b')), is_([u'b', u'c']))
+        assert_that(list(container._SampleContainer__data.iterkeys(u'a', u'b')),
+                    is_([u'a', u'b']))
+        assert_that([k for k, _ in container._SampleContainer__data.iteritems()],
+                    is_([u'a', u'b', u'c']))
+        assert_that(list(container._SampleContainer__data.itervalues()),
+                    has_length(3))
+        assert_that(list(container.values()), has_length(3))
+        assert_that(u'a' in container, is_(True))
+        del container[u'c']
+        assert_that(container, has_length(2))
+        container[u'c'] = self._obj()
+
+        container[u'd'] = self._obj()
+        assert_that(container, has_property('small', False))
+        assert_that(container._SampleContainer__data, instance_of(OOBTree))
+        assert_that(container._BTreeContainer__len, instance_of(Length))
+        assert_that(container, has_length(4))
+        assert_that(list(container.items(u'c')), has_length(2))
+        del container[u'a']
+        assert_that(container, has_length(3))
+
+    def test_persistence_and_conflicts(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        # DemoStorage doesn't resolve conflicts
+        db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+        conn = db.open()
+        storage = ContainedStorage()
+        conn.root()['storage'] = storage
+        storage.addContainedObject(self._obj())
+        transaction.commit()
+        container = storage.getContainer(u'foo')
+        assert_that(container, instance_of(SmallLastModifiedBTreeContainer))
+        # Just the container record
+        assert_that(container._SampleContainer__data,
+                    is_(instance_of(dict)))
+
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        c1 = db.open(tm1)
+        c2 = db.open(tm2)
+        s1 = c1.root()['storage'].getContainer(u'foo')
+        s2 = c2.root()['storage'].getContainer(u'foo')
+        s1[u'one'] = self._obj()
+        s2[u'two'] = self._obj()
+        del s2[sorted(s2)[0]]
+        tm1.commit()
+        tm2.commit()
+
+        tm1.begin()
+        s1 = c1.root()['storage'].getContainer(u'foo')
+        assert_that(sorted(s1), is_([u'one', u'two']))
+        assert_that(s1, has_length(2))
+
+        # The same key conflicts
+        tm2.begin()
+        s2 = c2.root()['storage'].getContainer(u'foo')
+        s1[u'three'] = self._obj()
+        s2[u'three'] = self._obj()
+        tm1.commit()
+        with self.assertRaises(ConflictError):
+            tm2.commit()
+        tm2.abort()
+
+        # As do other changes
+        tm1.begin()
+        tm2.begin()
+        c1.root()['storage'].getContainer(u'foo').max_small_size = 1
+        c2.root()['storage'].getContainer(u'foo').max_small_size = 2
+        tm1.commit()
+        with self.assertRaises(ConflictError):
+            tm2.commit()
+        tm2.abort()
+
+        for c in (conn, c1, c2):
+            c.close()
+        db.close()
+
+    def test_resolve_states(self):
+        container = SmallLastModifiedBTreeContainer()
+        resolved = container._p_resolveConflict(
+            {'a': 1, 'b': 1, 'lastModified': 1},
+            {'a': 1, 'b': 2, 'lastModified': 3},
+            {'b': 1, 'lastModified': 2})
+        assert_that(resolved, is_({'b': 2, 'lastModified': 3}))
+
+        ref = PersistentReference(b'\x00' * 8)
+        assert_that(_same(ref, PersistentReference(b'\x00' * 8)), is_(True))
+        assert_that(_same(ref, PersistentReference(b'\x01' * 8)), is_(False))
+        assert_that(_same(ref, b'\x00' * 8), is_(False))
+
+
+class TestLazyContainer(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def test_reads_do_not_create(self):
+        before = lazy_container_stats()
+        storage = ContainedStorage()
+        container = storage.getOrCreateContainer(u'foo', lazy=True)
+        assert_that(container, instance_of(LazyContainer))
+        for iface in (IContainer, ILastModified, ILocation):
+            assert_that(container, verifiably_provides(iface))
+        assert_that(container, has_property('__parent__', storage))
+        assert_that(container, has_property('__name__', u'foo'))
+        assert_that(container, has_property('materialized', False))
+        assert_that(storage.getOrCreateContainer(u'foo', lazy=True),
+                    is_(same_instance(container)))
+        assert_that(container, has_length(0))
+        assert_that(list(container), is_([]))
+        assert_that(list(container.keys()), is_([]))
+        assert_that(list(container.values()), is_([]))
+        assert_that(list(container.items()), is_([]))
+        assert_that(container.get(u'a', 1), is_(1))
+        assert_that(u'a' in container, is_(False))
+        assert_that(container, has_property('lastModified', 0))
+        assert_that(container, has_property('createdTime', 0))
+        assert_that(bool(container), is_(False))
+        with self.assertRaises(KeyError):
+            container[u'a']  # pylint: disable=pointless-statement
+        with self.assertRaises(KeyError):
+            del container[u'a']
+        with self.assertRaises(AttributeError):
+            getattr(container, 'updateLastMod')
+        with self.assertRaises(AttributeError):
+            getattr(container, '_p_jar')
+        container.clear()
+        assert_that(storage.containers, has_length(0))
+        assert_that(repr(container), is_('<LazyContainer foo materialized: False>'))
+
+        stats = lazy_container_stats()
+        assert_that(stats['proxies'], is_(before['proxies'] + 1))
+        assert_that(stats['avoided'], is_(before['avoided'] + 1))
+
+    def test_write_creates(self):
+        before = lazy_container_stats()
+        storage = ContainedStorage()
+        container = storage.getOrCreateContainer(u'foo', lazy=True)
+        obj = SamplePersistentContained()
+        container[u'a'] = obj
+        assert_that(container, has_property('materialized', True))
+        live = storage.getContainer(u'foo')
+        assert_that(live, instance_of(SmallLastModifiedBTreeContainer))
+        assert_that(live[u'a'], is_(obj))
+        assert_that(container[u'a'], is_(obj))
+        assert_that(container.get(u'a'), is_(obj))
+        assert_that(u'a' in container, is_(True))
+        assert_that(list(container), is_([u'a']))
+        assert_that(list(container.keys()), is_([u'a']))
+        assert_that(list(container.values()), is_([obj]))
+        assert_that(list(container.items()), is_([(u'a', obj)]))
+        assert_that(container.lastModified, is_(live.lastModified))
+        assert_that(container.createdTime, is_(0))
+        assert_that(live, has_property('__parent__', container.__parent__))
+        assert_that(container.updateLastMod, is_(live.updateLastMod))
+        del container[u'a']
+        assert_that(live, has_length(0))
+
+        stats = lazy_container_stats()
+        assert_that(stats['materialized'], is_(before['materialized'] + 1))
+        assert_that(stats['avoided'], is_(before['avoided']))
+
+        # Existing containers are returned directly
+        assert_that(storage.getOrCreateContainer(u'foo', lazy=True), is_(live))
+
+    def test_sees_containers_created_later(self):
+        before = lazy_container_stats()
+        storage = ContainedStorage()
+        container = storage.getOrCreateContainer(u'foo', lazy=True)
+        live = storage.getOrCreateContainer(u'foo')
+        # Not avoided after all
+        assert_that(lazy_container_stats()['avoided'], is_(before['avoided']))
+        assert_that(container, has_property('materialized', True))
+        container[u'a'] = SamplePersistentContained()
+        assert_that(live, has_length(1))
+
+        # Even when not created through the storage (or by another
+        # connection)
+        container = storage.getOrCreateContainer(u'bar', lazy=True)
+        storage.containers[u'bar'] = SmallLastModifiedBTreeContainer()
+        assert_that(container, has_property('materialized', True))
+        assert_that(lazy_container_stats()['avoided'], is_(before['avoided']))
+
+    def test_delete_and_recreate(self):
+        storage = ContainedStorage()
+        container = storage.getOrCreateContainer(u'foo', lazy=True)
+        container[u'a'] = SamplePersistentContained()
+        old = storage.getContainer(u'foo')
+        storage.deleteContainer(u'foo')
+        assert_that(container, has_length(0))
+        assert_that(container, has_property('materialized', False))
+        fresh = storage.getOrCreateContainer(u'foo', lazy=True)
+        assert_that(fresh, is_not(same_instance(container)))
+        # Writes to the old proxy create a new container too
+        container[u'b'] = SamplePersistentContained()
+        live = storage.getContainer(u'foo')
+        assert_that(live, is_not(same_instance(old)))
+        assert_that(list(live), is_([u'b']))
+        assert_that(list(fresh), is_([u'b']))
+
+    def test_abort(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        self.addCleanup(db.close)
+        self.addCleanup(conn.close)
+        self.addCleanup(transaction.abort)
+        storage = conn.root()['storage'] = ContainedStorage()
+        transaction.commit()
+        container = storage.getOrCreateContainer(u'foo', lazy=True)
+        container[u'a'] = SamplePersistentContained()
+        transaction.abort()
+        assert_that(storage.containers, has_length(0))
+        assert_that(container, has_property('materialized', False))
+        assert_that(container, has_length(0))
+        container[u'b'] = SamplePersistentContained()
+        transaction.commit()
+        assert_that(list(storage.getContainer(u'foo')), is_([u'b']))
+
+
+class TestUniqueContainedList(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _objs(self, count):
+        return [SamplePersistentContained(containerId=u'foo') for _ in range(count)]
+
+    def test_collapses_duplicates(self):
+        a, b, c, d = self._objs(4)
+        container = UniqueContainedList([a, b, a])
+        assert_that(list(container), is_([a, b]))
+        container.append(b)
+        container.extend([c, a])
+        container += [c, b]
+        assert_that(list(container), is_([a, b, c]))
+        container.insert(0, c)
+        assert_that(list(container), is_([a, b, c]))
+        container.insert(0, d)
+        assert_that(list(container), is_([d, a, b, c]))
+        assert_that(container.index(c), is_(3))
+        assert_that(container.index(a, 0, 2), is_(1))
+        assert_that(d in container, is_(True))
+        assert_that(SamplePersistentContained() in container, is_(False))
+        with self.assertRaises(ValueError):
+            container.index(SamplePersistentContained())
+
+        # Replacing with an object held elsewhere is refused
+        with self.assertRaises(ValueError):
+            container[0] = a
+        container[1] = a
+        container[-1] = c
+        assert_that(list(container), is_([d, a, b, c]))
+        container[0] = e = SamplePersistentContained()
+        assert_that(container.index(e), is_(0))
+        assert_that(d in container, is_(False))
+
+    def test_removal_keeps_order(self):
+        objs = self._objs(6)
+        container = UniqueContainedList(objs)
+        container.remove(objs[1])
+        assert_that(container.pop(), is_(objs[5]))
+        del container[-2]
+        assert_that(list(container), is_([objs[0], objs[2], objs[4]]))
+        for i, obj in enumerate(container):
+            assert_that(container.index(obj), is_(i))
+        assert_that(objs[3] in container, is_(False))
+        container.append(objs[3])
+        assert_that(container.index(objs[3]), is_(3))
+        with self.assertRaises(ValueError):
+            container.remove(objs[1])
+
+        # The map is compacted after many removals
+        container.max_removed = 1
+        container.pop(0)
+        assert_that(container._v_positions, is_(None))
+        container.pop(0)
+        assert_that(list(container), is_([objs[4], objs[3]]))
+        assert_that(container.index(objs[3]), is_(1))
+
+    def test_other_changes_rebuild(self):
+        a, b, c = objs = self._objs(3)
+        container = UniqueContainedList(objs)
+        container.reverse()
+        assert_that(container.index(a), is_(2))
+        container.sort(key=lambda o: objs.index(o))
+        assert_that(container.index(a), is_(0))
+        container[1:2] = [c]
+        assert_that(list(container), is_([a, c, c]))
+        # Duplicates from other changes are tolerated and
+        # removed one at a time
+        assert_that(container.index(c), is_(1))
+        container.pop()
+        assert_that(container.index(c), is_(1))
+        container.remove(c)
+        assert_that(list(container), is_([a]))
+        assert_that(b in container, is_(False))
+        container *= 2
+        assert_that(container, has_length(2))
+        container.remove(a)
+        assert_that(container.index(a), is_(0))
+        container.clear()
+        assert_that(container, has_length(0))
+        assert_that(a in container, is_(False))
+
+    def test_weak_references(self):
+        a, b = self._objs(2)
+        ref = WeakRef(a)
+        container = UniqueContainedList([ref])
+        assert_that(a in container, is_(True))
+        assert_that(WeakRef(a) in container, is_(True))
+
+        class Target(object):
+            pass
+        target = Target()
+        dead = weakref.ref(Target())
+        container.extend([weakref.ref(target), dead, b])
+        assert_that(target in container, is_(True))
+        assert_that(dead in container, is_(True))
+        assert_that(weakref.ref(Target()) in container, is_(False))
+        assert_that(container.index(b), is_(3))
+
+    def test_persistence(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        a, b, c = self._objs(3)
+        container = conn.root()['list'] = UniqueContainedList([a, WeakRef(b)])
+        assert_that(a in container, is_(True))
+        transaction.commit()
+        # Indexed by identity, found and then indexed by OID
+        assert_that(a._p_oid, is_(not_none()))
+        assert_that(container._v_transient, is_(2))
+        assert_that(a in container, is_(True))
+        assert_that(container._v_positions, has_key(a._p_oid))
+        assert_that(container._v_transient, is_(1))
+        assert_that(WeakRef(b) in container, is_(True))
+        assert_that(container._v_transient, is_(0))
+        assert_that(c in container, is_(False))
+
+        # The map is not kept
+        conn.cacheMinimize()
+        assert_that(container._v_positions, is_(None))
+        assert_that(container.index(b), is_(1))
+        container.remove(a)
+        transaction.commit()
+
+        conn2 = db.open()
+        assert_that([r.oid for r in conn2.root()['list']], is_([b._p_oid]))
+        conn2.close()
+        conn.close()
+        db.close()
+
+    def test_gaining_oids(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        self.addCleanup(db.close)
+        self.addCleanup(conn.close)
+        self.addCleanup(transaction.abort)
+        a, b, c = self._objs(3)
+        conn.root()['other'] = other = SamplePersistentContained()
+        container = conn.root()['list'] = UniqueContainedList([a, b])
+        # A duplicate from another change
+        container[2:] = [c, c]
+        assert_that(a in container, is_(True))
+        transaction.commit()
+        assert_that(other in container, is_(False))
+        # An identity reused by another object isn't taken for it
+        container._v_positions[id(other)] = 0
+        assert_that(other in container, is_(False))
+
+        assert_that(container.index(c), is_(2))
+        assert_that(container._v_duplicates, is_({c._p_oid}))
+        container.remove(c)
+        assert_that(container.index(c), is_(2))
+
+        # Lookups stay cheap while many objects have no OIDs
+        new = self._objs(100)
+        container.extend(new)
+        assert_that(container, has_length(103))
+        assert_that(container._v_positions, is_(not_none()))
+        assert_that(container._v_transient, is_(100))
+
+    def test_storage(self):
+        for weak in (False, True):
+            storage = ContainedStorage(weak=weak, set_ids=False,
+                                       containerType=UniqueContainedList)
+            obj = SamplePersistentContained(containerId=u'foo')
+            obj.id = u'shared'
+            other = SamplePersistentContained(containerId=u'foo')
+            other.id = u'other'
+            assert_that(storage.addContainedObject(obj), is_(obj))
+            assert_that(storage.addContainedObject(obj), is_(obj))
+            storage.addContainedObject(other)
+            container = storage.getContainer(u'foo')
+            assert_that(container, instance_of(UniqueContainedList))
+            assert_that(container, has_length(2))
+            storage.deleteEqualContainedObject(obj)
+            assert_that(container, has_length(1))
+            assert_that(obj in container, is_(False))
+            assert_that(other in container, is_(True))
@@ -10,8 +10,10 @@ from __future__ import absolute_import
 from hamcrest import is_
 from hamcrest import none
 from hamcrest import is_in
+from hamcrest import has_entry
 from hamcrest import is_not
 from hamcrest import contains
+from hamcrest import contains_string
 from hamcrest import not_none
 from hamcrest import has_length
 from hamcrest import instance_of
@@ -23,11 +25,20 @@ from hamcrest import greater_than_or_equal_to
 
 from nti.testing.matchers import validly_provides
 
+import gc
 import pickle
 import unittest
 
 import fudge
 
+import transaction
+
+from BTrees.OOBTree import OOBTree
+
+from ZODB.DB import DB
+
+from ZODB.DemoStorage import DemoStorage
+
 from ZODB.interfaces import IBroken
 from ZODB.interfaces import IConnection
 
@@ -43,12 +54,16 @@ from zope.location.interfaces import IContained as IZContained
 from nti.coremetadata.interfaces import IContained
 from nti.coremetadata.interfaces import IHTC_NEW_FACTORY
 
+from nti.containers.containers import CheckingLastModifiedBTreeContainer
+
 from nti.coremetadata.mixins import ZContainedMixin
 
+from nti.datastructures.datastructures import keys_from
 from nti.datastructures.datastructures import isSyntheticKey
 from nti.datastructures.datastructures import ContainedStorage
 from nti.datastructures.datastructures import VolatileFunctionProperty
 from nti.datastructures.datastructures import ContainedObjectValueError
+from nti.datastructures.datastructures import _valid_contained_types
 from nti.datastructures.datastructures import check_contained_object_for_storage
 from nti.datastructures.datastructures import AbstractNamedLastModifiedBTreeContainer
 
@@ -87,6 +102,15 @@ class SamplePersistentContained(ZContainedMixin,
         return to_external_ntiid_oid(self, default_oid=str(id(self)))
 
 
+class IMarker(interface.Interface):
+    pass
+
+
+@interface.implementer(IMarker)
+class MarkedContained(SamplePersistentContained):
+    pass
+
+
 class TestContainedStorage(unittest.TestCase):
 
     layer = SharedConfiguringTestLayer
@@ -214,11 +238,38 @@ class TestContainedStorage(unittest.TestCase):
         assert_that(isSyntheticKey(StandardExternalFields.OID),
                     is_(True))
 
+    def test_keys_from(self):
+        tree = OOBTree({u'a': 1, u'c': 2, u'e': 3})
+        mapping = {u'e': 3, u'a': 1, u'c': 2}
+        for m in tree, mapping:
+            assert_that(list(keys_from(m)), is_([u'a', u'c', u'e']))
+            assert_that(list(keys_from(m, u'c')), is_([u'c', u'e']))
+            # Resuming from a key that has been deleted
+            assert_that(list(keys_from(m, u'b')), is_([u'c', u'e']))
+            assert_that(list(keys_from(m, u'f')), is_([]))
+
     def test_valueError(self):
         class FakeContained(object):
             def __repr__(self, *args, **kwargs):
                 raise Exception
-        ContainedObjectValueError('xx', FakeContained())
+        e = ContainedObjectValueError('xx', FakeContained(), key='k')
+        assert_that(e.args, is_(('xx',)))
+        assert_that(str(e), contains_string('xx [type: '))
+        assert_that(str(e), contains_string("{'key': 'k'}"))
+        assert_that(str(e), is_(same_instance(str(e))))
+
+    def test_valueError_lazy(self):
+        calls = []
+
+        class Counting(object):
+            def __repr__(self):
+                calls.append(1)
+                return 'Counting'
+        e = ContainedObjectValueError('xx', Counting())
+        assert_that(calls, is_([]))
+        assert_that(str(e), contains_string('repr Counting'))
+        str(e)
+        assert_that(calls, is_([1]))
 
     def test_check_contained_object_for_storage(self):
         class FakeContained(object):
@@ -236,6 +287,17 @@ class TestContainedStorage(unittest.TestCase):
         with self.assertRaises(ContainedObjectValueError):
             check_contained_object_for_storage(contained)
 
+        # Instances of classes that implement the interfaces
+        # are only checked once per class
+        @interface.implementer(IContained)
+        class Implementing(FakeContained):
+            containerId = u'foo'
+        check_contained_object_for_storage(Implementing())
+        assert_that(Implementing in _valid_contained_types, is_(True))
+        check_contained_object_for_storage(Implementing())
+        # Directly provided interfaces are not cached
+        assert_that(FakeContained in _valid_contained_types, is_(False))
+
     def test_volatile_property(self):
 
         class C(object):
@@ -278,6 +340,36 @@ class TestContainedStorage(unittest.TestCase):
             "test_container", None
         )
         assert_that(result, is_(Test))
+        assert_that(containers._v_factories,
+                    has_entry("test_container", not_none()))
+
+        results = containers.maybeCreateContainedObjectsWithTypes(
+            [("test_container", None), ("missing", None)]
+        )
+        assert_that(results, contains(is_(Test), none()))
+
+        # Replacing a container invalidates the cached factory
+        containers.deleteContainer("test_container")
+        containers.addContainer("test_container", {})
+        result = containers.maybeCreateContainedObjectWithType(
+            "test_container", None
+        )
+        assert_that(result, is_(none()))
+
+        # Other transactions and aborts change the containers without
+        # going through addContainer and deleteContainer
+        containers.containers["late"] = TestContainer()
+        assert_that(containers.maybeCreateContainedObjectWithType("late", None),
+                    is_(Test))
+        containers.containers["late"] = {}
+        assert_that(containers.maybeCreateContainedObjectWithType("late", None),
+                    is_(none()))
+        containers.containers["late"] = TestContainer()
+        assert_that(containers.maybeCreateContainedObjectWithType("late", None),
+                    is_(Test))
+        del containers.containers["late"]
+        assert_that(containers.maybeCreateContainedObjectWithType("late", None),
+                    is_(none()))
 
     @WithMockDS
     @fudge.patch('nti.datastructures.datastructures.to_external_ntiid_oid')
@@ -334,6 +426,44 @@ class TestContainedStorage(unittest.TestCase):
         # delete should leave last object
         cs.deleteEqualContainedObject(obj)
 
+    def test_sweep_dangling_references(self):
+        assert_that(ContainedStorage().sweepDanglingReferences(),
+                    is_(([], None)))
+
+        cs = ContainedStorage(weak=True,
+                              containers={u'list': PersistentExternalizableList()},
+                              containerType=dict)
+        objs = []
+        for cid in (u'list', u'map'):
+            for _ in range(3):
+                obj = SampleContained()
+                obj.containerId = cid
+                cs.addContainedObject(obj)
+                objs.append(obj)
+        # Lose every other object
+        dead_ids = [(o.containerId, o.id) for o in objs[0::2]]
+        del objs[0::2]
+        gc.collect()
+
+        removed = []
+        batches = 0
+        cursor = None
+        while True:
+            batch, cursor = cs.sweepDanglingReferences(batch_size=2,
+                                                       cursor=cursor)
+            removed.extend(batch)
+            batches += 1
+            if cursor is None:
+                break
+        assert_that(batches, is_(3))
+        assert_that(removed, has_length(3))
+        assert_that(sorted(removed),
+                    is_(sorted([(u'list', 0), (u'list', 1), dead_ids[2]])))
+        assert_that(list(cs.getContainer(u'list')), has_length(1))
+        assert_that(cs.getContainedObject(u'map', objs[1].id),
+                    is_(same_instance(objs[1])))
+        assert_that(cs.sweepDanglingReferences(), is_(([], None)))
+
     def test_get_contained_object(self):
         cs = ContainedStorage(create=True)
         assert_that(cs.getContainedObject('foo', 'id'),
@@ -357,3 +487,102 @@ class TestContainedStorage(unittest.TestCase):
         bad._p_activate = _p_activate
 
         assert_that(cs.cleanBroken(), is_(2))
+
+    def test_query_contained_objects(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        cs = ContainedStorage(containers={u'list': PersistentExternalizableList(),
+                                          u'dict': {}})
+        conn.root()['cs'] = cs
+        for cid in (u'foo', u'bar', u'list', u'dict'):
+            for i in range(4):
+                obj = (MarkedContained if i % 2 else SamplePersistentContained)()
+                obj.containerId = cid
+                obj.id = u'k%s' % i
+                obj.lastModified = i
+                cs.addContainedObject(obj)
+        transaction.commit()
+        conn.close()
+
+        conn = db.open()
+        cs = conn.root()['cs']
+
+        def query(**kwargs):
+            return [(o.containerId, o.id) for o in cs.queryContainedObjects(**kwargs)]
+
+        assert_that(query(), has_length(16))
+        assert_that(query(containerIds=[u'foo', u'missing'], min_key=u'k1', max_key=u'k2'),
+                    is_([(u'foo', u'k1'), (u'foo', u'k2')]))
+        assert_that(query(containerIds=[u'dict', u'list'], max_key=u'k0'),
+                    is_([(u'dict', u'k0')]))
+        assert_that(query(containerIds=[u'bar'], modified_after=1, modified_before=3),
+                    is_([(u'bar', u'k1'), (u'bar', u'k2')]))
+        assert_that(query(containerIds=[u'bar'],
+                          predicate=lambda o: o.id.endswith(u'3')),
+                    is_([(u'bar', u'k3')]))
+        assert_that(query(containerIds=[u'foo', u'list'], provides=IMarker),
+                    is_([(u'foo', u'k1'), (u'foo', u'k3'),
+                         (u'list', u'1'), (u'list', u'3')]))
+        assert_that(query(provides=(MarkedContained, IMarker), limit=3),
+                    has_length(3))
+        assert_that(query(limit=0), is_([]))
+
+        weak = ContainedStorage(weak=True)
+        obj = SampleContained()
+        obj.containerId = u'foo'
+        weak.addContainedObject(obj)
+        del obj
+        gc.collect()
+        assert_that(list(weak.queryContainedObjects()), is_([]))
+
+        # Cheap constraints don't load the objects
+        conn.cacheMinimize()
+        assert_that(query(containerIds=[u'foo'], provides=SampleContained),
+                    is_([]))
+        container = cs.getContainer(u'foo')
+        for obj in container._SampleContainer__data.values():
+            assert_that(obj, has_property('_p_changed', none()))
+        conn.close()
+        db.close()
+
+    def test_sublocations_only_loads_owned(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        foreign = PersistentExternalizableList()
+        cs = ContainedStorage(containers={u'foreign': foreign})
+        conn.root()['cs'] = cs
+        obj = SampleContained()
+        obj.containerId = u'foo'
+        cs.addContainedObject(obj)
+        cs.addContainer(u'bar', CheckingLastModifiedBTreeContainer())
+        cs.addContainer(u'unlocated', CheckingLastModifiedBTreeContainer(),
+                        locate=False)
+        transaction.commit()
+        conn.close()
+
+        conn = db.open()
+        conn.cacheMinimize()
+        cs = conn.root()['cs']
+        assert_that(sorted(c.__name__ for c in cs.sublocations()),
+                    is_([u'bar', u'foo']))
+        assert_that(cs.containers[u'foreign'], has_property('_p_changed', none()))
+        assert_that(cs.containers[u'unlocated'], has_property('_p_changed', none()))
+        cs.deleteContainer(u'bar')
+        cs.deleteContainer(u'unlocated')
+        assert_that(list(cs._ownedContainerIds), is_([u'foo']))
+
+        # Storages from before owned containers were tracked find
+        # them without being changed, until they add a container
+        cs._ownedContainerIds = None
+        transaction.commit()
+        conn.cacheMinimize()
+        assert_that([c.__name__ for c in cs.sublocations()], is_([u'foo']))
+        assert_that(cs, has_property('_p_changed', False))
+        assert_that(cs._ownedContainerIds, is_(none()))
+        cs.addContainer(u'baz', CheckingLastModifiedBTreeContainer())
+        assert_that(list(cs._ownedContainerIds), is_([u'baz', u'foo']))
+        assert_that([c.__name__ for c in cs.sublocations()],
+                    is_([u'baz', u'foo']))
+        transaction.abort()
+        conn.close()
+        db.close()
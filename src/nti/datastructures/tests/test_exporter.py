@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_entry
+from hamcrest import has_length
+from hamcrest import assert_that
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+
+import transaction
+
+from ZODB.DB import DB
+
+from ZODB.DemoStorage import DemoStorage
+
+from zope import interface
+
+from nti.coremetadata.mixins import ZContainedMixin
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.exporter import load_checkpoint
+from nti.datastructures.exporter import ContainedStorageExporter
+from nti.datastructures.exporter import export_contained_storage
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.externalization.interfaces import IExternalObject
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+@interface.implementer(IExternalObject)
+class ExternalContained(ZContainedMixin):
+
+    def __init__(self, containerId, name):
+        super(ExternalContained, self).__init__()
+        self.containerId = containerId
+        self.id = name
+
+    def toExternalObject(self, **unused_kwargs):
+        return {'ContainerId': self.containerId, 'ID': self.id}
+
+
+class FailingContained(ExternalContained):
+
+    fail = True
+
+    def toExternalObject(self, **kwargs):
+        if self.fail:
+            raise ValueError(self.id)
+        return super(FailingContained, self).toExternalObject(**kwargs)
+
+
+class NotSeekable(object):
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def _read_lines(data):
+    return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+
+class TestExporter(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.storage = ContainedStorage(
+            containers={u'list': PersistentExternalizableList()})
+        for cid in (u'b', u'a', u'list'):
+            for name in (u'2', u'1', u'3'):
+                self.storage.addContainedObject(ExternalContained(cid, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_export(self):
+        fp = BytesIO()
+        assert_that(export_contained_storage(self.storage, fp), is_(9))
+        lines = _read_lines(fp.getvalue())
+        assert_that([(x['ContainerId'], x['ID']) for x in lines],
+                    is_([(u'a', u'1'), (u'a', u'2'), (u'a', u'3'),
+                         (u'b', u'1'), (u'b', u'2'), (u'b', u'3'),
+                         (u'list', u'0'), (u'list', u'1'), (u'list', u'2')]))
+
+    def test_export_persistent(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        conn.root()['storage'] = self.storage
+        transaction.commit()
+        fp = BytesIO()
+        exporter = ContainedStorageExporter(self.storage, fp,
+                                            checkpoint_interval=4)
+        assert_that(exporter.export(), is_(9))
+        conn.close()
+        db.close()
+
+    def test_compressed(self):
+        fp = BytesIO()
+        export_contained_storage(self.storage, fp, compress=True)
+        data = gzip.GzipFile(fileobj=BytesIO(fp.getvalue())).read()
+        assert_that(_read_lines(data), has_length(9))
+
+    def test_checkpoint_and_resume(self):
+        path = os.path.join(self.tmpdir, 'checkpoint.json')
+        assert_that(load_checkpoint(path), is_(none()))
+
+        fp = BytesIO()
+        exporter = ContainedStorageExporter(self.storage, fp,
+                                            checkpoint_path=path,
+                                            checkpoint_interval=4)
+        exporter.export()
+        checkpoint = load_checkpoint(path)
+        assert_that(checkpoint, has_entry('count', 9))
+        assert_that(checkpoint, has_entry('containerId', u'list'))
+        assert_that(checkpoint, has_entry('offset', len(fp.getvalue())))
+
+        # Resume from the middle of a mapping and a list container
+        for checkpoint, expected in (({'containerId': u'b', 'key': u'1', 'count': 4}, 5),
+                                     ({'containerId': u'list', 'key': 0, 'count': 7}, 2)):
+            fp = BytesIO()
+            exporter = ContainedStorageExporter(self.storage, fp)
+            assert_that(exporter.export(checkpoint), is_(checkpoint['count'] + expected))
+            assert_that(_read_lines(fp.getvalue()), has_length(expected))
+
+    def _interrupted(self, compress):
+        # An export that fails after the fifth object, between
+        # checkpoints...
+        data = os.path.join(self.tmpdir, 'data')
+        path = os.path.join(self.tmpdir, 'checkpoint.json')
+        failing = FailingContained(u'b', u'21')
+        self.storage.addContainedObject(failing)
+        with open(data, 'wb') as fp:
+            exporter = ContainedStorageExporter(self.storage, fp,
+                                                compress=compress,
+                                                checkpoint_path=path,
+                                                checkpoint_interval=4)
+            with self.assertRaises(ValueError):
+                exporter.export()
+        checkpoint = load_checkpoint(path)
+        assert_that(checkpoint, has_entry('count', 5))
+        # ...and then, as if killed, writes more after its checkpoint
+        with open(data, 'ab') as fp:
+            fp.write(b'{"partial": ')
+
+        failing.fail = False
+        with open(data, 'r+b') as fp:
+            exporter = ContainedStorageExporter(self.storage, fp,
+                                                compress=compress)
+            assert_that(exporter.export(checkpoint), is_(10))
+        with open(data, 'rb') as fp:
+            return fp.read()
+
+    def test_resume_after_failure(self):
+        lines = _read_lines(self._interrupted(False))
+        assert_that([(x['ContainerId'], x['ID']) for x in lines[4:7]],
+                    is_([(u'b', u'2'), (u'b', u'21'), (u'b', u'3')]))
+        assert_that(lines, has_length(10))
+
+    def test_resume_compressed(self):
+        data = gzip.GzipFile(fileobj=BytesIO(self._interrupted(True))).read()
+        assert_that(_read_lines(data), has_length(10))
+
+    def test_not_seekable(self):
+        path = os.path.join(self.tmpdir, 'checkpoint.json')
+        exporter = ContainedStorageExporter(self.storage, NotSeekable(),
+                                            checkpoint_path=path)
+        exporter.export()
+        assert_that(load_checkpoint(path), has_entry('offset', none()))
+        # Outside of an export, just saves
+        exporter.checkpoint()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import has_entries
+from hamcrest import assert_that
+from hamcrest import greater_than
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+from io import StringIO
+
+import transaction
+
+from BTrees.OOBTree import OOBTree
+
+from persistent.mapping import PersistentMapping
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.utils import u64
+
+from nti.containers.containers import CheckingLastModifiedBTreeContainer
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.footprint import _Sizes
+from nti.datastructures.footprint import _values
+from nti.datastructures.footprint import _btree_stats
+from nti.datastructures.footprint import main
+from nti.datastructures.footprint import write_footprint
+from nti.datastructures.footprint import storage_footprint
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SamplePersistentContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+def _obj(containerId, child=None):
+    obj = SamplePersistentContained()
+    obj.containerId = containerId
+    if child is not None:
+        obj.child = child
+    return obj
+
+
+class TestFootprint(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'Data.fs')
+        db = DB(FileStorage(self.path))
+        conn = db.open()
+        root = conn.root()
+
+        storage = root['storage'] = ContainedStorage(
+            containers={u'list': PersistentExternalizableList()})
+        storage.addContainer(u'big', CheckingLastModifiedBTreeContainer())
+        for _ in range(100):
+            storage.addContainedObject(_obj(u'big'))
+        grandchild = PersistentMapping()
+        child = PersistentMapping(grandchild=grandchild)
+        storage.addContainedObject(_obj(u'small', child))
+        storage.addContainedObject(_obj(u'small'))
+        storage.addContainedObject(_obj(u'list'))
+
+        weak = root['weak'] = ContainedStorage(weak=True)
+        objects = root['objects'] = PersistentMapping()
+        for name in (u'a', u'b'):
+            objects[name] = _obj(u'weak')
+            weak.addContainedObject(objects[name])
+        transaction.commit()
+        del objects[u'b']
+        transaction.commit()
+        db.pack()
+
+        self.oid = u64(storage._p_oid)
+        self.weak_oid = u64(weak._p_oid)
+        conn.close()
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _footprints(self, *oids, **kwargs):
+        fp = BytesIO()
+        count = write_footprint(self.path, oids or (self.oid,), fp, **kwargs)
+        lines = fp.getvalue().decode('utf-8').splitlines()
+        assert_that(len(lines), is_(count))
+        return dict((d['containerId'], d) for d in (json.loads(l) for l in lines))
+
+    def test_footprint(self):
+        footprints = self._footprints()
+        assert_that(sorted(footprints), is_([u'big', u'list', u'small']))
+
+        big = footprints[u'big']
+        assert_that(big, has_entries(count=100, strong_refs=100, weak_refs=0,
+                                     dangling_refs=0, inline_values=0,
+                                     storage=self.oid,
+                                     type='CheckingLastModifiedBTreeContainer'))
+        assert_that(big['btree'], has_entries(depth=2))
+        assert_that(big['btree']['buckets'], is_(greater_than(1)))
+        assert_that(big['btree']['fill'], is_(greater_than(0)))
+        # The container, tree, buckets, length, and objects
+        assert_that(big['persistent_objects'],
+                    is_(103 + big['btree']['buckets']))
+        sizes = big['object_bytes']
+        assert_that(sizes['total'], is_(greater_than(sizes['max'] * 99)))
+        assert_that(sizes['p50'], is_(sizes['p99']))
+        assert_that(big['container_bytes'], is_(greater_than(0)))
+
+        small = footprints[u'small']
+        assert_that(small, has_entries(count=2, strong_refs=2,
+                                       type='SmallLastModifiedBTreeContainer'))
+        assert_that(small['btree'], is_(none()))
+        # The container, two objects, and the child and grandchild
+        assert_that(small['persistent_objects'], is_(5))
+        assert_that(small['object_bytes']['max'],
+                    is_(greater_than(small['object_bytes']['p50'])))
+
+        small = self._footprints(max_depth=1)[u'small']
+        assert_that(small['persistent_objects'], is_(4))
+
+        lst = footprints[u'list']
+        assert_that(lst, has_entries(count=1, strong_refs=1, btree=none(),
+                                     persistent_objects=2))
+
+    def test_weak_and_sample(self):
+        footprints = self._footprints(self.weak_oid)
+        assert_that(footprints[u'weak'],
+                    has_entries(count=2, weak_refs=2, dangling_refs=1,
+                                strong_refs=0, persistent_objects=2))
+        assert_that(footprints[u'weak']['object_bytes']['p50'],
+                    is_(greater_than(0)))
+
+        footprints = self._footprints(self.oid, self.weak_oid, sample=1, seed=1)
+        assert_that(len(set(d['storage'] for d in footprints.values())), is_(1))
+
+    def test_empty_and_inline(self):
+        db = DB(FileStorage(self.path))
+        conn = db.open()
+        storage = ContainedStorage(containers={u'list': PersistentExternalizableList()})
+        conn.root()['other'] = storage
+        storage.addContainer(u'empty', CheckingLastModifiedBTreeContainer())
+        storage.getContainer(u'list').append(u'not persistent')
+        transaction.commit()
+        footprints = dict((d['containerId'], d) for d in storage_footprint(storage))
+        assert_that(footprints[u'empty']['btree'],
+                    is_({'depth': 0, 'buckets': 0, 'fill': 0.0}))
+        assert_that(footprints[u'empty']['object_bytes'],
+                    is_({'total': 0, 'max': 0, 'p50': 0, 'p90': 0, 'p99': 0}))
+        assert_that(footprints[u'list'], has_entries(count=1, inline_values=1))
+        transaction.abort()
+        conn.close()
+        db.close()
+
+    def test_sizes(self):
+        sizes = _Sizes(10, random.Random(0))
+        for size in range(1000):
+            sizes.add(size)
+        assert_that(sizes.sample, is_(has_length(10)))
+        assert_that(sizes.summary(), has_entries(total=499500, max=999))
+
+    def test_btree_stats(self):
+        structure = []
+        tree = OOBTree(dict((i, i) for i in range(10)))
+        assert_that(_btree_stats(tree, structure),
+                    is_({'depth': 1, 'buckets': 1, 'fill': 0.3333}))
+        assert_that(structure, is_([]))
+
+        tree = OOBTree(dict((i, i) for i in range(20000)))
+        stats = _btree_stats(tree, structure)
+        assert_that(stats['depth'], is_(3))
+        assert_that(structure, has_length(greater_than(stats['buckets'])))
+
+        assert_that(list(_values({'a': 1})), is_([1]))
+
+    def test_main(self):
+        out = BytesIO()
+
+        class Stdout(object):
+            buffer = out
+        old_stdout, old_stdin = sys.stdout, sys.stdin
+        sys.stdout = Stdout()
+        sys.stdin = StringIO(u'%s\n\n' % hex(self.oid))
+        try:
+            main([self.path, '--max-depth', '1'])
+        finally:
+            sys.stdout, sys.stdin = old_stdout, old_stdin
+        assert_that(out.getvalue().decode('utf-8').splitlines(), has_length(3))
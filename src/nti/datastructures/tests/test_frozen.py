@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import is_not
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import has_property
+from hamcrest import same_instance
+
+import gc
+import time
+import unittest
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.frozen import FrozenContainer
+from nti.datastructures.frozen import StaleFrozenContainerError
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SampleContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+class TestFrozenContainer(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _add(self, storage, containerId=u'foo'):
+        obj = SampleContained()
+        obj.containerId = containerId
+        return storage.addContainedObject(obj)
+
+    def test_copy_on_write(self):
+        storage = ContainedStorage()
+        assert_that(storage.getFrozenContainer(u'foo'), is_(none()))
+        o1 = self._add(storage)
+        o2 = self._add(storage)
+
+        view = storage.getFrozenContainer(u'foo')
+        assert_that(view, has_property('copied', False))
+        assert_that(view, has_length(2))
+        assert_that(view[o1.id], is_(same_instance(o1)))
+        assert_that(o2.id in view, is_(True))
+        assert_that(sorted(view), is_(sorted([o1.id, o2.id])))
+        assert_that(hash(view), is_(hash((u'foo', view.version))))
+        assert_that(repr(view), is_("<FrozenContainer foo version: %s>" % view.version))
+        # Cached until a change
+        assert_that(storage.getFrozenContainer(u'foo'), is_(same_instance(view)))
+
+        time.sleep(0.01)
+        o3 = self._add(storage)
+        assert_that(view, has_property('copied', True))
+        assert_that(view, has_length(2))
+        assert_that(o3.id in view, is_(False))
+        assert_that(list(view), is_(sorted([o1.id, o2.id])))
+
+        new_view = storage.getFrozenContainer(u'foo')
+        assert_that(new_view, is_not(same_instance(view)))
+        assert_that(new_view, has_length(3))
+        assert_that(new_view, is_not(view))
+        assert_that(new_view == {}, is_(False))
+
+        storage.deleteEqualContainedObject(o1)
+        storage.deleteContainer(u'foo')
+        assert_that(new_view, has_length(3))
+
+    def test_stale(self):
+        storage = ContainedStorage()
+        obj = self._add(storage)
+        view = storage.getFrozenContainer(u'foo')
+        # Changes that don't go through the storage
+        container = storage.getContainer(u'foo')
+        del container[obj.id]
+        container.updateLastMod(container.lastModified + 1)
+        with self.assertRaises(StaleFrozenContainerError):
+            len(view)
+
+    def test_lists_and_weak(self):
+        storage = ContainedStorage(weak=True,
+                                   containers={u'list': PersistentExternalizableList()})
+        objs = [self._add(storage, u'list') for _ in range(2)]
+        view = storage.getFrozenContainer(u'list')
+        assert_that(view, has_property('copied', True))
+        assert_that(view, has_property('version', none()))
+        assert_that(list(view.values()), is_(objs))
+        assert_that(storage.getFrozenContainer(u'list'), is_(view))
+        assert_that(storage.getFrozenContainer(u'list'), is_not(same_instance(view)))
+        view = storage.getFrozenContainer(u'list')
+        objs.append(self._add(storage, u'list'))
+        assert_that(view, has_length(2))
+
+        obj = self._add(storage)
+        view = storage.getFrozenContainer(u'foo')
+        assert_that(view[obj.id], is_(same_instance(obj)))
+        del obj
+        gc.collect()
+        storage.sweepDanglingReferences()
+        storage.cleanBroken()
+        assert_that(list(view.values()), is_([None]))
+
+    def test_equality(self):
+        a = FrozenContainer(u'foo', {}, None)
+        assert_that(a == object(), is_(False))
+        assert_that(a != object(), is_(True))
+        assert_that(a != FrozenContainer(u'foo', {}, None), is_(False))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import same_instance
+
+import unittest
+
+from six.moves import queue
+
+import transaction
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.hooks import ADD
+from nti.datastructures.hooks import GET
+from nti.datastructures.hooks import DELETE
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SampleContained
+
+
+class TestHooks(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        transaction.begin()
+        self.storage = ContainedStorage()
+
+    def tearDown(self):
+        transaction.abort()
+
+    def _add(self):
+        obj = SampleContained()
+        obj.containerId = u'foo'
+        return self.storage.addContainedObject(obj)
+
+    def test_immediate(self):
+        hooks = self.storage.hooks
+        assert_that(self.storage.hooks, is_(same_instance(hooks)))
+        assert_that(bool(hooks), is_(False))
+        first, second, gets = [], [], []
+        hooks.subscribe(ADD, first.append)
+        hooks.subscribe(ADD, second.append)
+        hooks.subscribe(GET, gets.append)
+        obj = self._add()
+        assert_that(first, is_([obj]))
+        assert_that(second, is_([obj]))
+        self.storage.getContainedObject(u'foo', obj.id)
+        assert_that(gets, is_([obj]))
+
+        hooks.unsubscribe(ADD, first.append)
+        self._add()
+        assert_that(first, is_([obj]))
+        assert_that(second, has_length(2))
+
+        with self.assertRaises(KeyError):
+            hooks.unsubscribe(ADD, first.append)
+        with self.assertRaises(ValueError):
+            hooks.subscribe('update', first.append)
+
+    def test_deferred(self):
+        batches = []
+
+        def deferred(event, objects):
+            batches.append((event, objects))
+
+        hooks = self.storage.hooks
+        hooks.subscribe(ADD, deferred, deferred=True)
+        hooks.subscribe(DELETE, deferred, deferred=True)
+        obj1 = self._add()
+        obj2 = self._add()
+        assert_that(batches, is_([]))
+        transaction.commit()
+        assert_that(batches, is_([(ADD, [obj1, obj2])]))
+
+        self.storage.deleteEqualContainedObject(obj1)
+        transaction.abort()
+        assert_that(batches, has_length(1))
+
+        # Adds and deletes in one transaction are delivered separately
+        obj3 = self._add()
+        self.storage.deleteEqualContainedObject(obj2)
+        obj4 = self._add()
+        transaction.commit()
+        assert_that(batches, is_([(ADD, [obj1, obj2]),
+                                  (ADD, [obj3, obj4]),
+                                  (DELETE, [obj2])]))
+
+    def test_queue_and_failures(self):
+        work = queue.Queue()
+        delivered = []
+
+        def broken(unused_event, unused_objects):
+            raise ValueError()
+
+        hooks = self.storage.hooks
+        hooks.subscribe(ADD, broken, deferred=True)
+        hooks.subscribe(ADD, delivered.append, queue=work)
+        obj = self._add()
+        transaction.commit()
+        subscriber, event, objects = work.get_nowait()
+        assert_that(event, is_(ADD))
+        subscriber(objects)
+        assert_that(delivered, is_([[obj]]))
+
+    def test_failed_commit(self):
+        batches = []
+        hooks = self.storage.hooks
+        hooks.subscribe(ADD, batches.append, deferred=True)
+        obj = self._add()
+        hooks._after_commit(False, [(ADD, batches.append, None, obj)])
+        assert_that(batches, is_([]))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import greater_than
+from hamcrest import has_property
+from hamcrest import contains_string
+
+import json
+import unittest
+
+from zope import interface
+
+from zope.component.factory import Factory
+
+from zope.schema.interfaces import SchemaNotProvided
+
+from nti.coremetadata.interfaces import IContained
+from nti.coremetadata.interfaces import IHTC_NEW_FACTORY
+
+from nti.coremetadata.mixins import ZContainedMixin
+
+from nti.datastructures.datastructures import ContainedStorage
+from nti.datastructures.datastructures import AbstractNamedLastModifiedBTreeContainer
+
+from nti.datastructures.importer import ContainedStorageImporter
+from nti.datastructures.importer import import_contained_storage
+
+from nti.datastructures.tests import WithMockDS
+from nti.datastructures.tests import mock_db_trans
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.dublincore.datastructures import PersistentCreatedModDateTrackingObject
+
+
+class IImported(IContained):
+    pass
+
+
+@interface.implementer(IImported)
+class Imported(ZContainedMixin, PersistentCreatedModDateTrackingObject):
+
+    def __init__(self, *unused_args):
+        super(Imported, self).__init__()
+
+
+# pylint: disable=no-value-for-parameter
+IImported.setTaggedValue(IHTC_NEW_FACTORY,
+                         Factory(Imported, interfaces=(IImported,)))
+
+
+class ImportedContainer(AbstractNamedLastModifiedBTreeContainer):
+    container_name = u'imported'
+    contained_type = IImported
+
+
+class SavepointCountingImporter(ContainedStorageImporter):
+
+    def __init__(self, *args, **kwargs):
+        super(SavepointCountingImporter, self).__init__(*args, **kwargs)
+        self.buffered = []
+
+    def _savepoint(self):
+        self.buffered.append(len(self._groups))
+        super(SavepointCountingImporter, self)._savepoint()
+
+
+def _storage():
+    storage = ContainedStorage()
+    storage.addContainer(u'imported', ImportedContainer())
+    return storage
+
+
+class TestImporter(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def test_import_objects(self):
+        storage = _storage()
+        externals = [{'ContainerId': u'imported', 'ID': u'%s' % i}
+                     for i in range(5)]
+        externals.append({'ContainerId': u'imported', 'ID': u'1'})
+        externals.append({'ContainerId': u'other', 'ID': u'1'})
+        externals.append({'ID': u'1'})
+        externals.append([])
+
+        importer = ContainedStorageImporter(storage, group_size=2)
+        result = importer.import_objects(externals)
+        assert_that(result, has_property('count', 5))
+        assert_that(result, has_property('rejected', 4))
+        assert_that([i for i, _ in result.rejects], is_([5, 6, 7, 8]))
+        assert_that(storage.getContainer(u'imported'), has_length(5))
+        assert_that(storage.getContainedObject(u'imported', u'3'),
+                    is_(Imported))
+        assert_that(repr(result), contains_string('count: 5'))
+
+        # Only the first rejects are described
+        importer.max_rejects = 2
+        result = importer.import_objects(externals)
+        assert_that([i for i, _ in result.rejects], is_([0, 1]))
+
+    def test_invalid(self):
+        storage = _storage()
+
+        def invalid(*unused_args, **unused_kwargs):
+            raise SchemaNotProvided(IImported, 'bad')
+        importer = ContainedStorageImporter(storage)
+        importer._create = invalid
+        result = importer.import_objects([{'ContainerId': u'imported'}])
+        assert_that(result, has_property('rejected', 1))
+
+    def test_import_lines(self):
+        storage = _storage()
+        lines = [json.dumps({'ContainerId': u'imported', 'ID': u'a'}),
+                 b'',
+                 b'{not json',
+                 json.dumps({'ContainerId': u'imported', 'ID': u'b'}).encode('utf-8')]
+        result = import_contained_storage(storage, lines)
+        assert_that(result, has_property('count', 2))
+        assert_that(result.rejects, has_length(1))
+        assert_that(result.rejects[0][0], is_(1))
+
+        result = import_contained_storage(storage,
+                                          [{'ContainerId': u'imported', 'ID': u'c'}])
+        assert_that(result, has_property('count', 1))
+
+        result = import_contained_storage(storage, [])
+        assert_that(result, has_property('count', 0))
+        assert_that(result, has_property('rate', 0.0))
+
+    @WithMockDS
+    def test_savepoint_small_groups(self):
+        with mock_db_trans() as conn:
+            storage = _storage()
+            conn.add(storage)
+            for i in range(10):
+                storage.addContainer(u'c%s' % i, ImportedContainer())
+            importer = SavepointCountingImporter(storage,
+                                                 savepoint_interval=4,
+                                                 group_size=100)
+            externals = [{'ContainerId': u'c%s' % i, 'ID': u'x'}
+                         for i in range(10)]
+            result = importer.import_objects(externals)
+            assert_that(result, has_property('count', 10))
+            # The buffered groups are added at each savepoint
+            assert_that(importer.buffered, is_([4, 4]))
+
+    @WithMockDS
+    def test_savepoints(self):
+        with mock_db_trans() as conn:
+            storage = _storage()
+            conn.add(storage)
+            importer = ContainedStorageImporter(storage,
+                                                savepoint_interval=3,
+                                                group_size=1)
+            importer.max_rejects = 0
+            externals = [{'ContainerId': u'imported', 'ID': u'%s' % i}
+                         for i in range(10)]
+            externals.append({})
+            result = importer.import_objects(externals)
+            assert_that(result, has_property('count', 10))
+            assert_that(result, has_property('rejected', 1))
+            assert_that(result.rejects, has_length(0))
+            assert_that(result.rate, greater_than(0))
+            assert_that(storage.getContainedObject(u'imported', u'9'),
+                        has_property('_p_jar', conn))
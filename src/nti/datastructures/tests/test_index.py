@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import is_not
+from hamcrest import none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import has_property
+from hamcrest import same_instance
+from hamcrest import contains_inanyorder
+
+import unittest
+
+from zope import lifecycleevent
+
+from BTrees.OOBTree import OOTreeSet
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.index import SetIndex
+from nti.datastructures.index import FieldIndex
+from nti.datastructures.index import KeywordIndex
+from nti.datastructures.index import union
+from nti.datastructures.index import intersection
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SampleContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+def _is_shared(obj):
+    return getattr(obj, 'sharedWith', None)
+
+
+class TestIndex(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _add(self, storage, containerId, creator, sharedWith=()):
+        obj = SampleContained()
+        obj.containerId = containerId
+        obj.creator = creator
+        obj.sharedWith = sharedWith
+        storage.addContainedObject(obj)
+        return obj
+
+    def test_set_operations(self):
+        a = OOTreeSet([1, 2, 3])
+        b = OOTreeSet([2, 3, 4])
+        assert_that(list(intersection(a, b)), is_([2, 3]))
+        assert_that(list(union(a, b)), is_([1, 2, 3, 4]))
+        assert_that(list(intersection()), is_([]))
+        assert_that(list(union()), is_([]))
+        assert_that(list(intersection(a)), is_([1, 2, 3]))
+        assert_that(intersection(a), is_not(same_instance(a)))
+
+    def test_index_arguments(self):
+        with self.assertRaises(TypeError):
+            FieldIndex()
+        with self.assertRaises(TypeError):
+            FieldIndex('creator', _is_shared)
+        with self.assertRaises(ValueError):
+            KeywordIndex('sharedWith').apply([u'a'], operator='xor')
+
+    def test_maintained_by_storage(self):
+        storage = ContainedStorage(
+            containers={u'list': PersistentExternalizableList()})
+        creator = storage.addIndex('creator', FieldIndex('creator'))
+        shared = storage.addIndex('sharedWith', KeywordIndex('sharedWith'))
+        is_shared = storage.addIndex('shared', SetIndex(discriminator=_is_shared))
+        assert_that(storage.getIndex('creator'), is_(same_instance(creator)))
+        assert_that(creator, has_property('complete', True))
+
+        o1 = self._add(storage, u'foo', u'alice', (u'bob', u'carl'))
+        o2 = self._add(storage, u'foo', u'bob', (u'alice',))
+        o3 = self._add(storage, u'bar', u'alice')
+        self._add(storage, u'list', u'alice', (u'bob',))
+
+        def found(docids):
+            return list(storage.findContainedObjects(docids))
+
+        assert_that(found(creator.apply(u'alice')),
+                    contains_inanyorder(o1, o3))
+        assert_that(found(creator.applyRange(u'b')), is_([o2]))
+        assert_that(found(shared.apply([u'bob', u'alice'])),
+                    contains_inanyorder(o1, o2))
+        assert_that(found(shared.apply([u'bob', u'carl'], operator='and')),
+                    is_([o1]))
+        assert_that(found(is_shared.apply()), contains_inanyorder(o1, o2))
+        # "Everything alice shared with bob"
+        assert_that(found(intersection(creator.apply(u'alice'),
+                                       shared.apply([u'bob']))),
+                    is_([o1]))
+        assert_that(list(creator.values()), is_([u'alice', u'bob']))
+        # Results belong to the caller
+        creator.apply(u'alice').clear()
+        is_shared.apply().clear()
+        shared.apply([u'bob'], operator='and').clear()
+        assert_that(found(creator.apply(u'alice')), contains_inanyorder(o1, o3))
+        assert_that(found(is_shared.apply()), contains_inanyorder(o1, o2))
+        assert_that(found(shared.apply([u'bob'])), is_([o1]))
+        assert_that(creator.documentValues((u'bar', o3.id)), is_((u'alice',)))
+
+        # Modification
+        o1.sharedWith = ()
+        lifecycleevent.modified(o1)
+        assert_that(found(is_shared.apply()), is_([o2]))
+        assert_that(found(shared.apply([u'bob'])), is_([]))
+        assert_that(creator, has_length(3))
+        # Objects we don't hold are ignored
+        stranger = SampleContained()
+        stranger.containerId = u'foo'
+        stranger.id = o1.id
+        stranger.creator = u'mallory'
+        storage.containedObjectModified(stranger)
+        assert_that(creator.documentValues((u'foo', o1.id)), is_((u'alice',)))
+
+        # Deletion
+        storage.deleteEqualContainedObject(o2)
+        assert_that(found(creator.apply(u'bob')), is_([]))
+        assert_that(is_shared, has_length(0))
+        storage.deleteContainer(u'bar')
+        assert_that(found(creator.apply(u'alice')), is_([o1]))
+
+        assert_that(storage.removeIndex('shared'), is_(same_instance(is_shared)))
+        assert_that(storage.getIndex('shared'), is_(none()))
+
+    def test_rebuild(self):
+        storage = ContainedStorage(
+            containers={u'list': PersistentExternalizableList()})
+        storage.containedObjectModified(None)
+        assert_that(storage.getIndex('creator'), is_(none()))
+        with self.assertRaises(KeyError):
+            storage.removeIndex('creator')
+
+        objs = [self._add(storage, cid, u'alice')
+                for cid in (u'foo', u'bar') for _ in range(3)]
+        self._add(storage, u'list', u'alice')
+        index = storage.addIndex('creator', FieldIndex('creator'))
+        assert_that(index, has_property('complete', False))
+        assert_that(index, has_length(0))
+        index.unindex_doc((u'foo', u'missing'))
+
+        cursor = None
+        batches = 0
+        while True:
+            cursor = storage.rebuildIndex('creator', batch_size=4, cursor=cursor)
+            batches += 1
+            if cursor is None:
+                break
+        assert_that(batches, is_(2))
+        assert_that(index, has_property('complete', True))
+        assert_that(list(storage.findContainedObjects(index.apply(u'alice'))),
+                    contains_inanyorder(*objs))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import not_none
+from hamcrest import has_length
+from hamcrest import assert_that
+from hamcrest import greater_than
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from io import StringIO
+
+import transaction
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.utils import p64
+from ZODB.utils import u64
+
+from nti.containers.containers import CheckingLastModifiedBTreeContainer
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.keyindex import KeyIndex
+from nti.datastructures.keyindex import main
+from nti.datastructures.keyindex import build_index
+from nti.datastructures.keyindex import write_index
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SamplePersistentContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+def _obj(containerId, name):
+    obj = SamplePersistentContained()
+    obj.containerId = containerId
+    obj.id = name
+    return obj
+
+
+class TestKeyIndex(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'Data.fs')
+        self.path = os.path.join(self.tmpdir, 'keys.idx')
+        db = DB(FileStorage(self.db_path))
+        conn = db.open()
+        root = conn.root()
+
+        storage = root['storage'] = ContainedStorage(
+            containers={u'list': PersistentExternalizableList()})
+        storage.addContainer(u'big', CheckingLastModifiedBTreeContainer())
+        self.oids = {}
+        for i in range(100):
+            obj = storage.addContainedObject(_obj(u'big', u'k%03d' % i))
+            self.oids[u'k%03d' % i] = obj
+        cafe = storage.addContainedObject(_obj(u'small', u'caf\xe9'))
+        storage.addContainedObject(_obj(u'list', u'ignored'))
+
+        weak = root['weak'] = ContainedStorage(weak=True)
+        root['target'] = target = _obj(u'small', u'target')
+        weak.addContainedObject(target)
+        transaction.commit()
+        self.oids = dict((k, v._p_oid) for k, v in self.oids.items())
+        self.cafe_oid = cafe._p_oid
+        self.target_oid = target._p_oid
+        self.oid = u64(storage._p_oid)
+        self.weak_oid = u64(weak._p_oid)
+        conn.close()
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _modify(self, func):
+        db = DB(FileStorage(self.db_path))
+        conn = db.open()
+        try:
+            func(conn.root())
+            transaction.commit()
+        finally:
+            conn.close()
+            db.close()
+
+    def test_lookup(self):
+        exported = build_index(self.db_path, [self.weak_oid, self.oid], self.path)
+        assert_that(exported, is_(2))
+        with KeyIndex(self.path) as index:
+            assert_that(index, has_length(102))
+            assert_that(list(index.storages()),
+                        is_([p64(self.oid), p64(self.weak_oid)]))
+            for key, oid in self.oids.items():
+                assert_that(index.lookup(self.oid, u'big', key), is_(oid))
+            assert_that(index.lookup(self.oid, u'small', u'caf\xe9'),
+                        is_(self.cafe_oid))
+            assert_that(index.lookup(self.weak_oid, u'small', b'target'),
+                        is_(self.target_oid))
+            for storage, containerId, key in ((self.oid, u'big', u'k100'),
+                                              (self.oid, u'big', u'a'),
+                                              (self.oid, u'list', u'0'),
+                                              (self.oid, u'nope', u'k000'),
+                                              (self.weak_oid, u'big', u'k000'),
+                                              (0, u'big', u'k000'),
+                                              (2 ** 40, u'big', u'k000')):
+                assert_that(index.lookup(storage, containerId, key), is_(none()))
+            assert_that(index.lookup(0, u'big', u'k000', 42), is_(42))
+
+            items = list(index.items(self.oid))
+            assert_that(items, has_length(101))
+            assert_that(items[0], is_((u'big', u'k000', self.oids[u'k000'])))
+            assert_that(items[-1], is_((u'small', u'caf\xe9', self.cafe_oid)))
+            assert_that(list(index.items(self.oid, u'big')), is_(items[:100]))
+            assert_that(list(index.items(self.oid, u'bi')), is_([]))
+            assert_that(list(index.items(0)), is_([]))
+            assert_that(index.lastModified(self.oid), is_(greater_than(0)))
+            assert_that(index.lastModified(0), is_(none()))
+
+    def test_refresh(self):
+        build_index(self.db_path, [self.oid, self.weak_oid], self.path)
+        index = KeyIndex(self.path)
+        assert_that(index.reload(), is_(False))
+        # Nothing changed
+        assert_that(build_index(self.db_path, [], self.path, refresh=True),
+                    is_(0))
+
+        def add(root):
+            root['storage'].addContainedObject(_obj(u'big', u'new'))
+            root['weak'].deleteContainer(u'small')
+        self._modify(add)
+        # Deleting a container isn't noticed unless forced
+        assert_that(build_index(self.db_path, [], self.path, refresh=True),
+                    is_(1))
+        assert_that(index.reload(), is_(True))
+        assert_that(index.lookup(self.oid, u'big', u'new'), is_(not_none()))
+        assert_that(index.lookup(self.oid, u'big', u'k000'),
+                    is_(self.oids[u'k000']))
+        assert_that(index.lookup(self.weak_oid, u'small', u'target'),
+                    is_(self.target_oid))
+        assert_that(build_index(self.db_path, [self.weak_oid], self.path,
+                                refresh=True, force=[self.weak_oid]),
+                    is_(1))
+        index.reload()
+        assert_that(list(index.storages()), has_length(1))
+        assert_that(index.lookup(self.weak_oid, u'small', u'target'), is_(none()))
+        index.close()
+
+    def test_errors(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 64)
+        with self.assertRaises(ValueError):
+            KeyIndex(self.path)
+
+        # The temporary file is removed on failure
+        os.mkdir(os.path.join(self.tmpdir, 'dir'))
+        os.mkdir(os.path.join(self.tmpdir, 'dir', 'index'))
+        with self.assertRaises(OSError):
+            write_index(os.path.join(self.tmpdir, 'dir', 'index'), {})
+        assert_that(os.listdir(os.path.join(self.tmpdir, 'dir')),
+                    is_([u'index']))
+
+    def test_main(self):
+        old_stdin = sys.stdin
+        sys.stdin = StringIO(u'%s\n\n' % hex(self.oid))
+        try:
+            main([self.db_path, self.path])
+        finally:
+            sys.stdin = old_stdin
+        main([self.db_path, self.path, '--refresh', '--force', hex(self.oid)])
+        with KeyIndex(self.path) as index:
+            assert_that(index, has_length(101))
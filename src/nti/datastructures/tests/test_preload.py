@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import assert_that
+from hamcrest import has_property
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import transaction
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.utils import u64
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.preload import ContainedStoragePreloader
+from nti.datastructures.preload import recently_modified_storages
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SamplePersistentContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+class TestPreload(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'Data.fs')
+        db = DB(FileStorage(self.path))
+        conn = db.open()
+        self.oids = []
+        for name in ('a', 'b', 'c'):
+            storage = ContainedStorage(
+                containers={u'list': PersistentExternalizableList()})
+            conn.root()[name] = storage
+            for cid in (u'foo', u'bar', u'list'):
+                for _ in range(3):
+                    obj = SamplePersistentContained()
+                    obj.containerId = cid
+                    storage.addContainedObject(obj)
+            transaction.commit()
+            self.oids.append(storage._p_oid)
+        self.before_last = time.time()
+        time.sleep(0.01)
+        conn.root()['b'].updateLastMod()
+        transaction.commit()
+        conn.close()
+        db.close()
+        self.db = DB(FileStorage(self.path))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_recently_modified(self):
+        storage = self.db.storage
+        assert_that(recently_modified_storages(storage, 0),
+                    is_([self.oids[1], self.oids[2], self.oids[0]]))
+        assert_that(recently_modified_storages(storage, self.before_last),
+                    is_([self.oids[1]]))
+
+    def test_preload(self):
+        preloader = ContainedStoragePreloader(self.db,
+                                              [u64(self.oids[0])] + self.oids[1:],
+                                              entries=2, threads=2)
+        preloader.start()
+        assert_that(preloader.join(), is_(True))
+        assert_that(preloader, has_property('storages_loaded', 3))
+        # 3 containers and 2 entries from each of them, per storage
+        assert_that(preloader, has_property('objects_loaded', 27))
+        assert_that(preloader, has_property('cancelled', False))
+
+    def test_budget_and_cancel(self):
+        preloader = ContainedStoragePreloader(self.db, self.oids,
+                                              threads=1, memory_budget=1)
+        preloader.start()
+        preloader.join()
+        assert_that(preloader, has_property('cancelled', True))
+        assert_that(preloader, has_property('storages_loaded', 0))
+
+        preloader = ContainedStoragePreloader(self.db, self.oids)
+        preloader.cancel()
+        preloader.start()
+        preloader.join()
+        assert_that(preloader, has_property('storages_loaded', 0))
+
+    def test_errors_are_logged(self):
+        preloader = ContainedStoragePreloader(self.db, [b'\xff' * 8], threads=1)
+        preloader.start()
+        preloader.join()
+        assert_that(preloader, has_property('storages_loaded', 0))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import assert_that
+
+import unittest
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.index import FieldIndex
+
+from nti.datastructures.recent import most_recent
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SampleContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+class CountingList(list):
+
+    iterations = 0
+
+    def __iter__(self):
+        self.iterations += 1
+        return list.__iter__(self)
+
+
+class TestMostRecent(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _storage(self, times, index=False, weak=False):
+        storage = ContainedStorage(weak=weak)
+        if index:
+            storage.addIndex('lastModified', FieldIndex('lastModified'))
+        for containerId, lastModified in times:
+            obj = SampleContained()
+            obj.containerId = containerId
+            storage.addContainedObject(obj)
+            obj.lastModified = lastModified
+            storage.containedObjectModified(obj)
+            storage.getContainer(containerId).lastModified = max(
+                lastModified, storage.getContainer(containerId).lastModified)
+            self.objects.append(obj)
+        return storage
+
+    def setUp(self):
+        self.objects = []
+
+    def test_merge(self):
+        s1 = self._storage([(u'foo', 1), (u'foo', 5), (u'bar', 3)])
+        s2 = self._storage([(u'foo', 4), (u'bar', 6), (u'foo', 2)],
+                           index=True, weak=True)
+        # An incomplete index is ignored
+        s3 = self._storage([(u'foo', 7)])
+        s3.addIndex('lastModified', FieldIndex('lastModified'))
+        empty = self._storage([], index=True)
+
+        def times(*args, **kwargs):
+            return [o.lastModified for o in most_recent(*args, **kwargs)]
+
+        sources = [s1, s2, s3, empty]
+        assert_that(times(sources), is_([7, 6, 5, 4, 3, 2, 1]))
+        assert_that(times(sources, k=3), is_([7, 6, 5]))
+        assert_that(times(sources, containerId=u'foo'), is_([7, 5, 4, 2, 1]))
+        assert_that(times([s1], containerId=u'baz'), is_([]))
+
+    def test_reads_only_what_is_needed(self):
+        old = CountingList()
+        old.lastModified = 1
+        new = CountingList()
+        new.lastModified = 10
+        for lastModified, container in ((1, old), (9, new), (10, new)):
+            obj = SampleContained()
+            obj.lastModified = lastModified
+            container.append(obj)
+        untracked = PersistentExternalizableList()
+
+        result = most_recent([old, new, untracked], k=2)
+        assert_that([o.lastModified for o in result], is_([10, 9]))
+        assert_that(new.iterations, is_(1))
+        assert_that(old.iterations, is_(0))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import assert_that
+
+import os
+import shutil
+import operator
+import tempfile
+import unittest
+
+import transaction
+
+from ZODB.DB import DB
+
+from ZODB.FileStorage import FileStorage
+
+from ZODB.utils import u64
+
+from persistent.mapping import PersistentMapping
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures import scan
+
+from nti.datastructures.scan import _init_worker
+from nti.datastructures.scan import _scan_containers
+from nti.datastructures.scan import parallel_scan
+from nti.datastructures.scan import partition_keys
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_datastructures import SamplePersistentContained
+
+
+def _count(unused_containerId, container):
+    return len(container)
+
+
+def _name(containerId, unused_container):
+    return containerId
+
+
+class TestScan(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'Data.fs')
+        db = DB(FileStorage(self.path))
+        conn = db.open()
+        storage = ContainedStorage()
+        conn.root()['storage'] = storage
+        for i in range(7):
+            for _ in range(i + 1):
+                obj = SamplePersistentContained()
+                obj.containerId = u'c%s' % i
+                storage.addContainedObject(obj)
+        transaction.commit()
+        self.oid = storage._p_oid
+        conn.close()
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_partition_keys(self):
+        assert_that(partition_keys([], 3), is_([]))
+        assert_that(partition_keys('abcde', 2),
+                    is_([['a', 'b', 'c'], ['d', 'e']]))
+        assert_that(partition_keys('ab', 5),
+                    is_([['a'], ['b']]))
+
+    def test_parallel_scan(self):
+        total = parallel_scan(self.path, self.oid, _count,
+                              reduce_func=operator.add, initial=0,
+                              processes=2, partitions=3)
+        assert_that(total, is_(28))
+
+        names = parallel_scan(self.path, u64(self.oid), _name, processes=2)
+        assert_that(sorted(names), is_([u'c%s' % i for i in range(7)]))
+
+    def test_dict_containers(self):
+        db = DB(FileStorage(self.path))
+        conn = db.open()
+        storage = ContainedStorage(containersType=PersistentMapping)
+        conn.root()['dict'] = storage
+        for i in range(12):
+            obj = SamplePersistentContained()
+            obj.containerId = u'c%s' % i
+            storage.addContainedObject(obj)
+        transaction.commit()
+        oid = storage._p_oid
+        conn.close()
+        db.close()
+        names = parallel_scan(self.path, oid, _name, processes=2, partitions=5)
+        assert_that(sorted(names), is_(sorted(u'c%s' % i for i in range(12))))
+
+    def test_scan_containers(self):
+        # What each worker process does
+        _init_worker(self.path)
+        try:
+            assert_that(_scan_containers((self.oid, [u'c2', u'c3'], _name, None)),
+                        is_([u'c2', u'c3']))
+            assert_that(_scan_containers((self.oid, [u'c5', u'c6'], _count, operator.add)),
+                        is_([13]))
+            assert_that(_scan_containers((self.oid, [u'd'], _count, operator.add)),
+                        is_([]))
+        finally:
+            scan._worker_db.close()
+            scan._worker_db = None
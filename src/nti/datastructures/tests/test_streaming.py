@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import has_key
+from hamcrest import has_entry
+from hamcrest import has_length
+from hamcrest import assert_that
+
+import json
+import unittest
+
+from io import BytesIO
+
+import transaction
+
+from persistent import Persistent
+
+from ZODB.DB import DB
+
+from ZODB.DemoStorage import DemoStorage
+
+from nti.containers.containers import CheckingLastModifiedBTreeContainer
+
+from nti.datastructures.datastructures import ContainedStorage
+
+from nti.datastructures.streaming import iter_container_json
+from nti.datastructures.streaming import write_container_json
+from nti.datastructures.streaming import iter_container_chunks
+
+from nti.datastructures.tests import SharedConfiguringTestLayer
+
+from nti.datastructures.tests.test_exporter import ExternalContained
+
+from nti.externalization.persistence import PersistentExternalizableList
+
+
+class PersistentExternalContained(Persistent, ExternalContained):
+    pass
+
+
+class TestStreaming(unittest.TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _container(self, count):
+        container = CheckingLastModifiedBTreeContainer()
+        for i in range(count):
+            name = u'%03d' % i
+            container[name] = ExternalContained(u'foo', name)
+        container.lastModified = 42
+        return container
+
+    def test_chunks(self):
+        chunks = list(iter_container_chunks(self._container(5), chunk_size=2))
+        assert_that(chunks, has_length(4))
+        assert_that(chunks[0], has_entry('Last Modified', 42))
+        assert_that(chunks[0], has_key('Class'))
+        assert_that([len(c) for c in chunks[1:]], is_([2, 2, 1]))
+        assert_that(chunks[3], is_([{'ContainerId': u'foo', 'ID': u'004'}]))
+
+    def test_json(self):
+        container = self._container(5)
+        for chunk_size in (1, 2, 5, 10):
+            parts = list(iter_container_json(container, chunk_size=chunk_size))
+            data = json.loads(b''.join(parts).decode('utf-8'))
+            assert_that(data, has_entry('Last Modified', 42))
+            assert_that([i['ID'] for i in data['Items']],
+                        is_([u'000', u'001', u'002', u'003', u'004']))
+
+        fp = BytesIO()
+        count = write_container_json(self._container(0), fp)
+        assert_that(count, is_(len(fp.getvalue())))
+        assert_that(json.loads(fp.getvalue().decode('utf-8')),
+                    has_entry('Items', []))
+
+    def test_lists_and_unwrap(self):
+        container = PersistentExternalizableList()
+        container.append(ExternalContained(u'foo', u'a'))
+        container.append(None)
+        container.append(ExternalContained(u'foo', u'b'))
+        data = b''.join(iter_container_json(container))
+        assert_that([i['ID'] for i in json.loads(data.decode('utf-8'))['Items']],
+                    is_([u'a', u'b']))
+
+    def test_persistent_storage(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        storage = ContainedStorage()
+        conn.root()['storage'] = storage
+        for name in (u'b', u'a', u'c'):
+            storage.addContainedObject(PersistentExternalContained(u'foo', name))
+        transaction.commit()
+        conn.cacheMinimize()
+
+        container = storage.getContainer(u'foo')
+        fp = BytesIO()
+        write_container_json(container, fp, chunk_size=1,
+                             unwrap=storage._v_unwrap)
+        data = json.loads(fp.getvalue().decode('utf-8'))
+        assert_that([i['ID'] for i in data['Items']], is_([u'a', u'b', u'c']))
+        # Items are released as they are written
+        assert_that(container[u'a']._p_changed, is_(None))
+
+        transaction.abort()
+        conn.close()
+        db.close()
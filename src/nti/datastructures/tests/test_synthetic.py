@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import empty
+from hamcrest import assert_that
+
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+from nti.datastructures.synthetic import _syntheticKeys
+from nti.datastructures.synthetic import isSyntheticKey
+
+from nti.externalization.interfaces import StandardExternalFields
+
+#: Modules that importing the light APIs must not import.
+HEAVY_MODULES = (
+    'BTrees',
+    'persistent',
+    'ZODB',
+    'nti.containers',
+    'nti.dublincore',
+    'nti.externalization',
+    'nti.ntiids',
+    'nti.zodb',
+    'nti.datastructures.datastructures',
+)
+
+#: Modules that importing the storage must leave until they are used.
+DEFERRED_MODULES = (
+    'nti.datastructures.hooks',
+    'nti.datastructures.changelog',
+    'nti.datastructures.frozen',
+)
+
+_IMPORT_SCRIPT = """
+import sys, json
+%s
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def _cold_import(statement):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    output = subprocess.check_output([sys.executable, '-c',
+                                      _IMPORT_SCRIPT % statement],
+                                     env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def test_keys_match_externalization(self):
+        assert_that(_syntheticKeys(),
+                    is_((StandardExternalFields.ID,
+                         StandardExternalFields.OID,
+                         StandardExternalFields.CLASS,
+                         StandardExternalFields.CREATOR,
+                         StandardExternalFields.CONTAINER_ID,
+                         StandardExternalFields.LAST_MODIFIED)))
+        assert_that(isSyntheticKey(StandardExternalFields.CREATOR), is_(True))
+        assert_that(isSyntheticKey(u'title'), is_(False))
+
+    def test_light_import(self):
+        light = _cold_import('import nti.datastructures.synthetic\n'
+                             'import nti.datastructures.interfaces')
+        heavy = [m for m in light
+                 if any(m == h or m.startswith(h + '.') for h in HEAVY_MODULES)]
+        assert_that(heavy, is_(empty()))
+
+    def test_deferred_import(self):
+        modules = _cold_import('import nti.datastructures.datastructures')
+        assert_that([m for m in DEFERRED_MODULES if m in modules],
+                    is_(empty()))
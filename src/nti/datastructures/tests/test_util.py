@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+# pylint: disable=protected-access,too-many-public-methods,arguments-differ
+
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import assert_that
+
+import unittest
+
+import transaction
+
+from ZODB.DB import DB
+
+from ZODB.DemoStorage import DemoStorage
+
+from ZODB.utils import p64
+
+from persistent.mapping import PersistentMapping
+
+from nti.datastructures._util import as_oid
+from nti.datastructures._util import deactivate
+
+
+class TestUtil(unittest.TestCase):
+
+    def test_as_oid(self):
+        assert_that(as_oid(42), is_(p64(42)))
+        assert_that(as_oid(p64(42)), is_(p64(42)))
+
+    def test_deactivate(self):
+        db = DB(DemoStorage())
+        conn = db.open()
+        saved = conn.root()['saved'] = PersistentMapping()
+        transaction.commit()
+        unsaved = PersistentMapping()
+        deactivate(unsaved)
+        assert_that(unsaved._p_changed, is_(False))
+
+        saved['a'] = 1
+        deactivate(saved)
+        assert_that(saved._p_changed, is_(True))
+
+        transaction.commit()
+        deactivate(saved)
+        assert_that(saved._p_changed, is_(none()))
+        conn.close()
+        db.close()